@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Ansible dynamic inventory built from terraform/vms.json.
+
+VM groups (``vm_groups``) are expanded with the same allocator Terraform
+uses, so generated workstations show up here without editing hosts.ini.
+Hosts are placed in the playbook groups (dc, windows, linux, infra,
+thehive) from their roles (see cyberlab_model.vm_roles), and every VM tag
+also becomes a group. VMs without a static cloud-init address fall back to
+the IP Terraform recorded in terraform.tfstate. When the controller
+artifact cache (cyberlab_artifacts.py) or APT proxy (cyberlab_apt_proxy.py)
+is enabled, its URL is exported as a group var of ``all``.
+
+The generated JSON is cached in .cyberlab/ keyed on the mtimes and sizes of
+the source files, so repeated ansible-playbook runs skip parsing entirely.
+
+Usage:
+    ansible-playbook -i inventory/cyberlab_inventory.py playbooks/<playbook>.yml
+    ./cyberlab_inventory.py --list
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, REPO_DIR)
+
+from cyberlab_common import CYBERLAB_DIR, TERRAFORM_DIR, UI_CONFIG_FILE, VMS_JSON, ensure_cyberlab_dir, read_ui_config  # noqa: E402
+
+TFSTATE = os.path.join(TERRAFORM_DIR, "terraform.tfstate")
+CACHE_FILE = os.path.join(CYBERLAB_DIR, "inventory_cache.json")
+
+# Playbook group for each role; workstations and plain members go to
+# windows/linux by OS. The router is not managed by Ansible.
+ROLE_GROUPS = {
+    "dc": "dc",
+    "siem": "infra",
+    "fleet": "infra",
+    "xdr": "infra",
+    "soc": "thehive",
+}
+GROUP_CHILDREN = {"linux": ["infra", "thehive"]}
+
+
+def group_name(tag: str) -> str:
+    return re.sub(r"[^a-z0-9_]", "_", tag.strip().lower())
+
+
+def source_files() -> list[str]:
+    return [
+        VMS_JSON,
+        TFSTATE,
+        UI_CONFIG_FILE,
+        os.path.abspath(__file__),
+        os.path.join(REPO_DIR, "cyberlab_model.py"),
+    ]
+
+
+def sources_key(paths: list[str]) -> list:
+    key = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            key.append([path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            key.append([path, None, None])
+    return key
+
+
+def tfstate_ips(state_path: str = TFSTATE) -> dict[str, str]:
+    """VM name -> default_ipv4_address reported by the Proxmox provider."""
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    ips = {}
+    for resource in state.get("resources", []):
+        if resource.get("type") != "proxmox_vm_qemu":
+            continue
+        for instance in resource.get("instances", []):
+            attrs = instance.get("attributes") or {}
+            if attrs.get("name") and attrs.get("default_ipv4_address"):
+                ips[attrs["name"]] = attrs["default_ipv4_address"]
+    return ips
+
+
+def host_group(vm) -> str | None:
+    roles = vm.roles
+    if "router" in roles:
+        return None
+    for role in roles:
+        if role in ROLE_GROUPS:
+            return ROLE_GROUPS[role]
+    return "windows" if vm.is_windows else "linux"
+
+
+def controller_vars() -> dict:
+    """Group vars for ``all`` pointing the roles at enabled controller caches."""
+    from cyberlab_apt_proxy import apt_proxy_url
+    from cyberlab_artifacts import artifact_cache_url
+
+    config = read_ui_config()
+    candidates = {
+        "artifact_cache_url": artifact_cache_url(config),
+        "apt_proxy_url": apt_proxy_url(config),
+    }
+    return {name: value for name, value in candidates.items() if value}
+
+
+def build_inventory(vms_path: str = VMS_JSON, state_path: str = TFSTATE) -> dict:
+    from cyberlab_model import load_vms
+
+    inventory: dict = {"_meta": {"hostvars": {}}}
+    all_vars = controller_vars()
+    if all_vars:
+        inventory["all"] = {"vars": all_vars}
+    for group, children in GROUP_CHILDREN.items():
+        inventory[group] = {"hosts": [], "children": list(children)}
+    state_ips = None
+
+    for vm in load_vms(vms_path):
+        ip = vm.primary_ip if vm.primary_ip != "dhcp" else ""
+        if not ip:
+            if state_ips is None:
+                state_ips = tfstate_ips(state_path)
+            ip = state_ips.get(vm.name, "")
+        if not ip:
+            continue
+        group = host_group(vm)
+        if group is None:
+            continue
+        inventory["_meta"]["hostvars"][vm.name] = {"ansible_host": ip}
+        inventory.setdefault(group, {"hosts": []})["hosts"].append(vm.name)
+        for tag in vm.tags:
+            tag_group = group_name(tag)
+            if tag_group != group:
+                inventory.setdefault(tag_group, {"hosts": []})["hosts"].append(vm.name)
+    return inventory
+
+
+def cached_inventory() -> dict:
+    """build_inventory(), reusing .cyberlab/inventory_cache.json while sources are unchanged."""
+    key = sources_key(source_files())
+    try:
+        with open(CACHE_FILE) as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["inventory"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    inventory = build_inventory()
+    try:
+        ensure_cyberlab_dir()
+        tmp = f"{CACHE_FILE}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"key": key, "inventory": inventory}, f)
+        os.replace(tmp, CACHE_FILE)
+    except OSError:
+        pass
+    return inventory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CyberLab dynamic inventory")
+    parser.add_argument("--list", action="store_true")
+    parser.add_argument("--host")
+    parser.add_argument("--refresh", action="store_true", help="Ignore the cached inventory")
+    args = parser.parse_args()
+
+    try:
+        inventory = build_inventory() if args.refresh else cached_inventory()
+    except (OSError, ValueError) as e:
+        sys.exit(f"cyberlab_inventory: {e}")
+    if args.host:
+        print(json.dumps(inventory["_meta"]["hostvars"].get(args.host, {})))
+    else:
+        print(json.dumps(inventory))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,17 @@
 import json
 import sys
 import os
-import re
+import hashlib
 import logging
+import threading
+import time
 import uuid
+from datetime import datetime, timezone
 from thehive4py.api import TheHiveApi
+from thehive4py.exceptions import TheHiveException
 from thehive4py.models import Alert, AlertArtifact
+from w2thive_format import extract_observables, flatten_alert, md_format
+from w2thive_enrich import Enricher
 #start user config
 # Global vars
 #threshold for wazuh rules level
@@ -20,6 +26,8 @@ info_enabled = True
 # Set paths
 pwd = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 log_file = '{0}/logs/integrations.log'.format(pwd)
+#routing rules and forwarder settings written by the wazuh_thehive_integration role
+config_file = '{0}/etc/w2thive.json'.format(pwd)
 logger = logging.getLogger(__name__)
 #set logging level
 logger.setLevel(logging.WARNING)
@@ -32,6 +40,91 @@ fh = logging.FileHandler(log_file)
 formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 fh.setFormatter(formatter)
 logger.addHandler(fh)
+#routing: first matching route decides; used when w2thive.json has no routes
+default_routes = [
+    {'name': 'suricata', 'groups': ['ids', 'suricata'], 'suricata_severity_max': suricata_lvl_threshold, 'action': 'forward'},
+    {'name': 'suricata-low', 'groups': ['ids', 'suricata'], 'action': 'drop'},
+    {'name': 'level', 'level_min': lvl_threshold, 'action': 'forward'},
+]
+default_action = 'drop'
+route_cache_max = 10000
+class Route:
+    #one compiled routing rule; unset matchers always match
+    __slots__ = ('name', 'forward', 'level_min', 'level_max', 'rule_ids', 'groups', 'agents', 'severity_max')
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.forward = spec.get('action', 'forward') == 'forward'
+        self.level_min = spec.get('level_min')
+        self.level_max = spec.get('level_max')
+        self.rule_ids = frozenset(str(r) for r in spec['rule_ids']) if spec.get('rule_ids') else None
+        self.groups = frozenset(spec['groups']) if spec.get('groups') else None
+        self.agents = frozenset(str(a) for a in spec['agents']) if spec.get('agents') else None
+        self.severity_max = spec.get('suricata_severity_max')
+    def matches(self, rule, agent, severity):
+        level = int(rule.get('level', 0))
+        if self.level_min is not None and level < self.level_min:
+            return False
+        if self.level_max is not None and level > self.level_max:
+            return False
+        if self.rule_ids is not None and str(rule.get('id')) not in self.rule_ids:
+            return False
+        if self.groups is not None and not self.groups.issubset(rule.get('groups', ())):
+            return False
+        if self.agents is not None and agent.get('name') not in self.agents and agent.get('id') not in self.agents:
+            return False
+        if self.severity_max is not None and (severity is None or int(severity) > self.severity_max):
+            return False
+        return True
+def compile_routes(specs):
+    return [Route(spec) for spec in specs]
+def read_config(path=config_file):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+def load_routes(config):
+    return compile_routes(config.get('routes') or default_routes), config.get('default_action', default_action)
+w2thive_config = read_config()
+routes, routes_default_action = load_routes(w2thive_config)
+#alerts with the same rule, agent and key observables inside one window (seconds) share a
+#sourceRef, so TheHive refuses repeats; the forwarder merges them into one alert. 0 disables
+aggregate_window = int(w2thive_config.get('aggregate_window', 60))
+key_observable_types = ('ip', 'hash')
+#w2thive-forwarder spool: alerts run inline (forwarder stopped or spool full) that TheHive
+#does not accept are left in its retry/ directory instead of being lost
+queue_dir = w2thive_config.get('queue_dir', '{0}/queue/w2thive'.format(pwd))
+#answers worth retrying; any other non-201 is final
+retry_statuses = (408, 429)
+#local GeoIP/ASN, lab asset and known-bad enrichment of observables (cached lookups)
+enricher = Enricher.from_config(w2thive_config.get('enrichment', {}))
+for warning in enricher.warnings:
+    logger.warning('enrichment: %s', warning)
+#per-route forwarded/dropped counters (meaningful in the long-lived forwarder)
+route_counters = {}
+route_counters_lock = threading.Lock()
+route_cache = {}
+def route_alert(w_alert):
+    #(route name, forward?) for a raw parsed alert, before any formatting
+    rule = w_alert.get('rule', {})
+    agent = w_alert.get('agent', {})
+    severity = w_alert.get('data', {}).get('alert', {}).get('severity') if isinstance(w_alert.get('data'), dict) else None
+    #level and groups are fixed per wazuh rule id, so this key determines the route
+    key = (rule.get('id'), agent.get('id'), severity)
+    hit = route_cache.get(key)
+    if hit is None:
+        hit = ('default', routes_default_action == 'forward')
+        for route in routes:
+            if route.matches(rule, agent, severity):
+                hit = (route.name, route.forward)
+                break
+        if len(route_cache) >= route_cache_max:
+            route_cache.clear()
+        route_cache[key] = hit
+    with route_counters_lock:
+        counts = route_counters.setdefault(hit[0], [0, 0])
+        counts[0 if hit[1] else 1] += 1
+    return hit
 def main(args):
     logger.debug('#start main')
     logger.debug('#get alert file location')
@@ -43,91 +136,118 @@ def main(args):
     thive_api = TheHiveApi(thive, thive_api_key )
     logger.debug('#open alert file')
     w_alert = json.load(open(alert_file_location))
-    logger.debug('#alert data')
+    alert = build_alert(w_alert)
+    if alert is not None and not send_alert(alert, thive_api):
+        defer_alert(alert)
+def prepare_alert(w_alert):
+    #(flattened entries, observables) for a parsed wazuh alert, or None when routing drops it
+    logger.debug('#routing')
+    route, forward = route_alert(w_alert)
+    if not forward:
+        return None
+    logger.debug('#alert data (route %s)', route)
     logger.debug(str(w_alert))
-    logger.debug('#gen json to dot-key-text')
-    alt = pr(w_alert,'',[])
+    logger.debug('#flatten alert')
+    entries = list(flatten_alert(w_alert))
+    logger.debug('#extract observables')
+    return entries, extract_observables(entries)
+def alert_time(w_alert):
+    #epoch seconds of the wazuh alert timestamp (now if missing or unparsable)
+    try:
+        return datetime.strptime(w_alert['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+    except (KeyError, TypeError, ValueError):
+        return time.time()
+def alert_key(w_alert, observables):
+    #deterministic aggregation key: rule id, agent id and the ip/hash observables
+    key_obs = sorted(data for (data_type, data), field in observables.items()
+                     if data_type in key_observable_types and not field.startswith('agent.'))
+    parts = [str(w_alert.get('rule', {}).get('id')), str(w_alert.get('agent', {}).get('id'))] + key_obs
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+def source_ref(key, timestamp):
+    #sourceRef for the aggregation window containing timestamp (None: aggregation disabled)
+    if aggregate_window <= 0:
+        return None
+    bucket = int(timestamp // aggregate_window)
+    return hashlib.sha1('{0}|{1}'.format(key, bucket).encode()).hexdigest()[:16]
+def build_alert(w_alert):
+    #TheHive Alert for a parsed wazuh alert, or None when routing drops it
+    prepared = prepare_alert(w_alert)
+    if prepared is None:
+        return None
+    entries, observables = prepared
     logger.debug('#formatting description')
-    format_alt = md_format(alt)
-    logger.debug('#search artifacts')
-    artifacts_dict = artifact_detect(format_alt)
-    alert = generate_alert(format_alt, artifacts_dict, w_alert)
-    logger.debug('#threshold filtering')
-    if w_alert['rule']['groups']==['ids','suricata']:
-        #checking the existence of the data.alert.severity field
-        if 'data' in w_alert.keys():
-            if 'alert' in w_alert['data']:
-                #checking the level of the source event
-                if int(w_alert['data']['alert']['severity'])<=suricata_lvl_threshold:
-                    send_alert(alert, thive_api)
-    elif int(w_alert['rule']['level'])>=lvl_threshold:
-        #if the event is different from suricata AND suricata-event-type: alert check lvl_threshold
-        send_alert(alert, thive_api)
-def pr(data,prefix, alt):
-    for key,value in data.items():
-        if hasattr(value,'keys'):
-            pr(value,prefix+'.'+str(key),alt=alt)
-        else:
-            alt.append((prefix+'.'+str(key)+'|||'+str(value)))
-    return alt
-def md_format(alt,format_alt=''):
-    md_title_dict = {}
-    #sorted with first key
-    for now in alt:
-        now = now[1:]
-        #fix first key last symbol
-        dot = now.split('|||')[0].find('.')
-        if dot==-1:
-            md_title_dict[now.split('|||')[0]] =[now]
-        else:
-            if now[0:dot] in md_title_dict.keys():
-                (md_title_dict[now[0:dot]]).append(now)
-            else:
-                md_title_dict[now[0:dot]]=[now]
-    for now in md_title_dict.keys():
-        format_alt+='### '+now.capitalize()+'\n'+'| key | val |\n| ------ | ------ |\n'
-        for let in md_title_dict[now]:
-            key,val = let.split('|||')[0],let.split('|||')[1]
-            format_alt+='| **' + key + '** | ' + val + ' |\n'
-    return format_alt
-def artifact_detect(format_alt):
-    artifacts_dict = {}
-    artifacts_dict['ip'] = re.findall(r'\d+\.\d+\.\d+\.\d+',format_alt)
-    artifacts_dict['url'] =  re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',format_alt)
-    artifacts_dict['domain'] = []
-    for now in artifacts_dict['url']: artifacts_dict['domain'].append(now.split('//')[1].split('/')[0])
-    return artifacts_dict
-def generate_alert(format_alt, artifacts_dict,w_alert):
+    ref = source_ref(alert_key(w_alert, observables), alert_time(w_alert))
+    return generate_alert(md_format(entries), observables, w_alert, ref)
+def generate_alert(format_alt, observables, w_alert, sourceRef=None, count=1, first_seen=None, last_seen=None):
     #generate alert sourceRef
-    sourceRef = str(uuid.uuid4())[0:6]
+    if sourceRef is None:
+        sourceRef = str(uuid.uuid4())[0:6]
     artifacts = []
     if 'agent' in w_alert.keys():
         if 'ip' not in w_alert['agent'].keys():
             w_alert['agent']['ip']='no agent ip'
     else:
         w_alert['agent'] = {'id':'no agent id', 'name':'no agent name'}
-    for key,value in artifacts_dict.items():
-        for val in value:
-            artifacts.append(AlertArtifact(dataType=key, data=val))
+    #one artifact per distinct (dataType, value); the message names the source field
+    enrich_tags = []
+    for (data_type, data), field in observables.items():
+        info = enricher.lookup(data_type, data) if enricher.enabled else None
+        if info is None:
+            artifacts.append(AlertArtifact(dataType=data_type, data=data, message=field))
+            continue
+        artifacts.append(AlertArtifact(dataType=data_type, data=data, message=field+' ('+info.note+')',
+                                       tags=list(info.tags), ioc=info.ioc))
+        for tag in info.tags:
+            if tag not in enrich_tags:
+                enrich_tags.append(tag)
+    tags=['wazuh', 
+        'rule='+w_alert['rule']['id'], 
+        'agent_name='+w_alert['agent']['name'],
+        'agent_id='+w_alert['agent']['id'],
+        'agent_ip='+w_alert['agent']['ip'],]
+    tags += enrich_tags
+    if count > 1:
+        #aggregated storm: one alert for count occurrences
+        tags.append('count='+str(count))
+        format_alt = '**{0} occurrences** between {1} and {2}\n\n{3}'.format(
+            count, fmt_time(first_seen), fmt_time(last_seen), format_alt)
     alert = Alert(title=w_alert['rule']['description'],
             tlp=2,
-            tags=['wazuh', 
-            'rule='+w_alert['rule']['id'], 
-            'agent_name='+w_alert['agent']['name'],
-            'agent_id='+w_alert['agent']['id'],
-            'agent_ip='+w_alert['agent']['ip'],],
+            tags=tags,
             description=format_alt ,
             type='wazuh_alert',
             source='wazuh',
             sourceRef=sourceRef,
             artifacts=artifacts,)
     return alert
+def fmt_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
 def send_alert(alert, thive_api):
-    response = thive_api.create_alert(alert)
+    #False when the alert should be retried (TheHive unreachable, 408/429 or 5xx)
+    try:
+        response = thive_api.create_alert(alert)
+    except TheHiveException as e:
+        logger.error('TheHive unreachable: {}'.format(e))
+        return False
     if response.status_code == 201:
         logger.info('Create TheHive alert: '+ str(response.json()['id']))
-    else:
-        logger.error('Error create TheHive alert: {}/{}'.format(response.status_code, response.text))
+        return True
+    logger.error('Error create TheHive alert: {}/{}'.format(response.status_code, response.text))
+    return response.status_code not in retry_statuses and response.status_code < 500
+def defer_alert(alert):
+    #hand an unsent alert to the forwarder's retry/ (same record as its own deferrals)
+    if not os.path.isdir(os.path.join(queue_dir, 'new')):
+        logger.error('TheHive alert {} not sent: w2thive-forwarder is disabled, nothing will retry it'.format(alert.sourceRef))
+        return
+    ref = alert.sourceRef if aggregate_window > 0 else None
+    name = '{0}.{1}'.format(time.time_ns(), ref or os.getpid())
+    tmp = os.path.join(queue_dir, 'tmp', name)
+    with open(tmp, 'w') as f:
+        json.dump({'ref': ref, 'attempts': 1, 'alert': alert.jsonify(excludes=['id'])}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(queue_dir, 'retry', name))
+    logger.warning('TheHive alert {} deferred to the w2thive-forwarder retry queue'.format(alert.sourceRef))
 if __name__ == "__main__":
     try:
         logger.debug('debug mode') # if debug enabled       
@@ -0,0 +1,797 @@
+#!/var/ossec/framework/python/bin/python3
+"""Long-lived Wazuh -> TheHive forwarder.
+
+integratord runs the custom-w2thive wrapper once per alert; the wrapper only
+links the alert file into the spool (``<queue_dir>/new``) and exits. This
+service claims spooled files into ``cur/``, and a pool of worker threads
+turns them into TheHive alerts with custom-w2thive.py (routing, markdown
+description, artifacts) and posts them over one keep-alive
+requests.Session, so the interpreter, thehive4py and the TCP/TLS
+connections to TheHive are set up once instead of per alert.
+
+With ``"ingest": "tail"`` integratord is not involved at all: the
+forwarder follows ``alerts_file`` (alerts.json) itself, reading appended
+lines in chunks and handing them to the workers in batches. Its position
+is checkpointed as inode + offset in ``<queue_dir>/tail.json`` (the oldest
+line whose alert is not sent, deferred or dropped yet), so a restart
+resumes there; rotation and truncation are followed once the old file
+has been read to its end.
+
+Alert storms are aggregated: forwarded alerts with the same rule, agent
+and key observables (IPs, hashes) inside one ``aggregate_window`` are held
+until the window closes and sent as a single TheHive alert carrying the
+occurrence count and the merged observables. A window closes a short
+grace after its end, or after it was opened if that is later, so a
+backlog read long after the fact still merges its alerts. Once TheHive
+has answered for it, the window's sourceRef is recorded in a persistent
+LRU (``<queue_dir>/sent_refs.json``). An alert whose window was already
+closed (sent, being sent, or deferred to ``retry/``; also alerts replayed
+from the spool after a restart) arrived too late to be merged: it is
+counted as "suppressed" and not posted, since TheHive would reject a
+second alert with the same sourceRef. Spool files of pending alerts stay in ``cur/`` until their
+aggregate is sent or deferred.
+
+Delivery never loses an alert to a TheHive outage: when a post fails with
+a connection error, a timeout, 408/429 or a 5xx, the rendered alert is
+written (fsynced) to ``<queue_dir>/retry`` and the forwarder backs off
+exponentially (``retry_base`` .. ``retry_max_delay`` seconds, jittered)
+before probing TheHive again; meanwhile new alerts are deferred straight
+to ``retry/`` without a post. Other 4xx answers (bad payload, duplicate
+sourceRef) are final. Once the spool holds more than ``spool_max_mb``
+the forwarder applies backpressure instead of dropping anything: it stops
+claiming ``new/`` and tailing alerts.json, and raises ``<queue_dir>/full``
+so the custom-w2thive wrapper runs custom-w2thive.py inline (which leaves
+alerts it cannot send in ``retry/``). The spool can therefore outgrow
+``spool_max_mb`` during a long outage; its depth is logged with the
+periodic stats.
+
+Counters, queue depth and TheHive latency quantiles are served in the
+Prometheus text format on ``http://<metrics_host>:<metrics_port>/metrics``
+(read by cyberlab_w2thive.py and the dashboard on the controller).
+
+Settings come from /var/ossec/etc/w2thive.json (written by the
+wazuh_thehive_integration role).
+"""
+import importlib.util
+import json
+import logging
+import os
+import queue
+import random
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CONFIG_FILE = os.environ.get("W2THIVE_CONFIG", "/var/ossec/etc/w2thive.json")
+DEFAULTS = {
+    "thehive_url": "",
+    "api_key": "",
+    "queue_dir": "/var/ossec/queue/w2thive",
+    "integration": "/var/ossec/integrations/custom-w2thive.py",
+    "workers": 4,
+    "poll_interval": 0.2,
+    "timeout": 10,
+    "verify_tls": True,
+    "stats_interval": 300,
+    "sent_refs_max": 10000,
+    "retry_base": 1.0,
+    "retry_max_delay": 300,
+    "spool_max_mb": 512,
+    "ingest": "spool",
+    "alerts_file": "/var/ossec/logs/alerts/alerts.json",
+    "metrics_host": "127.0.0.1",
+    "metrics_port": 9787,
+}
+# Wait this long after a window closes for alerts still in the spool.
+AGGREGATE_GRACE = 2.0
+SENT_REFS_SAVE_INTERVAL = 1.0
+SPOOL_CHECK_INTERVAL = 5.0
+SPOOL_DIRS = ("new", "cur", "retry")
+# Present while the spool is over spool_max_mb: the wrapper then runs alerts inline.
+SPOOL_FULL_FLAG = "full"
+TAIL_CHUNK = 1 << 20
+TAIL_BATCH = 256
+# Latency quantiles cover the most recent TheHive requests.
+LATENCY_WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+# Answers worth retrying; any other non-2xx is final.
+RETRY_STATUSES = {408, 429}
+SENT, REJECTED, RETRY = "sent", "rejected", "retry"
+
+# Worker queue items: a deferred alert in retry/, and alerts.json lines as ((inode, offset), line).
+Retry = namedtuple("Retry", "path")
+Batch = namedtuple("Batch", "lines")
+
+logger = logging.getLogger("w2thive-forwarder")
+
+
+def load_config(path=CONFIG_FILE):
+    config = dict(DEFAULTS)
+    with open(path) as f:
+        config.update(json.load(f))
+    if not config["thehive_url"] or not config["api_key"]:
+        raise ValueError(f"{path}: thehive_url and api_key are required")
+    return config
+
+
+def load_integration(path):
+    """Import custom-w2thive.py (hyphenated, so not importable by name)."""
+    spec = importlib.util.spec_from_file_location("custom_w2thive", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Pending:
+    """Forwarded alerts of one aggregation window, not sent yet."""
+
+    __slots__ = ("ref", "w_alert", "entries", "observables", "count", "first_seen", "last_seen", "deadline", "tokens")
+
+    def __init__(self, ref, w_alert, entries, observables, timestamp, deadline):
+        self.ref = ref
+        self.w_alert = w_alert
+        self.entries = entries
+        self.observables = dict(observables)
+        self.count = 0
+        self.first_seen = self.last_seen = timestamp
+        self.deadline = deadline
+        self.tokens = []
+
+    def add(self, observables, timestamp, token):
+        for observable, field in observables.items():
+            self.observables.setdefault(observable, field)
+        self.count += 1
+        self.first_seen = min(self.first_seen, timestamp)
+        self.last_seen = max(self.last_seen, timestamp)
+        self.tokens.append(token)
+
+
+class Tailer:
+    """Complete lines appended to alerts.json, tracked for an inode+offset checkpoint.
+
+    Each line is identified by (inode, offset) and stays outstanding until
+    done() is called for it; the checkpoint is the oldest outstanding line,
+    or the read position when nothing is outstanding.
+    """
+
+    def __init__(self, path, checkpoint_file):
+        self.path = path
+        self.checkpoint_file = checkpoint_file
+        self.file = None
+        self.inode = None
+        self.offset = 0  # file offset of self.buffer, the trailing partial line
+        self.buffer = b""
+        self.outstanding = OrderedDict()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def open(self):
+        """Resume from the checkpoint; without one, start at the end of the file."""
+        try:
+            with open(self.checkpoint_file) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = None
+        if not self.reopen():
+            return
+        size = os.fstat(self.file.fileno()).st_size
+        if saved is None:
+            self.offset = size
+        elif saved["inode"] == self.inode and saved["offset"] <= size:
+            self.offset = saved["offset"]
+        else:
+            logger.warning("%s was rotated while stopped, reading the new file from the start", self.path)
+        self.file.seek(self.offset)
+        logger.info("Tailing %s from offset %d", self.path, self.offset)
+
+    def reopen(self):
+        try:
+            new = open(self.path, "rb")
+        except OSError:
+            return False
+        if self.file is not None:
+            self.file.close()
+        self.file = new
+        self.inode = os.fstat(new.fileno()).st_ino
+        self.offset = 0
+        self.buffer = b""
+        with self.lock:
+            self.dirty = True
+        return True
+
+    def rotated(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False  # between the rename and the new file
+        return st.st_ino != self.inode or st.st_size < self.offset + len(self.buffer)
+
+    def read(self):
+        """[((inode, offset), line)] for the complete lines in the next chunk."""
+        if self.file is None:
+            if not self.reopen():
+                return []
+        chunk = self.file.read(TAIL_CHUNK)
+        if not chunk:
+            if self.rotated():
+                logger.info("%s rotated, reopening", self.path)
+                self.reopen()
+            return []
+        lines = (self.buffer + chunk).split(b"\n")
+        self.buffer = lines.pop()
+        start = self.offset
+        batch = []
+        for line in lines:
+            if line.strip():
+                batch.append(((self.inode, start), line))
+            start += len(line) + 1
+        self.offset = start
+        with self.lock:
+            for token, _ in batch:
+                self.outstanding[token] = None
+            self.dirty = True
+        return batch
+
+    def done(self, token):
+        with self.lock:
+            self.outstanding.pop(token, None)
+            self.dirty = True
+
+    def checkpoint(self):
+        with self.lock:
+            if not self.dirty or self.inode is None:
+                return
+            inode, offset = next(iter(self.outstanding)) if self.outstanding else (self.inode, self.offset)
+            self.dirty = False
+        tmp = f"{self.checkpoint_file}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"inode": inode, "offset": offset}, f)
+            os.replace(tmp, self.checkpoint_file)
+        except OSError:
+            logger.exception("Failed to save %s", self.checkpoint_file)
+
+
+class Forwarder:
+    def __init__(self, config, integration):
+        self.config = config
+        self.integration = integration
+        self.window = integration.aggregate_window
+        self.url = config["thehive_url"].rstrip("/") + "/api/alert"
+        self.new_dir = os.path.join(config["queue_dir"], "new")
+        self.cur_dir = os.path.join(config["queue_dir"], "cur")
+        self.retry_dir = os.path.join(config["queue_dir"], "retry")
+        self.sent_refs_file = os.path.join(config["queue_dir"], "sent_refs.json")
+        self.queue = queue.Queue(maxsize=config["workers"] * 64)
+        self.stopping = threading.Event()
+        self.pending = {}
+        # Refs of closed windows without a final TheHive answer yet: queued, being posted or in retry/.
+        self.in_flight = set()
+        self.sent_refs = OrderedDict()
+        self.sent_refs_dirty = False
+        self.lock = threading.Lock()
+        self.aggregated = self.suppressed = self.deferred = self.dropped = 0
+        self.received = self.failed = 0
+        self.requests = {SENT: 0, REJECTED: 0, RETRY: 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency_sum = 0.0
+        self.started = time.time()
+        self.failures = 0
+        self.retry_at = 0.0
+        self.retrying = set()
+        self.depth = {}
+        self.full = False
+        self.tailer = None
+        if config["ingest"] == "tail":
+            self.tailer = Tailer(config["alerts_file"], os.path.join(config["queue_dir"], "tail.json"))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config["workers"], pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {config['api_key']}",
+            "Content-Type": "application/json",
+        })
+        self.session.verify = config["verify_tls"]
+
+    def send(self, payload):
+        """Post one rendered alert; SENT, REJECTED (final) or RETRY."""
+        start = time.perf_counter()
+        result = self.post(payload)
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.requests[result] += 1
+            if result == REJECTED:
+                self.failed += 1
+            self.latencies.append(elapsed)
+            self.latency_sum += elapsed
+        return result
+
+    def post(self, payload):
+        try:
+            response = self.session.post(self.url, data=payload, timeout=self.config["timeout"])
+        except requests.RequestException as e:
+            logger.warning("TheHive unreachable: %s", e)
+            return RETRY
+        if response.status_code in (200, 201):
+            logger.info("Create TheHive alert: %s", response.json().get("id", "?"))
+            return SENT
+        logger.error("Error create TheHive alert: %s/%s", response.status_code, response.text)
+        if response.status_code in RETRY_STATUSES or response.status_code >= 500:
+            return RETRY
+        return REJECTED
+
+    def deliver(self, payload, ref, attempts=0, retry_path=None):
+        """Send now unless backing off; otherwise (or on failure) keep it in retry/."""
+        if time.monotonic() >= self.retry_at:
+            result = self.send(payload)
+            if result != RETRY:
+                with self.lock:
+                    self.failures = 0
+                # A rejected ref is most likely a duplicate sourceRef: don't try it again either.
+                if ref is not None:
+                    self.remember(ref)
+                if retry_path:
+                    os.remove(retry_path)
+                return
+            self.backoff()
+            attempts += 1
+        elif retry_path:
+            return
+        self.defer(payload, ref, attempts, retry_path)
+
+    def backoff(self):
+        with self.lock:
+            self.failures += 1
+            delay = min(self.config["retry_max_delay"], self.config["retry_base"] * 2 ** (self.failures - 1))
+            delay *= 0.5 + random.random() / 2
+            self.retry_at = max(self.retry_at, time.monotonic() + delay)
+        logger.warning("TheHive delivery failed %d times in a row, retrying in %.1fs", self.failures, delay)
+
+    def defer(self, payload, ref, attempts, path=None):
+        """Durably write a rendered alert to retry/ (replacing path when retrying it)."""
+        if path is None:
+            path = os.path.join(self.retry_dir, f"{time.time_ns()}.{ref or os.getpid()}")
+            with self.lock:
+                self.deferred += 1
+        tmp = os.path.join(self.config["queue_dir"], "tmp", os.path.basename(path))
+        with open(tmp, "w") as f:
+            json.dump({"ref": ref, "attempts": attempts, "alert": payload}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def retry(self, path):
+        try:
+            with open(path) as f:
+                item = json.load(f)
+        except (OSError, ValueError):
+            logger.exception("Dropping unreadable deferred alert %s", os.path.basename(path))
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self.lock:
+                self.dropped += 1
+            return
+        self.deliver(item["alert"], item["ref"], item["attempts"], path)
+
+    def handle(self, path):
+        """Parse and route one spooled alert; True when its file can be removed now."""
+        with open(path) as f:
+            w_alert = json.load(f)
+        return self.process(w_alert, path)
+
+    def count_failure(self):
+        with self.lock:
+            self.failed += 1
+
+    def process(self, w_alert, token):
+        """Route one alert and send or aggregate it; True when token can be released now.
+
+        token is the alert's spool file path or its alerts.json (inode, offset).
+        """
+        with self.lock:
+            self.received += 1
+        prepared = self.integration.prepare_alert(w_alert)
+        if prepared is None:
+            return True
+        entries, observables = prepared
+        timestamp = self.integration.alert_time(w_alert)
+        key = self.integration.alert_key(w_alert, observables)
+        ref = self.integration.source_ref(key, timestamp)
+        if ref is None:
+            record = Pending(None, w_alert, entries, observables, timestamp, 0)
+            record.add({}, timestamp, token)
+            self.emit(record)
+            return False
+        with self.lock:
+            if ref in self.sent_refs or ref in self.in_flight:
+                self.suppressed += 1
+                logger.debug("Suppressed alert for already sent %s", ref)
+                return True
+            record = self.pending.get(ref)
+            if record is None:
+                # Wait for the window's end, but never less than the grace from now: a backlog
+                # (restart, tail catch-up) carries old timestamps and would otherwise close at once.
+                window_end = (timestamp // self.window + 1) * self.window
+                deadline = max(window_end, time.time()) + AGGREGATE_GRACE
+                record = self.pending[ref] = Pending(ref, w_alert, entries, observables, timestamp, deadline)
+            else:
+                self.aggregated += 1
+            record.add(observables, timestamp, token)
+        return False
+
+    def emit(self, record):
+        """Render one (possibly aggregated) alert and deliver it, then release its sources."""
+        try:
+            alert = self.integration.generate_alert(
+                self.integration.md_format(record.entries), record.observables, record.w_alert,
+                record.ref, record.count, record.first_seen, record.last_seen,
+            )
+            self.deliver(alert.jsonify(excludes=["id"]), record.ref)
+        except Exception:
+            # Sources stay unreleased when deferring failed, and are read again on restart.
+            logger.exception("Failed to forward %s (%d alerts)", record.ref or "alert", record.count)
+            self.count_failure()
+            with self.lock:
+                self.in_flight.discard(record.ref)
+            return
+        for token in record.tokens:
+            self.release(token)
+
+    def release(self, token):
+        """Forget a finished alert: remove its spool file or advance the tail checkpoint."""
+        if isinstance(token, str):
+            try:
+                os.remove(token)
+            except OSError:
+                pass
+        else:
+            self.tailer.done(token)
+
+    def remember(self, ref):
+        with self.lock:
+            self.in_flight.discard(ref)
+            self.mark_sent(ref)
+
+    def mark_sent(self, ref):
+        """Add ref to the sent-ref LRU; the caller holds self.lock."""
+        self.sent_refs[ref] = None
+        self.sent_refs.move_to_end(ref)
+        while len(self.sent_refs) > self.config["sent_refs_max"]:
+            self.sent_refs.popitem(last=False)
+        self.sent_refs_dirty = True
+
+    def load_sent_refs(self):
+        # Deferred windows (retry/<ns>.<ref>) are still in flight.
+        for name in os.listdir(self.retry_dir):
+            ref = name.partition(".")[2]
+            if len(ref) == 16:
+                self.in_flight.add(ref)
+        try:
+            with open(self.sent_refs_file) as f:
+                refs = json.load(f)
+        except (OSError, ValueError):
+            return
+        for ref in refs[-self.config["sent_refs_max"]:]:
+            self.sent_refs[ref] = None
+
+    def save_sent_refs(self):
+        with self.lock:
+            if not self.sent_refs_dirty:
+                return
+            refs = list(self.sent_refs)
+            self.sent_refs_dirty = False
+        tmp = f"{self.sent_refs_file}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(refs, f)
+            os.replace(tmp, self.sent_refs_file)
+        except OSError:
+            logger.exception("Failed to save %s", self.sent_refs_file)
+
+    def flush(self):
+        """Queue the aggregates whose window (plus grace) has closed."""
+        now = time.time()
+        with self.lock:
+            due = [ref for ref, record in self.pending.items() if record.deadline <= now]
+            records = [self.pending.pop(ref) for ref in due]
+            # Alerts still arriving for a closed window are suppressed instead of opening a
+            # second aggregate with the same sourceRef; it is persisted only once delivered.
+            self.in_flight.update(due)
+        for record in records:
+            self.queue.put(record)
+
+    def worker(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self.stopping.is_set():
+                    return
+                continue
+            try:
+                if isinstance(item, Pending):
+                    self.emit(item)
+                    continue
+                if isinstance(item, Retry):
+                    try:
+                        self.retry(item.path)
+                    except Exception:
+                        logger.exception("Failed to retry %s", os.path.basename(item.path))
+                    finally:
+                        with self.lock:
+                            self.retrying.discard(item.path)
+                    continue
+                if isinstance(item, Batch):
+                    for token, line in item.lines:
+                        done = True
+                        try:
+                            done = self.process(json.loads(line), token)
+                        except ValueError:
+                            logger.warning("Skipping malformed alert at %s offset %d", self.config["alerts_file"], token[1])
+                            self.count_failure()
+                        except Exception:
+                            logger.exception("Failed to forward alert at offset %d", token[1])
+                            self.count_failure()
+                        if done:
+                            self.release(token)
+                    continue
+                done = True
+                try:
+                    done = self.handle(item)
+                except Exception:
+                    logger.exception("Failed to forward %s", os.path.basename(item))
+                    self.count_failure()
+                if done:
+                    self.release(item)
+            finally:
+                self.queue.task_done()
+
+    def claim(self):
+        """Move new spool files into cur/ (oldest first) and queue them."""
+        try:
+            names = sorted(entry.name for entry in os.scandir(self.new_dir) if entry.is_file())
+        except OSError:
+            return 0
+        for name in names:
+            target = os.path.join(self.cur_dir, name)
+            try:
+                os.rename(os.path.join(self.new_dir, name), target)
+            except OSError:
+                continue
+            self.queue.put(target)
+        return len(names)
+
+    def tail(self):
+        """Queue the alerts.json lines appended since the last read, in batches."""
+        lines = self.tailer.read()
+        for i in range(0, len(lines), TAIL_BATCH):
+            self.queue.put(Batch(lines[i:i + TAIL_BATCH]))
+        return len(lines)
+
+    def requeue(self):
+        """Queue deferred alerts once the backoff expired: one probe while TheHive is failing."""
+        if time.monotonic() < self.retry_at:
+            return
+        with self.lock:
+            if self.retrying:
+                return
+            limit = 1 if self.failures else self.queue.maxsize // 2
+        try:
+            names = sorted(os.listdir(self.retry_dir))[:limit]
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.retry_dir, name)
+            with self.lock:
+                self.retrying.add(path)
+            self.queue.put(Retry(path))
+
+    def check_spool(self):
+        """Measure the spool; over spool_max_mb, stop ingesting and let the wrapper run alerts inline."""
+        depth = {}
+        total = 0
+        for name in SPOOL_DIRS:
+            try:
+                sizes = [entry.stat().st_size for entry in os.scandir(os.path.join(self.config["queue_dir"], name))]
+            except OSError:
+                sizes = []
+            depth[name] = len(sizes)
+            total += sum(sizes)
+        full = total > self.config["spool_max_mb"] << 20
+        flag = os.path.join(self.config["queue_dir"], SPOOL_FULL_FLAG)
+        try:
+            if full:
+                open(flag, "a").close()
+            elif os.path.exists(flag):
+                os.remove(flag)
+        except OSError:
+            logger.exception("Failed to update %s", flag)
+        if full != self.full:
+            if full:
+                logger.error("w2thive spool over %d MiB: pausing ingest, new alerts are sent inline", self.config["spool_max_mb"])
+            else:
+                logger.info("w2thive spool back under %d MiB: resuming ingest", self.config["spool_max_mb"])
+        with self.lock:
+            self.full = full
+            self.depth = dict(depth, pending=len(self.pending), bytes=total)
+
+    def run(self):
+        for name in ("tmp",) + SPOOL_DIRS:
+            os.makedirs(os.path.join(self.config["queue_dir"], name), exist_ok=True)
+        self.load_sent_refs()
+        if self.tailer:
+            self.tailer.open()
+        threads = [threading.Thread(target=self.worker, daemon=True) for _ in range(self.config["workers"])]
+        for thread in threads:
+            thread.start()
+        # Files claimed before a restart were not forwarded yet (or were still being aggregated).
+        # The workers are already draining: cur/ can hold more files than the queue.
+        for name in sorted(os.listdir(self.cur_dir)):
+            self.queue.put(os.path.join(self.cur_dir, name))
+        metrics_server = self.serve_metrics()
+        logger.info("w2thive forwarder started: %d workers, %s ingest, spool %s, aggregate window %ss",
+                    len(threads), self.config["ingest"], self.config["queue_dir"], self.window)
+        next_stats = time.monotonic() + self.config["stats_interval"]
+        next_save = time.monotonic() + SENT_REFS_SAVE_INTERVAL
+        next_check = time.monotonic()
+        while not self.stopping.is_set():
+            if time.monotonic() >= next_check:
+                self.check_spool()
+                next_check = time.monotonic() + SPOOL_CHECK_INTERVAL
+            ingested = 0
+            # Backpressure: what is not claimed waits in new/ or alerts.json.
+            if not self.full:
+                # Spool files are still drained in tail mode (left over from spool mode).
+                ingested = self.claim()
+                if self.tailer:
+                    ingested += self.tail()
+            if not ingested:
+                self.stopping.wait(self.config["poll_interval"])
+            self.flush()
+            self.requeue()
+            if time.monotonic() >= next_save:
+                self.save_sent_refs()
+                if self.tailer:
+                    self.tailer.checkpoint()
+                next_save = time.monotonic() + SENT_REFS_SAVE_INTERVAL
+            if time.monotonic() >= next_stats:
+                self.log_route_stats()
+                next_stats = time.monotonic() + self.config["stats_interval"]
+        # Aggregates still open keep their spool files in cur/ and are rebuilt on restart.
+        for thread in threads:
+            thread.join()
+        self.session.close()
+        if metrics_server:
+            metrics_server.shutdown()
+        self.save_sent_refs()
+        if self.tailer:
+            self.tailer.checkpoint()
+        self.log_route_stats()
+        logger.info("w2thive forwarder stopped")
+
+    def metrics(self):
+        """Prometheus text exposition of the forwarder counters and gauges."""
+        with self.integration.route_counters_lock:
+            routes = {name: list(counts) for name, counts in self.integration.route_counters.items()}
+        with self.lock:
+            counters = {
+                "alerts_received": self.received,
+                "alerts_aggregated": self.aggregated,
+                "alerts_suppressed": self.suppressed,
+                "alerts_forwarded": self.requests[SENT],
+                "alerts_failed": self.failed,
+                "alerts_deferred": self.deferred,
+                "alerts_dropped": self.dropped,
+            }
+            requests_by_result = dict(self.requests)
+            latencies = sorted(self.latencies)
+            latency_sum, latency_count = self.latency_sum, sum(self.requests.values())
+            depth = dict(self.depth, pending=len(self.pending), workers=self.queue.qsize())
+            failures = self.failures
+            full = self.full
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP w2thive_{name} {help_text}")
+            lines.append(f"# TYPE w2thive_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"w2thive_{name}{{{label_text}}} {value}" if label_text else f"w2thive_{name} {value}")
+
+        for name, value in counters.items():
+            metric(f"{name}_total", "counter", name.replace("_", " ").capitalize(), [({}, value)])
+        metric("alerts_routed_total", "counter", "Alerts per route and action (drop = filtered)", [
+            ({"route": route, "action": action}, counts[i])
+            for route, counts in sorted(routes.items()) for i, action in enumerate(("forward", "drop"))
+        ])
+        metric("thehive_requests_total", "counter", "TheHive create-alert requests by result",
+               [({"result": result}, count) for result, count in requests_by_result.items()])
+        quantiles = [
+            ({"quantile": q}, f"{latencies[round(q * (len(latencies) - 1))]:.6f}" if latencies else "NaN")
+            for q in QUANTILES
+        ]
+        metric("thehive_request_seconds", "summary", f"TheHive create-alert latency (last {LATENCY_WINDOW} requests)", quantiles)
+        lines.append(f"w2thive_thehive_request_seconds_sum {latency_sum:.6f}")
+        lines.append(f"w2thive_thehive_request_seconds_count {latency_count}")
+        metric("queue_depth", "gauge", f"Alerts waiting per stage (spool stages sampled every {SPOOL_CHECK_INTERVAL:.0f}s)",
+               [({"stage": stage}, depth.get(stage, 0)) for stage in ("new", "cur", "workers", "pending", "retry")])
+        metric("spool_bytes", "gauge", "Bytes in the spool", [({}, depth.get("bytes", 0))])
+        metric("spool_full", "gauge", "1 while ingest is paused because the spool is over spool_max_mb", [({}, int(full))])
+        metric("thehive_failures_in_row", "gauge", "Consecutive failed TheHive requests (backoff level)", [({}, failures)])
+        metric("start_time_seconds", "gauge", "Forwarder start time", [({}, f"{self.started:.0f}")])
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self):
+        """Serve /metrics from a daemon thread; returns the server (None when disabled)."""
+        if not self.config["metrics_port"]:
+            return None
+        forwarder = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = forwarder.metrics().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            server = ThreadingHTTPServer((self.config["metrics_host"], self.config["metrics_port"]), MetricsHandler)
+        except OSError as e:
+            logger.error("Metrics endpoint disabled: %s", e)
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def log_route_stats(self):
+        with self.integration.route_counters_lock:
+            counters = {name: list(counts) for name, counts in self.integration.route_counters.items()}
+        if counters:
+            summary = ", ".join(f"{name} {fwd} fwd/{drop} drop" for name, (fwd, drop) in sorted(counters.items()))
+            logger.info("w2thive routes: %s", summary)
+        with self.lock:
+            aggregated, suppressed, pending = self.aggregated, self.suppressed, len(self.pending)
+            depth, deferred, dropped = dict(self.depth), self.deferred, self.dropped
+        if aggregated or suppressed or pending:
+            logger.info("w2thive aggregation: %d merged, %d suppressed, %d pending", aggregated, suppressed, pending)
+        if depth:
+            logger.info("w2thive spool: %d new, %d in progress, %d to retry (%.1f MiB); %d deferred, %d dropped",
+                        depth["new"], depth["cur"], depth["retry"], depth["bytes"] / 2**20, deferred, dropped)
+
+
+def main():
+    try:
+        config = load_config()
+        integration = load_integration(config["integration"])
+    except (OSError, ValueError) as e:
+        sys.exit(f"w2thive-forwarder: {e}")
+    # Log next to the per-alert script (logs/integrations.log).
+    for handler in integration.logger.handlers:
+        logger.addHandler(handler)
+    logger.setLevel(integration.logger.level)
+
+    forwarder = Forwarder(config, integration)
+    signal.signal(signal.SIGTERM, lambda *_: forwarder.stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: forwarder.stopping.set())
+    forwarder.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Local enrichment of TheHive observables for custom-w2thive.py.
+
+Every source is a local file, so enriching an alert costs no network
+round-trip:
+
+- GeoIP country and ASN from MaxMind-format ``.mmdb`` databases, opened
+  with maxminddb in MODE_MMAP (the file is mapped, a lookup is a tree
+  walk over pages already in the page cache);
+- lab asset names (inventory ``ansible_host`` -> host name);
+- known-bad lists: text files with one IP, CIDR, domain, URL or hash per
+  line (``#`` comments allowed); the list name is the file name.
+
+Results are cached per (dataType, value) in an LRU. Every source is
+optional: a missing file, or maxminddb not being installed, only disables
+that source and is reported in ``Enricher.warnings``.
+"""
+import functools
+import ipaddress
+import os
+from collections import namedtuple
+
+# tags: for the artifact and the alert; ioc: matched a known-bad list; note: appended to the artifact message
+Enrichment = namedtuple("Enrichment", "tags ioc note")
+
+
+def open_mmdb(path):
+    import maxminddb
+
+    return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+
+def read_indicators(path):
+    """(exact values, networks) from one known-bad list; values are lower-cased."""
+    values, networks = set(), []
+    with open(path) as f:
+        for line in f:
+            entry = line.split("#", 1)[0].strip().lower()
+            if not entry:
+                continue
+            if "/" in entry and "://" not in entry:
+                try:
+                    network = ipaddress.ip_network(entry, strict=False)
+                except ValueError:
+                    values.add(entry)
+                    continue
+                if network.num_addresses == 1:
+                    values.add(str(network.network_address))
+                else:
+                    networks.append(network)
+            else:
+                values.add(entry)
+    return values, networks
+
+
+class Enricher:
+    def __init__(self, geoip_db="", asn_db="", assets=None, known_bad=(), cache_size=4096):
+        self.warnings = []
+        self.geoip = self.open_db(geoip_db)
+        self.asn = self.open_db(asn_db)
+        self.assets = dict(assets or {})
+        # value -> list name, and (network, list name) for CIDR entries
+        self.bad_values = {}
+        self.bad_networks = []
+        for path in known_bad:
+            name = os.path.splitext(os.path.basename(path))[0]
+            try:
+                values, networks = read_indicators(path)
+            except OSError as e:
+                self.warnings.append(f"known-bad list {path}: {e}")
+                continue
+            for value in values:
+                self.bad_values.setdefault(value, name)
+            self.bad_networks += [(network, name) for network in networks]
+        self.lookup = functools.lru_cache(maxsize=cache_size)(self.resolve)
+
+    @classmethod
+    def from_config(cls, config):
+        """Enricher for the ``enrichment`` section of w2thive.json."""
+        return cls(
+            geoip_db=config.get("geoip_db", ""),
+            asn_db=config.get("asn_db", ""),
+            assets=config.get("assets"),
+            known_bad=config.get("known_bad", ()),
+            cache_size=int(config.get("cache_size", 4096)),
+        )
+
+    @property
+    def enabled(self):
+        return bool(self.geoip or self.asn or self.assets or self.bad_values or self.bad_networks)
+
+    def open_db(self, path):
+        if not path:
+            return None
+        try:
+            return open_mmdb(path)
+        except ImportError:
+            self.warnings.append(f"{path}: maxminddb is not installed, lookups disabled")
+        except (OSError, ValueError) as e:
+            self.warnings.append(f"{path}: {e}")
+        return None
+
+    def known_bad(self, value):
+        name = self.bad_values.get(value)
+        if name is None and self.bad_networks:
+            try:
+                address = ipaddress.ip_address(value)
+            except ValueError:
+                return None
+            for network, list_name in self.bad_networks:
+                if address.version == network.version and address in network:
+                    return list_name
+        return name
+
+    def resolve(self, data_type, data):
+        """Enrichment for one observable, or None when no source knows it (use lookup(), it is cached)."""
+        tags, notes = [], []
+        if data_type == "ip":
+            asset = self.assets.get(data)
+            if asset:
+                tags.append("asset=" + asset)
+                notes.append("lab asset " + asset)
+            elif not ipaddress.ip_address(data).is_private:
+                country = self.geoip.get(data) if self.geoip else None
+                iso = ((country or {}).get("country") or (country or {}).get("registered_country") or {}).get("iso_code")
+                if iso:
+                    tags.append("geo=" + iso)
+                    notes.append(iso)
+                record = self.asn.get(data) if self.asn else None
+                if record and record.get("autonomous_system_number"):
+                    number = record["autonomous_system_number"]
+                    tags.append(f"asn=AS{number}")
+                    notes.append(f"AS{number} {record.get('autonomous_system_organization', '')}".rstrip())
+        value = data.lower()
+        list_name = self.known_bad(value)
+        if list_name is None and data_type == "domain":
+            # evil.example listed -> cdn.evil.example matches too
+            labels = value.split(".")
+            parents = (".".join(labels[i:]) for i in range(1, len(labels) - 1))
+            list_name = next((self.bad_values[d] for d in parents if d in self.bad_values), None)
+        if list_name:
+            tags.append("known_bad=" + list_name)
+            notes.append("known bad: " + list_name)
+        if not tags:
+            return None
+        return Enrichment(tuple(tags), list_name is not None, ", ".join(notes))
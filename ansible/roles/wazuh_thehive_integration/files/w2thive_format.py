@@ -0,0 +1,176 @@
+"""Alert flattening, Markdown rendering and observable extraction for custom-w2thive.py.
+
+Kept free of thehive4py so it can be imported (and benchmarked, see
+scripts/bench_w2thive_format.py) on the controller.
+"""
+import ipaddress
+import re
+
+
+def flatten_alert(data):
+    """Yield (section, dotted key, value) for every leaf of a parsed alert, in order.
+
+    The section is the top-level key. Lists of scalars become one
+    comma-separated value; lists containing objects are expanded with the
+    item index in the key (``data.files.0.filename``). Iterative, so each
+    leaf costs one tuple however deep it is nested.
+    """
+    for section, value in data.items():
+        section = str(section)
+        stack = [(section, value)]
+        while stack:
+            path, value = stack.pop()
+            kind = type(value)
+            if kind is dict:
+                stack.extend((f"{path}.{k}", v) for k, v in reversed(list(value.items())))
+            elif kind is list:
+                if any(type(item) in (dict, list) for item in value):
+                    stack.extend((f"{path}.{i}", item) for i, item in reversed(list(enumerate(value))))
+                else:
+                    yield section, path, ", ".join(map(str, value))
+            else:
+                yield section, path, value
+
+
+def md_escape(value):
+    """Make a value safe inside a Markdown table cell."""
+    text = str(value)
+    if "|" in text:
+        text = text.replace("|", "\\|")
+    if "\n" in text or "\r" in text:
+        text = text.replace("\r\n", "<br>").replace("\n", "<br>").replace("\r", "")
+    return text
+
+
+def md_format(entries):
+    """Render (section, key, value) tuples as one Markdown table per section, joined once."""
+    sections = {}
+    for section, key, value in entries:
+        rows = sections.get(section)
+        if rows is None:
+            rows = sections[section] = []
+        rows.append(f"| **{md_escape(key)}** | {md_escape(value)} |\n")
+    parts = []
+    for section, rows in sections.items():
+        parts.append(f"### {section.capitalize()}\n| key | val |\n| ------ | ------ |\n")
+        parts += rows
+    return "".join(parts)
+
+
+# Observables: TheHive dataType by the last component of the field key.
+FIELD_TYPES = {
+    "srcip": "ip", "dstip": "ip", "src_ip": "ip", "dest_ip": "ip", "ip": "ip",
+    "sourceip": "ip", "destinationip": "ip", "ipaddress": "ip",
+    "hostname": "domain", "rrname": "domain", "queryname": "domain",
+    "url": "url", "http_user_agent": "user-agent",
+    "md5": "hash", "sha1": "hash", "sha256": "hash", "md5_after": "hash", "sha1_after": "hash", "sha256_after": "hash",
+    "image": "filename", "parentimage": "filename", "targetfilename": "filename", "imageloaded": "filename",
+    "path": "filename", "file": "filename",
+    "user": "other", "srcuser": "other", "dstuser": "other", "targetusername": "other",
+    "subjectusername": "other", "parentuser": "other",
+}
+# Fields scanned for embedded URLs and IP addresses.
+TEXT_FIELDS = {"commandline", "parentcommandline", "full_log", "message", "scriptblocktext", "payload_printable"}
+# Sections that only describe the rule or the Wazuh pipeline.
+SKIP_SECTIONS = {"rule", "decoder", "predecoder", "manager", "id", "timestamp", "location", "input"}
+SKIP_VALUES = {"", "-", "any", "none", "null", "unknown", "no agent ip"}
+
+HASH_LENGTHS = {32, 40, 64}
+HEX_RE = re.compile(r"^[0-9a-fA-F]+$")
+# Sysmon "Hashes" field: SHA1=...,MD5=...,SHA256=...,IMPHASH=...
+HASHES_RE = re.compile(r"\b(MD5|SHA1|SHA256)=([0-9a-fA-F]{32,64})\b")
+URL_RE = re.compile(r"\bhttps?://[^\s\"'<>|`]+", re.IGNORECASE)
+# Candidates in free text; valid_ip() has the final say. A "v"/"ver"/"version"
+# prefix marks a version number, and the lookarounds reject dotted quads glued
+# to words or longer dotted runs (OIDs, "1.2.3.4.5").
+IPV4_RE = re.compile(r"(?<![\w.])(?P<version>v(?:er(?:sion)?)?[\s:=]*)?(?P<ip>(?:\d{1,3}\.){3}\d{1,3})(?!\w|\.\d)",
+                     re.IGNORECASE)
+IPV6_RE = re.compile(r"(?<![\w:.])(?:[0-9a-f]{0,4}:){2,7}[0-9a-f]{0,4}(?![\w:.])", re.IGNORECASE)
+DOMAIN_RE = re.compile(r"^(?=.{4,253}$)(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\.?$", re.IGNORECASE)
+
+
+def valid_ip(value):
+    """Normalised address, or None for non-addresses and unspecified/loopback ones."""
+    try:
+        address = ipaddress.ip_address(value.strip("[]"))
+    except ValueError:
+        return None
+    if address.is_unspecified or address.is_loopback:
+        return None
+    return str(address)
+
+
+def url_host(url):
+    host = url.split("//", 1)[-1].split("/", 1)[0].split("?", 1)[0].rsplit("@", 1)[-1]
+    if host.startswith("["):
+        return host[1:host.find("]")] if "]" in host else host
+    return host.rsplit(":", 1)[0] if host.count(":") == 1 else host
+
+
+def extract_observables(entries):
+    """Map flattened (section, key, value) fields to deduplicated TheHive observables.
+
+    Returns {(dataType, data): source field}, in first-seen order. Values are
+    validated (ipaddress, hex length, domain syntax) instead of being matched
+    loosely in the rendered text, so timestamps and versions are not IPs.
+    """
+    found = {}
+
+    def add(data_type, data, field):
+        if data_type == "ip":
+            data = valid_ip(data)
+        elif data_type == "domain":
+            data = data.rstrip(".").lower()
+            if valid_ip(data) or not DOMAIN_RE.match(data):
+                data = None
+        elif data_type == "hash":
+            data = data.lower() if len(data) in HASH_LENGTHS and HEX_RE.match(data) else None
+        if data:
+            found.setdefault((data_type, data), field)
+
+    def add_url(url, field):
+        url = url.rstrip(".,;)]}")
+        add("url", url, field)
+        host = url_host(url)
+        add("ip" if valid_ip(host) else "domain", host, field)
+
+    http_host = {}
+    for section, key, value in entries:
+        if section in SKIP_SECTIONS or value is None:
+            continue
+        text = str(value)
+        if text.lower() in SKIP_VALUES:
+            continue
+        name = key.rsplit(".", 1)[-1].lower()
+        if name == "hashes":
+            for _, digest in HASHES_RE.findall(text):
+                add("hash", digest, key)
+            continue
+        data_type = FIELD_TYPES.get(name)
+        if data_type == "url":
+            if "://" in text:
+                add_url(text, key)
+            else:
+                # Suricata http.url is the request path; pair it with http.hostname.
+                http_host.setdefault(key.rsplit(".", 1)[0], []).append((text, key))
+        elif data_type == "domain":
+            add("domain", text, key)
+            http_host.setdefault(key.rsplit(".", 1)[0], []).insert(0, (None, text))
+        elif data_type:
+            add(data_type, text, key)
+        elif name in TEXT_FIELDS or "://" in text:
+            for url in URL_RE.findall(text):
+                add_url(url, key)
+            for match in IPV4_RE.finditer(text):
+                if not match.group("version"):
+                    add("ip", match.group("ip"), key)
+            if ":" in text:
+                for candidate in IPV6_RE.findall(text):
+                    add("ip", candidate, key)
+
+    for pairs in http_host.values():
+        host = next((text for path, text in pairs if path is None), None)
+        for path, key in pairs:
+            if host and path is not None and path.startswith("/"):
+                add("url", f"http://{host}{path}", key)
+    return found
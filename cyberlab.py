@@ -1,12 +1,22 @@
 #!/usr/bin/env python3
+import copy
 import os
 import sys
 import subprocess
 import shutil
-import json
 import yaml
 
-from cyberlab_common import ansible_playbook_cmd
+from cyberlab_common import (
+    DEFAULT_ANSIBLE_INVENTORY,
+    TEMPLATES,
+    ansible_playbook_cmd,
+    invalidate_preflight,
+    run_preflight,
+    validate_vms,
+)
+from cyberlab_galaxy import install_command, mirror_matches
+from cyberlab_model import dump_vms, load_vms, read_vms_data
+from cyberlab_probe import probe_lab
 
 # ANSI Colors
 GREEN = "\033[92m"
@@ -45,15 +55,6 @@ class CyberLabManager:
         elif status == "WARN":
             print(f"[{YELLOW}WARN{RESET}] {message}")
 
-    def check_tool(self, tool_name):
-        path = shutil.which(tool_name)
-        if path:
-            self.print_status(f"Found {tool_name} at {path}", "SUCCESS")
-            return True
-        else:
-            self.print_status(f"{tool_name} is not installed or not in PATH", "ERROR")
-            return False
-
     def check_file(self, filepath, description):
         if os.path.exists(filepath):
             self.print_status(f"Found {description}: {os.path.basename(filepath)}", "SUCCESS")
@@ -124,35 +125,44 @@ class CyberLabManager:
                 search_domain = input("Enter Search Domain (e.g. yourdomain.com): ").strip()
                 ssh_key = self.get_ssh_key()
                 
-                with open(vms_example_path, 'r') as f:
-                    data = json.load(f)
-                
-                # Update cloudinit for all entries
-                # Structure is {"vms": [...]}
-                if isinstance(data, dict) and 'vms' in data and isinstance(data['vms'], list):
-                    for vm in data['vms']:
-                        if 'cloudinit' in vm:
-                            if 'searchdomain' in vm['cloudinit']:
-                                vm['cloudinit']['searchdomain'] = search_domain
-                            if 'sshkeys' in vm['cloudinit']:
-                                vm['cloudinit']['sshkeys'] = ssh_key
-                elif isinstance(data, list):
-                    # Fallback if structure changes
-                     for vm in data:
-                        if 'cloudinit' in vm:
-                            if 'searchdomain' in vm['cloudinit']:
-                                vm['cloudinit']['searchdomain'] = search_domain
-                            if 'sshkeys' in vm['cloudinit']:
-                                vm['cloudinit']['sshkeys'] = ssh_key
-                
-                with open(vms_json_path, 'w') as f:
-                    json.dump(data, f, indent=2)
+                data = read_vms_data(vms_example_path)
+                # Hand-written VMs only: vm_groups stay in data and expand at load time.
+                # The loaded list is shared with load_vms' cache, so edit a copy.
+                vms = copy.deepcopy(load_vms(vms_example_path, expand=False))
+
+                # Update cloudinit for all entries that already carry the field
+                for vm in vms:
+                    if vm.cloudinit:
+                        if vm.cloudinit.searchdomain:
+                            vm.cloudinit.searchdomain = search_domain
+                        if vm.cloudinit.sshkeys:
+                            vm.cloudinit.sshkeys = [ssh_key] if ssh_key else []
+
+                dump_vms(vms_json_path, vms, data, indent=2)
                 
                 self.print_status(f"Created and configured {vms_json_path}", "SUCCESS")
                 
             except Exception as e:
                 self.print_status(f"Failed to create vms.json: {e}", "ERROR")
 
+    def check_vm_conflicts(self):
+        """Validate vms.json before Terraform runs; returns False on conflicts."""
+        vms_json_path = os.path.join(self.terraform_dir, 'vms.json')
+        try:
+            vms = load_vms(vms_json_path)
+        except Exception as e:
+            self.print_status(f"Could not load vms.json: {e}", "ERROR")
+            return False
+
+        conflicts = validate_vms(vms)
+        if not conflicts:
+            self.print_status("vms.json has no VMID/IP/name conflicts", "SUCCESS")
+            return True
+        for name, message in conflicts:
+            self.print_status(f"{name}: {message}", "ERROR")
+        self.print_status(f"Found {len(conflicts)} conflict(s) in vms.json. Fix them before deploying.", "ERROR")
+        return False
+
     def run_command_stream(self, command, cwd, description):
         self.print_status(f"Running: {description}...", "INFO")
         print(f"{CYAN}{'-'*40}{RESET}")
@@ -193,12 +203,7 @@ class CyberLabManager:
             
             # Get template passwords
             print(f"\n{YELLOW}Configure passwords for VM templates:{RESET}")
-            templates = [
-                "ubuntu-server-template",
-                "ubuntu-desktop-template",
-                "win11-template",
-                "win-dc-2022-template"
-            ]
+            templates = TEMPLATES
             
             use_same_password = input("Use the same password for all templates? (y/n): ").lower().strip() == 'y'
             template_passwords = {}
@@ -513,11 +518,16 @@ wazuh_admin_password: {wazuh_admin_password}
         print(f"\n{CYAN}=== Checking Prerequisites ==={RESET}")
         all_checks_passed = True
 
+        report = run_preflight(force=True)
+        self.print_status(f"Preflight: {len(report.checks)} checks in {report.elapsed_ms:.0f} ms", "INFO")
+
         # 1. Check System Tools
         print(f"\n{YELLOW}Checking System Tools:{RESET}")
-        tools = ['terraform', 'ansible', 'ansible-playbook']
-        for tool in tools:
-            if not self.check_tool(tool):
+        for check in report.of_kind("tool"):
+            if check.ok:
+                self.print_status(f"Found {check.name} at {check.detail}", "SUCCESS")
+            else:
+                self.print_status(f"{check.name} is not installed or not in PATH", "ERROR")
                 all_checks_passed = False
 
         # 1.1 Check vms.json
@@ -652,10 +662,17 @@ wazuh_admin_password: {wazuh_admin_password}
         # 5. Ansible Galaxy Requirements
         print(f"\n{YELLOW}Installing Ansible Requirements:{RESET}")
         requirements_path = os.path.join(self.ansible_dir, 'requirements.yml')
+        galaxy = report.get("galaxy")
         if os.path.exists(requirements_path):
-             if not self.run_command_stream("ansible-galaxy install -r requirements.yml", self.ansible_dir, "Ansible Galaxy Install"):
-                 all_checks_passed = False
+            if galaxy.ok:
+                self.print_status(f"Ansible requirements already installed ({galaxy.detail}).", "SUCCESS")
+            else:
+                source = "local mirror" if mirror_matches() else "Ansible Galaxy"
+                if not self.run_command_stream(install_command(), self.ansible_dir, f"Ansible Galaxy Install ({source})"):
+                    all_checks_passed = False
         
+        # Files may have been created above; the menu header re-reads them.
+        invalidate_preflight()
         if all_checks_passed:
             print(f"\n{GREEN}All prerequisites checks passed!{RESET}")
         else:
@@ -672,6 +689,10 @@ wazuh_admin_password: {wazuh_admin_password}
              input("Press Enter to return to menu...")
              return
 
+        if not self.check_vm_conflicts():
+            input("Press Enter to return to menu...")
+            return
+
         # 1. Terraform Plan
         print(f"\n{YELLOW}Running Terraform Plan...{RESET}")
         plan_file = "lab.tfplan"
@@ -700,7 +721,7 @@ wazuh_admin_password: {wazuh_admin_password}
         
         input("\nPress Enter to return to menu...")
 
-    def run_ansible_playbook(self, playbook_name, description, inventory_file="inventory/hosts.ini"):
+    def run_ansible_playbook(self, playbook_name, description, inventory_file=DEFAULT_ANSIBLE_INVENTORY):
         """Helper to run a single playbook."""
         print(f"\n{YELLOW}>> Starting: {description}{RESET}")
         cmd = ansible_playbook_cmd(playbook_name, inventory_file)
@@ -810,6 +831,26 @@ wazuh_admin_password: {wazuh_admin_password}
             else:
                 print("Invalid option.")
 
+    def check_reachability(self):
+        print(f"\n{CYAN}=== Lab Reachability (TCP) ==={RESET}")
+        vms_json_path = os.path.join(self.terraform_dir, 'vms.json')
+        try:
+            results = probe_lab(load_vms(vms_json_path), ttl=0)
+        except (OSError, ValueError) as e:
+            self.print_status(f"Could not load vms.json: {e}", "ERROR")
+            input("\nPress Enter to return to menu...")
+            return
+
+        statuses = {"up": "SUCCESS", "partial": "WARN", "down": "ERROR"}
+        for host in results:
+            ports = ", ".join(
+                f"{p.service}:{p.port} {'open' if p.open else p.error}" for p in host.ports
+            )
+            self.print_status(f"{host.name} ({host.ip}) {host.state} - {ports}", statuses[host.state])
+        up = sum(host.state == "up" for host in results)
+        print(f"\n{up}/{len(results)} hosts fully reachable.")
+        input("\nPress Enter to return to menu...")
+
     def destroy_infra(self):
         print(f"\n{CYAN}=== Destroy Infrastructure (Terraform) ==={RESET}")
         print(f"{RED}WARNING: This will destroy ALL Terraform-managed infrastructure!{RESET}")
@@ -827,18 +868,28 @@ wazuh_admin_password: {wazuh_admin_password}
 
         input("\nPress Enter to return to menu...")
 
+    def print_preflight_summary(self):
+        report = run_preflight()
+        if report.ok:
+            print(f"{GREEN}Prerequisites: all {len(report.checks)} checks passed{RESET}")
+        else:
+            names = ", ".join(c.name for c in report.failed)
+            print(f"{YELLOW}Prerequisites: missing {names}{RESET}")
+
     def menu(self):
         while True:
             # os.system('clear' if os.name == 'posix' else 'cls') # Commented out clear for better scrolling history during dev
             print(f"\n{CYAN}=== CyberLab Infrastructure Manager ==={RESET}")
+            self.print_preflight_summary()
             print("1. Run Prerequisites Checks")
             print("2. Deploy Infrastructure (Terraform)")
             print("3. Configure Software (Ansible)")
             print(f"4. {RED}Destroy Infrastructure (Terraform){RESET}")
-            print("5. Exit")
+            print("5. Check Lab Reachability")
+            print("6. Exit")
             
             try:
-                choice = input(f"\n{YELLOW}Select an option (1-5): {RESET}")
+                choice = input(f"\n{YELLOW}Select an option (1-6): {RESET}")
             except EOFError:
                 break
             
@@ -851,6 +902,8 @@ wazuh_admin_password: {wazuh_admin_password}
             elif choice == '4':
                 self.destroy_infra()
             elif choice == '5':
+                self.check_reachability()
+            elif choice == '6':
                 print("Exiting...")
                 sys.exit(0)
             else:
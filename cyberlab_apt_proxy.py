@@ -0,0 +1,286 @@
+"""Caching APT proxy for the Linux lab hosts.
+
+A small HTTP forward proxy run on the controller. The apt_proxy role points
+apt on every Linux host at it (``Acquire::http::Proxy``), so packages are
+downloaded from the public mirrors once per lab and served from
+.cyberlab/apt-cache on later rebuilds.
+
+Cache policy:
+- ``.deb`` files and ``by-hash`` indexes never change for a given URL and
+  are served from disk without contacting the mirror.
+- Release/Packages/Sources/Translation indexes are revalidated with
+  If-Modified-Since; a stale copy is served when the mirror is unreachable.
+- Anything else is passed through uncached.
+
+Only plain-HTTP repositories go through the proxy; HTTPS sources (Elastic,
+Wazuh, TheHive) keep connecting directly.
+
+It is not an open proxy: it listens on the controller's lab LAN address,
+answers only clients on the lab LAN (and loopback), and only fetches from
+the distribution mirrors in APT_MIRRORS (plus any ``--mirror``).
+
+Usage:
+    python3 cyberlab_apt_proxy.py serve [--host ADDR] [--port 3142] [--mirror HOST ...]
+    python3 cyberlab_apt_proxy.py status
+    python3 cyberlab_apt_proxy.py clear
+"""
+import argparse
+import email.utils
+import ipaddress
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cyberlab_artifacts import controller_lan_address
+from cyberlab_common import CYBERLAB_DIR, get_router_ips, read_ui_config
+
+APT_CACHE_DIR = os.path.join(CYBERLAB_DIR, "apt-cache")
+APT_PROXY_PID_FILE = os.path.join(CYBERLAB_DIR, "apt_proxy.pid")
+APT_PROXY_LOG = os.path.join(CYBERLAB_DIR, "apt_proxy.log")
+APT_PROXY_PORT = 3142
+UPSTREAM_TIMEOUT = 30
+CHUNK_SIZE = 1 << 16
+# Upstream hosts the proxy fetches from; subdomains match too (de.archive.ubuntu.com).
+APT_MIRRORS = (
+    "archive.ubuntu.com",
+    "security.ubuntu.com",
+    "ports.ubuntu.com",
+    "deb.debian.org",
+    "security.debian.org",
+    "ftp.debian.org",
+)
+
+IMMUTABLE_RE = re.compile(r"(\.u?deb|\.ddeb|\.dsc|\.tar\.\w+|/by-hash/\w+/[0-9a-f]+)$")
+INDEX_RE = re.compile(r"/(InRelease|Release(\.gpg)?|(Packages|Sources|Translation-\w+|Contents-\w+|Components-\w+|icons-\w+)(\.\w+)?)$")
+
+_path_locks: dict[str, threading.Lock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def cache_path(url: str) -> str | None:
+    """On-disk location for ``url``, or None if it must not be cached."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme != "http" or parts.query or ".." in parts.path.split("/"):
+        return None
+    if not (IMMUTABLE_RE.search(parts.path) or INDEX_RE.search(parts.path)):
+        return None
+    return os.path.join(APT_CACHE_DIR, parts.hostname or "_", parts.path.lstrip("/"))
+
+
+def mirror_allowed(host: str, mirrors: tuple[str, ...]) -> bool:
+    host = host.lower().rstrip(".")
+    return any(host == mirror or host.endswith("." + mirror) for mirror in mirrors)
+
+
+def lab_networks() -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+    """Networks whose clients may use the proxy: the lab LAN and loopback."""
+    networks = [ipaddress.ip_network("127.0.0.0/8"), ipaddress.ip_network("::1/128")]
+    lan = get_router_ips().get("lan", "")
+    if lan:
+        networks.append(ipaddress.ip_network(lan, strict=False))
+    return networks
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _path_locks_guard:
+        return _path_locks.setdefault(path, threading.Lock())
+
+
+class AptProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        sys.stderr.write(f"{self.address_string()} {fmt % args}\n")
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        url = self.path
+        client = ipaddress.ip_address(self.client_address[0].removeprefix("::ffff:"))
+        if not any(client in network for network in self.server.allowed_clients):
+            self.send_error(403, "Client is not on the lab network")
+            return
+        if not url.startswith("http://"):
+            self.send_error(400, "Only absolute http:// URLs are proxied")
+            return
+        if not mirror_allowed(urllib.parse.urlsplit(url).hostname or "", self.server.mirrors):
+            self.send_error(403, "Only apt mirrors are proxied")
+            return
+        path = cache_path(url)
+        if path is None:
+            self._relay(url, head)
+            return
+        with _lock_for(path):
+            if not os.path.exists(path) or INDEX_RE.search(url):
+                try:
+                    self._refresh(url, path)
+                except (OSError, urllib.error.URLError) as e:
+                    if not os.path.exists(path):
+                        code = e.code if isinstance(e, urllib.error.HTTPError) else 502
+                        self.send_error(code, str(getattr(e, "reason", e)))
+                        return
+        self._send_file(path, head)
+
+    def _refresh(self, url: str, path: str):
+        """Download ``url`` into the cache (conditionally if a copy exists)."""
+        request = urllib.request.Request(url, headers={"User-Agent": "cyberlab-apt-proxy"})
+        if os.path.exists(path):
+            request.add_header("If-Modified-Since", email.utils.formatdate(os.path.getmtime(path), usegmt=True))
+        try:
+            resp = urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return
+            raise
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.part"
+        with resp, open(tmp, "wb") as out:
+            shutil.copyfileobj(resp, out, CHUNK_SIZE)
+        modified = resp.headers.get("Last-Modified")
+        if modified:
+            stamp = email.utils.parsedate_to_datetime(modified).timestamp()
+            os.utime(tmp, (stamp, stamp))
+        os.replace(tmp, path)
+
+    def _send_file(self, path: str, head: bool):
+        size = os.path.getsize(path)
+        self.send_response(200)
+        self.send_header("Content-Length", str(size))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Last-Modified", email.utils.formatdate(os.path.getmtime(path), usegmt=True))
+        self.end_headers()
+        if not head:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _relay(self, url: str, head: bool):
+        request = urllib.request.Request(url, method="HEAD" if head else "GET")
+        try:
+            resp = urllib.request.urlopen(request, timeout=UPSTREAM_TIMEOUT)
+        except urllib.error.HTTPError as e:
+            self.send_error(e.code, e.reason)
+            return
+        except (OSError, urllib.error.URLError) as e:
+            self.send_error(502, str(getattr(e, "reason", e)))
+            return
+        with resp:
+            self.send_response(resp.status)
+            for name in ("Content-Type", "Last-Modified", "ETag"):
+                if resp.headers.get(name):
+                    self.send_header(name, resp.headers[name])
+            length = resp.headers.get("Content-Length")
+            if length is not None:
+                self.send_header("Content-Length", length)
+            elif head:
+                self.send_header("Content-Length", "0")
+            else:
+                # Unknown length: the end of the body is the end of the connection.
+                self.send_header("Connection", "close")
+                self.close_connection = True
+            self.end_headers()
+            if not head:
+                shutil.copyfileobj(resp, self.wfile, CHUNK_SIZE)
+
+
+def serve(host: str = "", port: int = APT_PROXY_PORT, mirrors: tuple[str, ...] = APT_MIRRORS):
+    """Run the proxy on ``host`` (default: the controller's lab LAN address, else loopback)."""
+    os.makedirs(APT_CACHE_DIR, exist_ok=True)
+    with ThreadingHTTPServer((host or controller_lan_address() or "127.0.0.1", port), AptProxyHandler) as httpd:
+        httpd.allowed_clients = lab_networks()
+        httpd.mirrors = tuple(mirror.lower() for mirror in mirrors)
+        httpd.serve_forever()
+
+
+def cache_usage() -> tuple[int, int]:
+    """(file count, total bytes) in the APT cache."""
+    count = size = 0
+    for root, _, files in os.walk(APT_CACHE_DIR):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+                count += 1
+            except OSError:
+                continue
+    return count, size
+
+
+def proxy_pid() -> int | None:
+    """PID of the background proxy if it is running."""
+    try:
+        with open(APT_PROXY_PID_FILE) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def start_proxy(port: int = APT_PROXY_PORT) -> int:
+    pid = proxy_pid()
+    if pid:
+        return pid
+    os.makedirs(CYBERLAB_DIR, exist_ok=True)
+    with open(APT_PROXY_LOG, "a") as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+            stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    with open(APT_PROXY_PID_FILE, "w") as f:
+        f.write(str(proc.pid))
+    return proc.pid
+
+
+def stop_proxy() -> bool:
+    pid = proxy_pid()
+    if not pid:
+        return False
+    os.kill(pid, signal.SIGTERM)
+    try:
+        os.remove(APT_PROXY_PID_FILE)
+    except OSError:
+        pass
+    return True
+
+
+def apt_proxy_url(config: dict | None = None) -> str:
+    """Proxy URL for the Linux hosts, or '' when the proxy is disabled."""
+    cfg = (config if config is not None else read_ui_config()).get("apt_proxy", {})
+    return cfg.get("url", "").rstrip("/") if cfg.get("enabled") else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching APT proxy for the lab")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve_cmd = sub.add_parser("serve", help="Run the proxy (foreground)")
+    serve_cmd.add_argument("--host", default="", help="Listen address (default: the controller's lab LAN address)")
+    serve_cmd.add_argument("--port", type=int, default=APT_PROXY_PORT)
+    serve_cmd.add_argument("--mirror", action="append", default=[], help="Extra upstream host to allow (repeatable)")
+    sub.add_parser("status", help="Show cache usage")
+    sub.add_parser("clear", help="Delete all cached packages")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        host = args.host or controller_lan_address() or "127.0.0.1"
+        print(f"APT proxy on {host}:{args.port}, cache {APT_CACHE_DIR}", flush=True)
+        serve(host, args.port, APT_MIRRORS + tuple(args.mirror))
+    elif args.command == "status":
+        count, size = cache_usage()
+        pid = proxy_pid()
+        print(f"{count} files, {size / 2**20:.1f} MiB in {APT_CACHE_DIR}")
+        print(f"proxy: {'running (pid ' + str(pid) + ')' if pid else 'stopped'}; url: {apt_proxy_url() or 'disabled'}")
+    else:
+        shutil.rmtree(APT_CACHE_DIR, ignore_errors=True)
+        print(f"Cleared {APT_CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""Controller-side artifact cache served to the lab over HTTP.
+
+Agent and server packages the roles download (Elastic Agent, Wazuh agent,
+the Wazuh installer, TheHive, thehive4py, maxminddb) are fetched once per
+version into .cyberlab/artifacts. Blobs are stored by SHA-256 under
+``blobs/`` and linked by file name into ``www/``, next to a
+``<name>.sha256`` sidecar the roles verify against. ``serve`` exposes ``www/`` with a threaded
+http.server; setting the cache URL in the UI makes the dynamic inventory
+pass ``artifact_cache_url`` to the roles, which then download from the
+controller instead of the internet.
+
+Upstream URLs are read from the role defaults, so bumping a version there is
+enough for the next ``sync`` to fetch it.
+
+Usage:
+    python3 cyberlab_artifacts.py sync
+    python3 cyberlab_artifacts.py serve [--host ADDR] [--port 8090]
+    python3 cyberlab_artifacts.py status
+"""
+import argparse
+import functools
+import hashlib
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from cyberlab_common import ANSIBLE_DIR, CYBERLAB_DIR, ensure_cyberlab_dir, get_router_ips, read_ui_config
+
+ARTIFACT_DIR = os.path.join(CYBERLAB_DIR, "artifacts")
+BLOB_DIR = os.path.join(ARTIFACT_DIR, "blobs")
+WWW_DIR = os.path.join(ARTIFACT_DIR, "www")
+PYPI_DIR = os.path.join(WWW_DIR, "pypi")
+INDEX_FILE = os.path.join(ARTIFACT_DIR, "index.json")
+SERVER_PID_FILE = os.path.join(ARTIFACT_DIR, "server.pid")
+SERVER_LOG = os.path.join(ARTIFACT_DIR, "server.log")
+ARTIFACT_PORT = 8090
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_WORKERS = 4
+
+
+@dataclass(frozen=True, slots=True)
+class ArtifactSource:
+    role: str
+    url_var: str
+    checksum_var: str = ""
+    checksum_suffix: str = ""
+    algo: str = "sha256"
+
+
+# Upstream downloads, named by role default variables. A published checksum
+# (a URL variable or a suffix on the artifact URL) is verified on fetch.
+ARTIFACT_SOURCES = [
+    ArtifactSource("elastic_agent_setup", "elastic_agent_linux_upstream_url", checksum_suffix=".sha512", algo="sha512"),
+    ArtifactSource("elastic_agent_setup", "elastic_agent_windows_upstream_url", checksum_suffix=".sha512", algo="sha512"),
+    ArtifactSource("fleet_setup", "fleet_agent_upstream_url", checksum_suffix=".sha512", algo="sha512"),
+    ArtifactSource("wazuh_agent_setup", "wazuh_agent_linux_deb_upstream_url"),
+    ArtifactSource("wazuh_agent_setup", "wazuh_agent_windows_upstream_url"),
+    ArtifactSource("wazuh_server_setup", "wazuh_installer_upstream_url"),
+    ArtifactSource("thehive", "thehive_deb_upstream_url", checksum_var="thehive_sha256_upstream_url"),
+    ArtifactSource("thehive", "thehive_asc_upstream_url"),
+]
+# (role, version variable, PyPI project) mirrored with ``pip download``.
+# Wheels are for Wazuh's embedded Python on the (x86_64, glibc) managers, not
+# for the controller: one download per Python version in the role's
+# wazuh_python_candidates.
+PYPI_PLATFORM = "manylinux_2_28_x86_64"
+PYPI_PYTHON_ROLE = "wazuh_thehive_integration"
+PYPI_SOURCES = [
+    ("wazuh_thehive_integration", "thehive4py_version", "thehive4py"),
+    ("wazuh_thehive_integration", "maxminddb_version", "maxminddb"),
+]
+
+_VAR_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+def role_defaults(role: str) -> dict:
+    import yaml
+
+    path = os.path.join(ANSIBLE_DIR, "roles", role, "defaults", "main.yml")
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def render_default(defaults: dict, name: str) -> str:
+    """Resolve a default, substituting plain ``{{ var }}`` references from the same file."""
+    value = str(defaults[name])
+    for _ in range(5):
+        rendered = _VAR_RE.sub(lambda m: str(defaults.get(m.group(1), m.group(0))), value)
+        if rendered == value:
+            break
+        value = rendered
+    return value
+
+
+def resolve_sources() -> list[tuple[str, str, str, str]]:
+    """(file name, url, checksum url, algo) for every artifact, deduplicated by name."""
+    resolved: dict[str, tuple[str, str, str, str]] = {}
+    defaults_cache: dict[str, dict] = {}
+    for src in ARTIFACT_SOURCES:
+        defaults = defaults_cache.setdefault(src.role, role_defaults(src.role))
+        url = render_default(defaults, src.url_var)
+        checksum_url = ""
+        if src.checksum_var:
+            checksum_url = render_default(defaults, src.checksum_var)
+        elif src.checksum_suffix:
+            checksum_url = url + src.checksum_suffix
+        name = os.path.basename(url)
+        resolved.setdefault(name, (name, url, checksum_url, src.algo))
+    return list(resolved.values())
+
+
+def read_index() -> dict:
+    try:
+        with open(INDEX_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}, "pypi": {}}
+
+
+def write_index(index: dict):
+    tmp = f"{INDEX_FILE}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, INDEX_FILE)
+
+
+def _published_digest(checksum_url: str) -> str:
+    with urllib.request.urlopen(checksum_url, timeout=DOWNLOAD_TIMEOUT) as resp:
+        text = resp.read().decode(errors="replace")
+    return text.split()[0].lower() if text.split() else ""
+
+
+def _publish(name: str, digest: str):
+    """Link blobs/<digest> to www/<name> and write the www/<name>.sha256 sidecar."""
+    blob = os.path.join(BLOB_DIR, digest)
+    target = os.path.join(WWW_DIR, name)
+    tmp = f"{target}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(blob, tmp)
+    except OSError:
+        shutil.copyfile(blob, tmp)
+    os.replace(tmp, target)
+    with open(f"{target}.sha256.tmp", "w") as f:
+        f.write(f"{digest}  {name}\n")
+    os.replace(f"{target}.sha256.tmp", f"{target}.sha256")
+
+
+def fetch_artifact(name: str, url: str, checksum_url: str = "", algo: str = "sha256") -> dict:
+    """Download ``url`` into the blob store, verifying a published checksum if any."""
+    expected = _published_digest(checksum_url) if checksum_url else ""
+    sha256 = hashlib.sha256()
+    verify = hashlib.new(algo)
+    tmp = os.path.join(BLOB_DIR, f".{name}.part")
+    size = 0
+    try:
+        with urllib.request.urlopen(url, timeout=DOWNLOAD_TIMEOUT) as resp, open(tmp, "wb") as out:
+            while chunk := resp.read(1 << 20):
+                out.write(chunk)
+                sha256.update(chunk)
+                verify.update(chunk)
+                size += len(chunk)
+        if expected and verify.hexdigest() != expected:
+            raise ValueError(f"{name}: {algo} mismatch (expected {expected}, got {verify.hexdigest()})")
+        digest = sha256.hexdigest()
+        os.replace(tmp, os.path.join(BLOB_DIR, digest))
+    finally:
+        # Failed, interrupted or mismatched downloads leave nothing behind.
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _publish(name, digest)
+    return {"url": url, "sha256": digest, "size": size, "verified": bool(expected), "fetched_at": int(time.time())}
+
+
+def wazuh_python_versions() -> list[str]:
+    """Python versions ("3.9", ...) named by the role's wazuh_python_candidates."""
+    candidates = role_defaults(PYPI_PYTHON_ROLE).get("wazuh_python_candidates", [])
+    found = {m.group(1) for path in candidates if (m := re.search(r"python(3\.\d+)$", path))}
+    return sorted(found, key=lambda v: tuple(map(int, v.split("."))))
+
+
+def mirror_pypi(project: str, version: str, python_versions: list[str]) -> list[str]:
+    """``pip download`` wheels of a pinned project and its dependencies into www/pypi."""
+    for python_version in python_versions:
+        subprocess.run(
+            [sys.executable, "-m", "pip", "download", "--quiet", "--dest", PYPI_DIR,
+             "--only-binary=:all:", "--platform", PYPI_PLATFORM, "--python-version", python_version,
+             f"{project}=={version}"],
+            check=True,
+        )
+    return sorted(os.listdir(PYPI_DIR))
+
+
+def sync_artifacts(force: bool = False, log=print) -> dict:
+    """Fetch every missing or changed artifact; returns the updated index."""
+    ensure_cyberlab_dir()
+    for path in (BLOB_DIR, WWW_DIR, PYPI_DIR):
+        os.makedirs(path, exist_ok=True)
+    index = read_index()
+    files = index.setdefault("files", {})
+
+    pending = []
+    for name, url, checksum_url, algo in resolve_sources():
+        entry = files.get(name)
+        fresh = (
+            entry
+            and entry.get("url") == url
+            and os.path.exists(os.path.join(BLOB_DIR, entry["sha256"]))
+        )
+        if fresh and not force:
+            if not os.path.exists(os.path.join(WWW_DIR, name)):
+                _publish(name, entry["sha256"])
+            log(f"cached   {name}")
+        else:
+            pending.append((name, url, checksum_url, algo))
+
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+        futures = {pool.submit(fetch_artifact, *args): args[0] for args in pending}
+        for future, name in futures.items():
+            try:
+                files[name] = future.result()
+                log(f"fetched  {name} ({files[name]['size'] // 2**20} MiB)")
+            except (OSError, ValueError) as e:
+                log(f"FAILED   {name}: {e}")
+
+    pypi = index.setdefault("pypi", {})
+    python_versions = wazuh_python_versions()
+    target = {"platform": PYPI_PLATFORM, "python": python_versions}
+    if index.get("pypi_target") != target:
+        pypi.clear()  # mirrored for another interpreter or platform
+    index["pypi_target"] = target
+    for role, version_var, project in PYPI_SOURCES:
+        spec = f"{project}=={render_default(role_defaults(role), version_var)}"
+        if spec in pypi and not force:
+            log(f"cached   {spec}")
+            continue
+        try:
+            pypi[spec] = mirror_pypi(project, spec.split("==", 1)[1], python_versions)
+            log(f"fetched  {spec}")
+        except (OSError, subprocess.CalledProcessError) as e:
+            log(f"FAILED   {spec}: {e}")
+
+    write_index(index)
+    return index
+
+
+def cache_stats(index: dict | None = None) -> tuple[int, int]:
+    """(artifact count, total bytes) recorded in the index."""
+    files = (index or read_index()).get("files", {})
+    return len(files), sum(entry.get("size", 0) for entry in files.values())
+
+
+def serve(host: str = "", port: int = ARTIFACT_PORT):
+    """Serve ``www/`` on ``host``, by default only the controller's lab LAN address."""
+    os.makedirs(WWW_DIR, exist_ok=True)
+    handler = functools.partial(SimpleHTTPRequestHandler, directory=WWW_DIR)
+    with ThreadingHTTPServer((host or controller_lan_address() or "127.0.0.1", port), handler) as httpd:
+        httpd.serve_forever()
+
+
+def server_pid() -> int | None:
+    """PID of the background server if it is running."""
+    try:
+        with open(SERVER_PID_FILE) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+        return pid
+    except (OSError, ValueError):
+        return None
+
+
+def start_server(port: int = ARTIFACT_PORT) -> int:
+    pid = server_pid()
+    if pid:
+        return pid
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    with open(SERVER_LOG, "a") as log:
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "serve", "--port", str(port)],
+            stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+        )
+    with open(SERVER_PID_FILE, "w") as f:
+        f.write(str(proc.pid))
+    return proc.pid
+
+
+def stop_server() -> bool:
+    pid = server_pid()
+    if not pid:
+        return False
+    os.kill(pid, signal.SIGTERM)
+    try:
+        os.remove(SERVER_PID_FILE)
+    except OSError:
+        pass
+    return True
+
+
+def controller_lan_address(router_ips: dict[str, str] | None = None) -> str:
+    """Local address the controller uses to reach the lab LAN (routing lookup, no traffic)."""
+    lan = (router_ips or get_router_ips()).get("lan", "").split("/")[0]
+    if not lan:
+        return ""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect((lan, 9))
+            return s.getsockname()[0]
+        except OSError:
+            return ""
+
+
+def artifact_cache_url(config: dict | None = None) -> str:
+    """Base URL roles should download from, or '' when the cache is disabled."""
+    cfg = (config if config is not None else read_ui_config()).get("artifact_cache", {})
+    return cfg.get("url", "").rstrip("/") if cfg.get("enabled") else ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Controller artifact cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sync = sub.add_parser("sync", help="Download missing artifacts")
+    sync.add_argument("--force", action="store_true", help="Re-download everything")
+    serve_cmd = sub.add_parser("serve", help="Serve the cache over HTTP (foreground)")
+    serve_cmd.add_argument("--host", default="", help="Listen address (default: the controller's lab LAN address)")
+    serve_cmd.add_argument("--port", type=int, default=ARTIFACT_PORT)
+    sub.add_parser("status", help="Show cached artifacts")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        index = sync_artifacts(force=args.force)
+        count, size = cache_stats(index)
+        print(f"{count} artifacts, {size / 2**30:.2f} GiB in {ARTIFACT_DIR}")
+    elif args.command == "serve":
+        host = args.host or controller_lan_address() or "127.0.0.1"
+        print(f"Serving {WWW_DIR} on {host}:{args.port}", flush=True)
+        serve(host, args.port)
+    else:
+        index = read_index()
+        for name, entry in sorted(index.get("files", {}).items()):
+            print(f"{entry['sha256'][:12]}  {entry['size'] // 2**20:>6} MiB  {name}")
+        for spec, files in sorted(index.get("pypi", {}).items()):
+            print(f"{'pypi':<12}  {len(files):>6} files  {spec}")
+        pid = server_pid()
+        print(f"server: {'running (pid ' + str(pid) + ')' if pid else 'stopped'}; url: {artifact_cache_url() or 'disabled'}")
+
+
+if __name__ == "__main__":
+    main()
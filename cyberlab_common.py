@@ -1,8 +1,332 @@
 """Shared helpers for cyberlab.py and cyberlab_ui.py."""
+import ipaddress
+import json
+import os
+import shlex
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 
-DEFAULT_ANSIBLE_INVENTORY = "inventory/hosts.ini"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.join(BASE_DIR, "terraform")
+ANSIBLE_DIR = os.path.join(BASE_DIR, "ansible")
+CYBERLAB_DIR = os.path.join(BASE_DIR, ".cyberlab")
+UI_CONFIG_FILE = os.path.join(CYBERLAB_DIR, "ui_config.json")
+VMS_JSON = os.path.join(TERRAFORM_DIR, "vms.json")
 
+DEFAULT_ANSIBLE_INVENTORY = "inventory/cyberlab_inventory.py"
 
-def ansible_playbook_cmd(playbook_name: str, inventory_file: str = DEFAULT_ANSIBLE_INVENTORY) -> str:
-    """Build the ansible-playbook command used by both CLI and UI."""
-    return f"ansible-playbook -i {inventory_file} playbooks/{playbook_name}"
+# Connection profiles: environment overrides placed in front of
+# ansible-playbook. Pipelining and ControlPersist only change SSH hosts;
+# WinRM hosts ignore them. Compare them with scripts/bench_ansible_profiles.py.
+_PERSIST_SSH_ARGS = "-C -o ControlMaster=auto -o ControlPersist=600s"
+ANSIBLE_PROFILES: dict[str, dict[str, str]] = {
+    "default": {},
+    "pipelining": {"ANSIBLE_PIPELINING": "True"},
+    "pipelining-persist": {"ANSIBLE_PIPELINING": "True", "ANSIBLE_SSH_ARGS": _PERSIST_SSH_ARGS},
+    "pipelining-persist-free": {
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_SSH_ARGS": _PERSIST_SSH_ARGS,
+        "ANSIBLE_STRATEGY": "free",
+    },
+    "pipelining-persist-forks20": {
+        "ANSIBLE_PIPELINING": "True",
+        "ANSIBLE_SSH_ARGS": _PERSIST_SSH_ARGS,
+        "ANSIBLE_FORKS": "20",
+    },
+}
+DEFAULT_ANSIBLE_PROFILE = "default"
+PROFILE_BENCH_FILE = os.path.join(CYBERLAB_DIR, "ansible_profile_bench.json")
+
+TEMPLATES = [
+    "ubuntu-server-template",
+    "ubuntu-desktop-template",
+    "win11-template",
+    "win-dc-2022-template",
+]
+ROUTER_TEMPLATE = "pfsense-template"
+
+
+def ansible_playbook_cmd(
+    playbook_name: str,
+    inventory_file: str = DEFAULT_ANSIBLE_INVENTORY,
+    profile: str | None = None,
+    tuned: bool = True,
+) -> str:
+    """Build the ansible-playbook command used by both CLI and UI.
+
+    ``profile`` defaults to the connection profile saved in the UI config.
+    With ``tuned`` the forks and strategy from cyberlab_tuning are added and
+    echoed first, so every run log starts with the settings it used. The
+    fact cache is synced with terraform.tfstate before the playbook starts.
+    """
+    profile = profile or get_ansible_profile()
+    env = dict(ANSIBLE_PROFILES.get(profile, {}))
+    cmd = f"ansible-playbook -i {inventory_file} playbooks/{playbook_name}"
+    header = ""
+    if tuned:
+        from cyberlab_tuning import tune_playbook
+
+        tuning = tune_playbook(playbook_name, profile)
+        env.pop("ANSIBLE_FORKS", None)
+        env["ANSIBLE_STRATEGY"] = tuning.strategy
+        cmd += f" --forks {tuning.forks}"
+        header = f"echo {shlex.quote(f'# {playbook_name}: profile={profile} {tuning.summary()}')} && "
+    # Drop cached facts of VMs Terraform changed since the last run.
+    header += f"python3 {shlex.quote(os.path.join(BASE_DIR, 'cyberlab_facts.py'))} sync && "
+    prefix = " ".join(f"{key}={shlex.quote(value)}" for key, value in env.items())
+    return f"{header}{prefix} {cmd}" if prefix else f"{header}{cmd}"
+
+
+def ensure_cyberlab_dir():
+    os.makedirs(CYBERLAB_DIR, exist_ok=True)
+
+
+def read_ui_config() -> dict:
+    if not os.path.exists(UI_CONFIG_FILE):
+        return {}
+    try:
+        with open(UI_CONFIG_FILE) as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def write_ui_config(config: dict):
+    ensure_cyberlab_dir()
+    with open(UI_CONFIG_FILE, "w") as f:
+        json.dump(config, f, indent=4)
+
+
+def default_router_ips() -> dict[str, str]:
+    return {"lan": "172.16.10.1/24", "wan": ""}
+
+
+def get_router_ips(config: dict | None = None) -> dict[str, str]:
+    cfg = config if config is not None else read_ui_config()
+    defaults = default_router_ips()
+    stored = cfg.get("router_ips", {})
+    return {
+        "lan": stored.get("lan", defaults["lan"]),
+        "wan": stored.get("wan", defaults["wan"]),
+    }
+
+
+def get_ansible_profile(config: dict | None = None) -> str:
+    cfg = config if config is not None else read_ui_config()
+    profile = cfg.get("ansible_profile", DEFAULT_ANSIBLE_PROFILE)
+    return profile if profile in ANSIBLE_PROFILES else DEFAULT_ANSIBLE_PROFILE
+
+
+def read_profile_bench() -> dict:
+    """Last scripts/bench_ansible_profiles.py --save result, or {}."""
+    try:
+        with open(PROFILE_BENCH_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def known_templates() -> set[str]:
+    return set(TEMPLATES) | {ROUTER_TEMPLATE}
+
+
+def validate_vms(
+    vms: list,
+    router_ips: dict[str, str] | None = None,
+    templates: set[str] | None = None,
+) -> list[tuple[str, str]]:
+    """Report every VMID, IP, name and reference conflict across typed VMs.
+
+    Builds hash indexes (vmid, address, name) and checks LAN membership as an
+    integer interval test, so the cost stays linear in the number of VMs.
+    Returns (vm_name, message) pairs; an empty list means the file is clean.
+    """
+    router_ips = router_ips if router_ips is not None else get_router_ips()
+    templates = templates if templates is not None else known_templates()
+    conflicts: list[tuple[str, str]] = []
+
+    lan_iface = None
+    lan_lo = lan_hi = None
+    try:
+        if router_ips.get("lan"):
+            lan_iface = ipaddress.ip_interface(router_ips["lan"])
+            lan_lo = int(lan_iface.network.network_address)
+            lan_hi = int(lan_iface.network.broadcast_address)
+    except ValueError:
+        conflicts.append(("router", f"invalid LAN address {router_ips.get('lan')!r}"))
+
+    names: dict[str, int] = {}
+    vmids: dict[int, str] = {}
+    addresses: dict[int, str] = {}
+    if lan_iface is not None:
+        addresses[int(lan_iface.ip)] = "router LAN"
+    pending_deps: list[tuple[str, str]] = []
+
+    for idx, vm in enumerate(vms):
+        name = vm.name or f"#{idx + 1}"
+        if not vm.name:
+            conflicts.append((name, "missing name"))
+        elif name in names:
+            conflicts.append((name, f"duplicate name (also VM #{names[name] + 1})"))
+        else:
+            names[name] = idx
+
+        if vm.vmid in vmids:
+            conflicts.append((name, f"duplicate vmid {vm.vmid} (also {vmids[vm.vmid]})"))
+        else:
+            vmids[vm.vmid] = name
+
+        if vm.clone not in templates:
+            conflicts.append((name, f"unknown template {vm.clone!r}"))
+
+        for raw in vm.ips:
+            if raw == "dhcp":
+                continue
+            try:
+                iface = ipaddress.ip_interface(raw)
+            except ValueError:
+                conflicts.append((name, f"invalid ip {raw!r}"))
+                continue
+            addr = int(iface.ip)
+            if addr in addresses:
+                conflicts.append((name, f"ip {iface.ip} already used by {addresses[addr]}"))
+            else:
+                addresses[addr] = name
+            if lan_lo is not None and iface.version == lan_iface.version and not lan_lo < addr < lan_hi:
+                conflicts.append((name, f"ip {iface.ip} is outside LAN {lan_iface.network}"))
+
+        for dep in vm.depends_on:
+            if dep == name:
+                conflicts.append((name, "depends on itself"))
+            else:
+                pending_deps.append((name, dep))
+
+    for name, dep in pending_deps:
+        if dep not in names:
+            conflicts.append((name, f"depends_on references unknown VM {dep!r}"))
+
+    return conflicts
+
+
+# Preflight: the environment checks shared by the CLI prerequisites menu and
+# the dashboard status grid. Each check is independent and runs in a thread
+# pool; the report is memoized on PATH and the mtimes of PREFLIGHT_FILES (plus
+# requirements.yml) and re-probed at most every PREFLIGHT_TTL seconds.
+PREFLIGHT_TOOLS = ("terraform", "ansible", "ansible-playbook")
+PREFLIGHT_FILES = {
+    "vms.json": VMS_JSON,
+    "terraform.tfvars": os.path.join(TERRAFORM_DIR, "terraform.tfvars"),
+    ".vault_pass": os.path.join(ANSIBLE_DIR, ".vault_pass"),
+    "secret_vault.yml": os.path.join(ANSIBLE_DIR, "inventory", "group_vars", "secret_vault.yml"),
+    "all.yml": os.path.join(ANSIBLE_DIR, "inventory", "group_vars", "all.yml"),
+    "dc.yml": os.path.join(ANSIBLE_DIR, "inventory", "group_vars", "dc.yml"),
+}
+TERRAFORM_INIT_DIR = os.path.join(TERRAFORM_DIR, ".terraform")
+PREFLIGHT_TTL = 300.0
+
+_preflight_cache: dict = {}
+
+
+@dataclass(slots=True)
+class PreflightCheck:
+    name: str
+    kind: str  # "tool", "file", "terraform" or "galaxy"
+    ok: bool
+    detail: str = ""
+    required: bool = True
+
+
+@dataclass(slots=True)
+class PreflightReport:
+    checks: list[PreflightCheck]
+    checked_at: float = field(default_factory=time.time)
+    elapsed_ms: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return all(c.ok for c in self.checks if c.required)
+
+    @property
+    def failed(self) -> list[PreflightCheck]:
+        return [c for c in self.checks if not c.ok]
+
+    def get(self, name: str) -> PreflightCheck | None:
+        return next((c for c in self.checks if c.name == name), None)
+
+    def of_kind(self, kind: str) -> list[PreflightCheck]:
+        return [c for c in self.checks if c.kind == kind]
+
+
+def _check_tool(name: str) -> PreflightCheck:
+    path = shutil.which(name)
+    return PreflightCheck(name, "tool", bool(path), path or "not in PATH")
+
+
+def _check_file(name: str, path: str) -> PreflightCheck:
+    found = os.path.exists(path)
+    return PreflightCheck(name, "file", found, path)
+
+
+def _check_terraform_init() -> PreflightCheck:
+    found = os.path.isdir(TERRAFORM_INIT_DIR)
+    return PreflightCheck("tf init", "terraform", found, "initialized" if found else "run terraform init")
+
+
+def _check_galaxy() -> PreflightCheck:
+    import yaml
+    from cyberlab_galaxy import REQUIREMENTS_FILE, check_requirements
+
+    if not os.path.exists(REQUIREMENTS_FILE):
+        return PreflightCheck("galaxy", "galaxy", True, "no requirements.yml", required=False)
+    try:
+        reqs = check_requirements()
+    except (OSError, ValueError, KeyError, yaml.YAMLError) as e:
+        return PreflightCheck("galaxy", "galaxy", False, str(e))
+    missing = [r.name for r in reqs if not r.satisfied]
+    detail = f"missing {', '.join(missing)}" if missing else ", ".join(f"{r.name} {r.installed}" for r in reqs)
+    return PreflightCheck("galaxy", "galaxy", not missing, detail)
+
+
+def _preflight_key() -> tuple:
+    paths = [*PREFLIGHT_FILES.values(), TERRAFORM_INIT_DIR, os.path.join(ANSIBLE_DIR, "requirements.yml")]
+    stamps = []
+    for path in paths:
+        try:
+            stamps.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            stamps.append(None)
+    return (os.environ.get("PATH", ""), os.environ.get("ANSIBLE_COLLECTIONS_PATH", ""), tuple(stamps))
+
+
+def run_preflight(force: bool = False) -> PreflightReport:
+    """Check tools, config files, Terraform init and Galaxy requirements concurrently.
+
+    The report is reused until PATH or one of the watched files changes, or
+    PREFLIGHT_TTL expires (tools and collections can be installed without
+    touching any watched file).
+    """
+    key = _preflight_key()
+    cached = _preflight_cache.get("report")
+    if (
+        not force
+        and cached is not None
+        and _preflight_cache.get("key") == key
+        and time.time() - cached.checked_at < PREFLIGHT_TTL
+    ):
+        return cached
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(_check_tool, tool) for tool in PREFLIGHT_TOOLS]
+        futures += [pool.submit(_check_file, name, path) for name, path in PREFLIGHT_FILES.items()]
+        futures += [pool.submit(_check_terraform_init), pool.submit(_check_galaxy)]
+        checks = [f.result() for f in futures]
+    report = PreflightReport(checks, elapsed_ms=(time.perf_counter() - start) * 1000)
+    _preflight_cache.update(key=key, report=report)
+    return report
+
+
+def invalidate_preflight():
+    _preflight_cache.clear()
@@ -0,0 +1,124 @@
+"""Ansible fact cache maintenance for .cyberlab/facts.
+
+ansible.cfg stores facts in .cyberlab/facts with the jsonfile cache plugin
+and ``gathering = smart``, so a batch of playbooks gathers each host once.
+A host's cached facts are dropped when its proxmox_vm_qemu instance in
+terraform.tfstate is recreated: a new resource id or VMID, other MAC
+addresses or another clone source. In-place updates and refreshes keep the
+facts. ansible_playbook_cmd() runs ``sync`` before every playbook.
+
+Usage:
+    python3 cyberlab_facts.py sync          # invalidate hosts changed in tfstate
+    python3 cyberlab_facts.py clear [HOST ...]
+"""
+import argparse
+import hashlib
+import json
+import os
+
+from cyberlab_common import CYBERLAB_DIR, TERRAFORM_DIR, ensure_cyberlab_dir
+
+FACT_CACHE_DIR = os.path.join(CYBERLAB_DIR, "facts")
+FACT_STATE_FILE = os.path.join(CYBERLAB_DIR, "facts_state.json")
+TFSTATE = os.path.join(TERRAFORM_DIR, "terraform.tfstate")
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_json(path: str, data: dict):
+    ensure_cyberlab_dir()
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def vm_fingerprints(state_path: str = TFSTATE) -> dict[str, str]:
+    """VM name -> digest of the proxmox_vm_qemu attributes that change only when the VM is recreated."""
+    state = _read_json(state_path)
+    prints = {}
+    for resource in state.get("resources", []):
+        if resource.get("type") != "proxmox_vm_qemu":
+            continue
+        for instance in resource.get("instances", []):
+            attrs = instance.get("attributes") or {}
+            if attrs.get("name"):
+                identity = {
+                    "id": attrs.get("id"),
+                    "vmid": attrs.get("vmid"),
+                    "clone": attrs.get("clone"),
+                    "macs": sorted(str(nic.get("macaddr")) for nic in attrs.get("network") or [] if isinstance(nic, dict)),
+                }
+                blob = json.dumps(identity, sort_keys=True, default=str).encode()
+                prints[attrs["name"]] = hashlib.sha1(blob).hexdigest()
+    return prints
+
+
+def invalidate_facts(hosts: list[str] | None = None) -> list[str]:
+    """Delete cached facts for ``hosts`` (all hosts when None); returns the hosts removed."""
+    try:
+        cached = os.listdir(FACT_CACHE_DIR)
+    except OSError:
+        return []
+    targets = cached if hosts is None else [h for h in hosts if h in cached]
+    removed = []
+    for host in targets:
+        try:
+            os.remove(os.path.join(FACT_CACHE_DIR, host))
+            removed.append(host)
+        except OSError:
+            continue
+    return removed
+
+
+def sync_fact_cache(state_path: str = TFSTATE) -> list[str]:
+    """Drop facts of VMs whose tfstate entry changed since the last sync.
+
+    Skips all work while terraform.tfstate keeps the mtime/size seen last time.
+    """
+    try:
+        st = os.stat(state_path)
+        state_key = [st.st_mtime_ns, st.st_size]
+    except OSError:
+        state_key = None
+    saved = _read_json(FACT_STATE_FILE)
+    if saved.get("tfstate") == state_key and state_key is not None:
+        return []
+
+    current = vm_fingerprints(state_path)
+    if saved:
+        previous = saved.get("vms", {})
+        changed = [name for name in previous.keys() | current.keys() if previous.get(name) != current.get(name)]
+        removed = invalidate_facts(changed)
+    else:
+        # No baseline yet: facts cached before tracking started cannot be trusted.
+        removed = invalidate_facts()
+    _write_json(FACT_STATE_FILE, {"tfstate": state_key, "vms": current})
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the Ansible fact cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("sync", help="Invalidate hosts whose VM changed in terraform.tfstate")
+    clear = sub.add_parser("clear", help="Delete cached facts")
+    clear.add_argument("hosts", nargs="*", help="Hosts to clear (default: all)")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        removed = sync_fact_cache()
+        if removed:
+            print(f"# fact cache: invalidated {', '.join(sorted(removed))}")
+    else:
+        removed = invalidate_facts(args.hosts or None)
+        print(f"Cleared cached facts for {len(removed)} hosts.")
+
+
+if __name__ == "__main__":
+    main()
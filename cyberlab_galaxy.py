@@ -0,0 +1,272 @@
+"""Offline mirror for the Ansible Galaxy content in ansible/requirements.yml.
+
+``mirror`` downloads the required collections (``ansible-galaxy collection
+download``) and roles as tarballs into .cyberlab/galaxy and records their
+SHA-256 and a content hash in manifest.json, next to a requirements file
+that installs from those tarballs. ``check`` reads the MANIFEST.json of
+the installed collections (and meta/.galaxy_install_info of roles) straight
+from the collection/role paths, so the prerequisites check only calls
+ansible-galaxy when something is missing, and then always installs from the
+mirror: when it matches requirements.yml no network is needed, otherwise it
+is rebuilt first, so every requirement is downloaded once.
+
+Usage:
+    python3 cyberlab_galaxy.py check
+    python3 cyberlab_galaxy.py mirror
+    python3 cyberlab_galaxy.py install [--offline]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+from dataclasses import dataclass
+
+from cyberlab_common import ANSIBLE_DIR, CYBERLAB_DIR, ensure_cyberlab_dir
+
+REQUIREMENTS_FILE = os.path.join(ANSIBLE_DIR, "requirements.yml")
+GALAXY_MIRROR_DIR = os.path.join(CYBERLAB_DIR, "galaxy")
+GALAXY_MANIFEST = os.path.join(GALAXY_MIRROR_DIR, "manifest.json")
+MIRROR_REQUIREMENTS = os.path.join(GALAXY_MIRROR_DIR, "requirements.yml")
+DEFAULT_COLLECTION_PATHS = ["~/.ansible/collections", "/usr/share/ansible/collections"]
+DEFAULT_ROLE_PATHS = ["~/.ansible/roles", "/usr/share/ansible/roles", "/etc/ansible/roles"]
+
+_SPEC_RE = re.compile(r"^\s*(>=|<=|==|!=|>|<|=)?\s*(\S+)\s*$")
+
+
+@dataclass(slots=True)
+class Requirement:
+    kind: str  # "collection" or "role"
+    name: str
+    version: str  # specifier for collections, exact version (or "") for roles
+    installed: str = ""
+
+    @property
+    def satisfied(self) -> bool:
+        if not self.installed:
+            return False
+        if self.kind == "role":
+            return not self.version or self.version == self.installed
+        return version_matches(self.installed, self.version)
+
+
+def _version_key(version: str) -> tuple:
+    return tuple(int(p) if p.isdigit() else 0 for p in re.split(r"[.+-]", version)[:4])
+
+
+def version_matches(version: str, spec: str) -> bool:
+    """Galaxy-style specifier check: '*', '1.2.3', '>=1.0.0,<2.0.0', '!=1.1.0'."""
+    for clause in (spec or "*").split(","):
+        match = _SPEC_RE.match(clause)
+        if not match or match.group(2) == "*":
+            continue
+        op, wanted = match.group(1) or "==", match.group(2)
+        have, want = _version_key(version), _version_key(wanted)
+        ok = {
+            ">=": have >= want, "<=": have <= want, ">": have > want, "<": have < want,
+            "==": have == want, "=": have == want, "!=": have != want,
+        }[op]
+        if not ok:
+            return False
+    return True
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_requirements(path: str = REQUIREMENTS_FILE) -> list[Requirement]:
+    import yaml
+
+    with open(path) as f:
+        data = yaml.safe_load(f) or {}
+    reqs = []
+    for entry in data.get("collections", []) or []:
+        entry = entry if isinstance(entry, dict) else {"name": entry}
+        reqs.append(Requirement("collection", entry["name"], str(entry.get("version", "*"))))
+    for entry in data.get("roles", []) or []:
+        entry = entry if isinstance(entry, dict) else {"name": entry}
+        reqs.append(Requirement("role", entry.get("name") or entry["src"], str(entry.get("version", ""))))
+    return reqs
+
+
+def _search_paths(env_var: str, defaults: list[str], subdir: str = "") -> list[str]:
+    paths = [p for p in os.environ.get(env_var, "").split(os.pathsep) if p] + defaults
+    if subdir == "ansible_collections":
+        # Collections bundled with the ``ansible`` pip package live next to ansible-core.
+        for entry in sys.path:
+            if os.path.isdir(os.path.join(entry, "ansible_collections")):
+                paths.append(entry)
+    return [os.path.join(os.path.expanduser(p), subdir) for p in paths]
+
+
+def installed_collection_version(name: str) -> str:
+    namespace, _, collection = name.partition(".")
+    for base in _search_paths("ANSIBLE_COLLECTIONS_PATH", DEFAULT_COLLECTION_PATHS, "ansible_collections"):
+        try:
+            with open(os.path.join(base, namespace, collection, "MANIFEST.json")) as f:
+                return json.load(f)["collection_info"]["version"]
+        except (OSError, ValueError, KeyError):
+            continue
+    return ""
+
+
+def installed_role_version(name: str) -> str:
+    import yaml
+
+    for base in _search_paths("ANSIBLE_ROLES_PATH", DEFAULT_ROLE_PATHS):
+        try:
+            with open(os.path.join(base, name, "meta", ".galaxy_install_info")) as f:
+                return str((yaml.safe_load(f) or {}).get("version", "")) or "installed"
+        except OSError:
+            continue
+    return ""
+
+
+def check_requirements(path: str = REQUIREMENTS_FILE) -> list[Requirement]:
+    """Requirements with their installed versions filled in (no subprocesses)."""
+    reqs = read_requirements(path)
+    for req in reqs:
+        lookup = installed_collection_version if req.kind == "collection" else installed_role_version
+        req.installed = lookup(req.name)
+    return reqs
+
+
+def read_manifest() -> dict:
+    try:
+        with open(GALAXY_MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def mirror_matches(manifest: dict | None = None) -> bool:
+    """True when the mirror was built from the current requirements.yml and is intact."""
+    manifest = manifest if manifest is not None else read_manifest()
+    if not manifest or not os.path.exists(REQUIREMENTS_FILE):
+        return False
+    if manifest.get("requirements_sha256") != file_sha256(REQUIREMENTS_FILE):
+        return False
+    return all(
+        os.path.exists(os.path.join(GALAXY_MIRROR_DIR, item["file"]))
+        for item in manifest.get("collections", []) + manifest.get("roles", [])
+    )
+
+
+def build_mirror(log=print) -> dict:
+    """Download every requirement into the mirror and write manifest.json."""
+    import yaml
+
+    ensure_cyberlab_dir()
+    reqs = read_requirements()
+    with tempfile.TemporaryDirectory(dir=CYBERLAB_DIR, prefix="galaxy-") as tmp:
+        collections, roles = [], []
+        if any(r.kind == "collection" for r in reqs):
+            subprocess.run(
+                ["ansible-galaxy", "collection", "download", "-r", REQUIREMENTS_FILE, "-p", tmp],
+                check=True, cwd=ANSIBLE_DIR,
+            )
+            for name in sorted(os.listdir(tmp)):
+                if not name.endswith(".tar.gz"):
+                    continue
+                namespace, collection, version = name[: -len(".tar.gz")].split("-", 2)
+                collections.append({"name": f"{namespace}.{collection}", "version": version, "file": name})
+        role_reqs = [r for r in reqs if r.kind == "role"]
+        if role_reqs:
+            roles_dir = os.path.join(tmp, "roles")
+            subprocess.run(
+                ["ansible-galaxy", "role", "install", "-r", REQUIREMENTS_FILE, "-p", roles_dir],
+                check=True, cwd=ANSIBLE_DIR,
+            )
+            for req in role_reqs:
+                archive = f"{req.name}.tar.gz"
+                with tarfile.open(os.path.join(tmp, archive), "w:gz") as tar:
+                    tar.add(os.path.join(roles_dir, req.name), arcname=req.name)
+                roles.append({"name": req.name, "version": req.version, "file": archive})
+
+        staging = os.path.join(tmp, "mirror")
+        os.makedirs(staging)
+        for item in collections + roles:
+            shutil.move(os.path.join(tmp, item["file"]), os.path.join(staging, item["file"]))
+            item["sha256"] = file_sha256(os.path.join(staging, item["file"]))
+        content = "\n".join(f"{i['name']} {i['version']} {i['sha256']}" for i in collections + roles)
+        manifest = {
+            "requirements_sha256": file_sha256(REQUIREMENTS_FILE),
+            "content_sha256": hashlib.sha256(content.encode()).hexdigest(),
+            "collections": collections,
+            "roles": roles,
+        }
+        offline_reqs = {
+            "collections": [
+                {"name": os.path.join(GALAXY_MIRROR_DIR, i["file"]), "type": "file"} for i in collections
+            ],
+            "roles": [{"src": f"file://{os.path.join(GALAXY_MIRROR_DIR, i['file'])}", "name": i["name"]} for i in roles],
+        }
+        with open(os.path.join(staging, "requirements.yml"), "w") as f:
+            yaml.safe_dump({k: v for k, v in offline_reqs.items() if v}, f, sort_keys=False)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        shutil.rmtree(GALAXY_MIRROR_DIR, ignore_errors=True)
+        os.replace(staging, GALAXY_MIRROR_DIR)
+    log(f"Mirrored {len(collections)} collections and {len(roles)} roles "
+        f"(content {manifest['content_sha256'][:12]}) in {GALAXY_MIRROR_DIR}")
+    return manifest
+
+
+def install_command(offline: bool = False) -> str:
+    """ansible-galaxy command installing the requirements, always from the mirror.
+
+    A missing or stale mirror is rebuilt first, so each collection and role
+    is downloaded once and then installed from its tarball.
+    """
+    install = f'ansible-galaxy install -r "{MIRROR_REQUIREMENTS}" --force'
+    if mirror_matches():
+        return install
+    if offline:
+        raise ValueError("Galaxy mirror is missing or out of date; run 'cyberlab_galaxy.py mirror' while online")
+    return f'python3 "{os.path.abspath(__file__)}" mirror && {install}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Ansible Galaxy mirror")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Compare installed versions with requirements.yml")
+    sub.add_parser("mirror", help="Download requirements into the mirror")
+    install = sub.add_parser("install", help="Install missing requirements")
+    install.add_argument("--offline", action="store_true", help="Fail instead of using the network")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "check":
+            reqs = check_requirements()
+            for req in reqs:
+                state = "ok" if req.satisfied else "MISSING"
+                print(f"{state:<8} {req.name} {req.version or '*'} (installed: {req.installed or '-'})")
+            manifest = read_manifest()
+            mirror = f"content {manifest['content_sha256'][:12]}" if mirror_matches(manifest) else "missing or stale"
+            print(f"mirror: {mirror}")
+            sys.exit(0 if all(r.satisfied for r in reqs) else 1)
+        elif args.command == "mirror":
+            build_mirror()
+        else:
+            if all(r.satisfied for r in check_requirements()):
+                print("All requirements already installed.")
+                return
+            cmd = install_command(args.offline)
+            sys.exit(subprocess.run(cmd, shell=True, cwd=ANSIBLE_DIR).returncode)
+    except (OSError, ValueError, subprocess.CalledProcessError) as e:
+        sys.exit(f"cyberlab_galaxy: {e}")
+
+
+if __name__ == "__main__":
+    main()
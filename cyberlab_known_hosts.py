@@ -0,0 +1,162 @@
+"""Single-pass known_hosts maintenance for the lab hosts.
+
+Drops every known_hosts line that names a lab host (by VM name or IP, plain
+or hashed) in one read-filter-write pass, instead of one ``ssh-keygen -R``
+subprocess and file rewrite per host. With ``--scan`` the fresh keys of the
+SSH hosts are collected first by a single ``ssh-keyscan`` run (which probes
+all hosts concurrently) and written in the same rewrite.
+
+Usage:
+    python3 cyberlab_known_hosts.py [--scan] [--known-hosts PATH] [HOST ...]
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import subprocess
+import sys
+import tempfile
+
+from cyberlab_common import VMS_JSON
+from cyberlab_model import VM, load_vms
+
+KNOWN_HOSTS_FILE = os.path.expanduser("~/.ssh/known_hosts")
+KEYSCAN_TIMEOUT = 3
+KEYSCAN_TYPES = "ed25519,ecdsa,rsa"
+
+
+def lab_hosts(vms: list[VM]) -> tuple[set[str], list[str]]:
+    """(all names/IPs to forget, SSH host IPs worth scanning)."""
+    forget: set[str] = set()
+    scan: list[str] = []
+    for vm in vms:
+        if "router" in vm.roles:
+            continue
+        forget.add(vm.name)
+        ip = vm.primary_ip
+        if ip and ip != "dhcp":
+            forget.add(ip)
+            if not vm.is_windows:
+                scan.append(ip)
+    return forget, scan
+
+
+def _hashed_match(entry: str, hosts: set[str]) -> bool:
+    """Match an ``|1|salt|hash`` entry (HashKnownHosts) against plain host names."""
+    try:
+        _, _, salt, digest = entry.split("|", 3)
+        key = base64.b64decode(salt)
+        expected = base64.b64decode(digest)
+    except ValueError:
+        return False
+    return any(
+        hmac.compare_digest(hmac.new(key, host.encode(), hashlib.sha1).digest(), expected)
+        for host in hosts
+    )
+
+
+def line_matches(line: str, hosts: set[str]) -> bool:
+    fields = line.split()
+    if not fields or fields[0].startswith("#"):
+        return False
+    if fields[0].startswith("@"):
+        fields = fields[1:]
+        if not fields:
+            return False
+    patterns = fields[0]
+    if patterns.startswith("|1|"):
+        return _hashed_match(patterns, hosts)
+    for pattern in patterns.split(","):
+        if pattern.startswith("[") and "]:" in pattern:
+            pattern = pattern[1:pattern.index("]:")]
+        if pattern in hosts:
+            return True
+    return False
+
+
+def keyscan(hosts: list[str], timeout: int = KEYSCAN_TIMEOUT) -> list[str]:
+    """Host key lines for ``hosts``; one ssh-keyscan run covers them all in parallel."""
+    if not hosts:
+        return []
+    try:
+        proc = subprocess.run(
+            ["ssh-keyscan", "-T", str(timeout), "-t", KEYSCAN_TYPES, *hosts],
+            capture_output=True,
+            text=True,
+            timeout=timeout * 2 + 10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    return [line for line in proc.stdout.splitlines() if line and not line.startswith("#")]
+
+
+def clean_known_hosts(
+    hosts: set[str],
+    known_hosts: str = KNOWN_HOSTS_FILE,
+    add_lines: list[str] | None = None,
+) -> int:
+    """Remove every entry for ``hosts`` and append ``add_lines``; returns the number removed.
+
+    The file is read once and replaced atomically, keeping its permissions.
+    """
+    try:
+        with open(known_hosts) as f:
+            lines = f.readlines()
+        mode = os.stat(known_hosts).st_mode & 0o777
+    except FileNotFoundError:
+        lines = []
+        mode = 0o600
+
+    kept = [line for line in lines if not line_matches(line, hosts)]
+    removed = len(lines) - len(kept)
+    if not removed and not add_lines:
+        return 0
+    if kept and not kept[-1].endswith("\n"):
+        kept[-1] += "\n"
+    kept.extend(f"{line}\n" for line in add_lines or [])
+
+    directory = os.path.dirname(known_hosts) or "."
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".known_hosts.", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.writelines(kept)
+        os.chmod(tmp, mode)
+        os.replace(tmp, known_hosts)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forget (and optionally re-scan) lab SSH host keys")
+    parser.add_argument("hosts", nargs="*", help="Extra host names or IPs to forget")
+    parser.add_argument("--known-hosts", default=KNOWN_HOSTS_FILE)
+    parser.add_argument("--scan", action="store_true", help="Pre-populate fresh keys with ssh-keyscan")
+    parser.add_argument("--timeout", type=int, default=KEYSCAN_TIMEOUT, help="ssh-keyscan timeout per host")
+    args = parser.parse_args()
+
+    forget, scan = set(args.hosts), list(args.hosts)
+    if os.path.exists(VMS_JSON):
+        try:
+            lab_forget, lab_scan = lab_hosts(load_vms(VMS_JSON))
+        except ValueError as e:
+            sys.exit(f"clean_known_hosts: {e}")
+        forget |= lab_forget
+        scan += lab_scan
+    if not forget:
+        print("No lab hosts found in vms.json; nothing to clean.")
+        return
+
+    added = keyscan(scan, args.timeout) if args.scan else []
+    removed = clean_known_hosts(forget, args.known_hosts, added)
+    print(f"Removed {removed} known_hosts entries for {len(forget)} lab host names/IPs.")
+    if args.scan:
+        scanned = len({line.split()[0] for line in added})
+        print(f"Added {len(added)} host keys for {scanned}/{len(scan)} SSH hosts.")
+
+
+if __name__ == "__main__":
+    main()
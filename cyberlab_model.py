@@ -0,0 +1,493 @@
+"""Typed VM model for terraform/vms.json shared by cyberlab.py and cyberlab_ui.py.
+
+Each type converts from the raw JSON dict with explicit coercion (the same
+rules the VM Editor used to apply in sanitize_vm) and back to the minimal
+dict Terraform expects. Loading is memoized on the file's mtime and size so
+repeated page renders do not re-parse an unchanged vms.json.
+"""
+import copy
+import ipaddress
+import json
+import os
+import sys
+from dataclasses import dataclass, field
+
+_CACHE: dict[tuple[str, bool], tuple[tuple[int, int], list["VM"]]] = {}
+
+# Lab roles, in topology order. A VM's roles come from its tags when any tag
+# names a role (or an alias); otherwise from its name prefix, then template.
+ROLES = ("router", "dc", "siem", "fleet", "xdr", "soc", "workstation")
+ROLE_ALIASES = {
+    "gateway": "router",
+    "pfsense": "router",
+    "domain-controller": "dc",
+    "elastic": "siem",
+    "elasticsearch": "siem",
+    "wazuh": "xdr",
+    "thehive": "soc",
+    "ws": "workstation",
+}
+NAME_PREFIX_ROLES = {
+    "PF": "router",
+    "DC": "dc",
+    "SIEM": "siem",
+    "FLEET": "fleet",
+    "XDR": "xdr",
+    "SOC": "soc",
+    "LIN": "workstation",
+    "WIN": "workstation",
+}
+TEMPLATE_ROLES = {
+    "pfsense-template": "router",
+    "win-dc-2022-template": "dc",
+    "win11-template": "workstation",
+    "ubuntu-desktop-template": "workstation",
+}
+
+
+def vm_roles(name: str, clone: str, tags: list[str]) -> tuple[str, ...]:
+    """Roles of a VM in ROLES order; empty for a plain domain member."""
+    tagged = set()
+    for tag in tags:
+        tag = tag.strip().lower()
+        tag = ROLE_ALIASES.get(tag, tag)
+        if tag in ROLES:
+            tagged.add(tag)
+    if tagged:
+        return tuple(r for r in ROLES if r in tagged)
+    role = NAME_PREFIX_ROLES.get(name.split("-", 1)[0].upper()) or TEMPLATE_ROLES.get(clone)
+    return (role,) if role else ()
+
+
+@dataclass(slots=True)
+class Disk:
+    slot: str
+    type: str
+    storage: str
+    size: str = ""
+    iothread: bool = False
+    discard: bool = False
+    cache: str = ""
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Disk":
+        if d["type"] != "disk":
+            return cls(d["slot"], d["type"], d["storage"])
+        return cls(
+            d["slot"], d["type"], d["storage"],
+            d.get("size") or "", bool(d.get("iothread")), bool(d.get("discard")), d.get("cache") or "",
+        )
+
+    def to_dict(self) -> dict:
+        out: dict = {"slot": self.slot, "type": self.type, "storage": self.storage}
+        if self.type != "disk":
+            return out
+        if self.size:
+            out["size"] = self.size
+        if self.iothread:
+            out["iothread"] = True
+        if self.discard:
+            out["discard"] = True
+        if self.cache:
+            out["cache"] = self.cache
+        return out
+
+
+@dataclass(slots=True)
+class Network:
+    id: int
+    model: str
+    bridge: str
+    firewall: bool = True
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Network":
+        return cls(int(d["id"]), d["model"], d["bridge"], bool(d.get("firewall", True)))
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "model": self.model, "bridge": self.bridge, "firewall": self.firewall}
+
+
+@dataclass(slots=True)
+class IpConfig:
+    interface: str = ""
+    ip: str = ""
+    gateway: str = ""
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "IpConfig":
+        return cls(d.get("interface") or "", d.get("ip") or "", d.get("gateway") or "")
+
+    def to_dict(self) -> dict:
+        out: dict = {}
+        if self.interface:
+            out["interface"] = self.interface
+        if self.ip:
+            out["ip"] = self.ip
+        if self.gateway:
+            out["gateway"] = self.gateway
+        return out
+
+
+@dataclass(slots=True)
+class CloudInit:
+    nameserver: str = ""
+    searchdomain: str = ""
+    sshkeys: list[str] = field(default_factory=list)
+    ipconfig: list[IpConfig] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CloudInit":
+        keys = d.get("sshkeys") or []
+        if isinstance(keys, str):
+            keys = [keys]
+        return cls(
+            d.get("nameserver") or "",
+            d.get("searchdomain") or "",
+            list(keys),
+            [IpConfig.from_dict(e) for e in d.get("ipconfig", []) if e.get("ip")],
+        )
+
+    def to_dict(self) -> dict:
+        out: dict = {"enabled": True}
+        if self.nameserver:
+            out["nameserver"] = self.nameserver
+        if self.searchdomain:
+            out["searchdomain"] = self.searchdomain
+        if self.sshkeys:
+            out["sshkeys"] = list(self.sshkeys)
+        if self.ipconfig:
+            out["ipconfig"] = [e.to_dict() for e in self.ipconfig]
+        return out
+
+
+@dataclass(slots=True)
+class VM:
+    name: str
+    vmid: int
+    target_node: str
+    clone: str
+    full_clone: bool
+    cores: int
+    sockets: int
+    cpu_type: str
+    memory: int
+    scsihw: str
+    bootdisk: str
+    onboot: bool = False
+    tags: list[str] = field(default_factory=list)
+    bios: str = ""
+    machine: str = ""
+    efi_storage: str = ""
+    balloon: int | None = None
+    serial: tuple[int, str] | None = None
+    disks: list[Disk] = field(default_factory=list)
+    networks: list[Network] = field(default_factory=list)
+    cloudinit: CloudInit | None = None
+    agent: int = 0
+    depends_on: list[str] = field(default_factory=list)
+    os_type: str = ""
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "VM":
+        """Coerce a raw vms.json entry; raises ValueError naming the VM and field."""
+        name = d.get("name") or "?"
+        try:
+            cpu = d["cpu"]
+            ovmf = d.get("bios") == "ovmf"
+            ci = d.get("cloudinit")
+            serial = d.get("serial")
+            return cls(
+                name=d["name"],
+                vmid=int(d["vmid"]),
+                target_node=d["target_node"],
+                clone=d["clone"],
+                full_clone=bool(d["full_clone"]),
+                cores=int(cpu["cores"]),
+                sockets=int(cpu["sockets"]),
+                cpu_type=cpu["type"],
+                memory=int(d["memory"]),
+                scsihw=d["scsihw"],
+                bootdisk=d["bootdisk"],
+                onboot=bool(d.get("onboot")),
+                tags=list(d.get("tags") or []),
+                bios="ovmf" if ovmf else "",
+                machine=d.get("machine", "q35") if ovmf else "",
+                efi_storage=d.get("efi_storage", "Internal") if ovmf else "",
+                balloon=int(d["balloon"]) if d.get("balloon") is not None else None,
+                serial=(int(serial["id"]), serial["type"]) if serial else None,
+                disks=[Disk.from_dict(x) for x in d.get("disks", [])],
+                networks=[Network.from_dict(x) for x in d.get("networks", [])],
+                cloudinit=CloudInit.from_dict(ci) if ci and ci.get("enabled") else None,
+                agent=int(d.get("agent", 0)),
+                depends_on=list(d.get("depends_on") or []),
+                os_type=d.get("os_type") or "",
+            )
+        except KeyError as e:
+            raise ValueError(f"{name}: missing field {e.args[0]!r}") from None
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{name}: {e}") from None
+
+    def to_dict(self) -> dict:
+        out: dict = {
+            "name": self.name,
+            "vmid": self.vmid,
+            "target_node": self.target_node,
+            "clone": self.clone,
+            "full_clone": self.full_clone,
+        }
+        if self.onboot:
+            out["onboot"] = True
+        if self.tags:
+            out["tags"] = list(self.tags)
+        out["cpu"] = {"cores": self.cores, "sockets": self.sockets, "type": self.cpu_type}
+        if self.bios == "ovmf":
+            out["bios"] = "ovmf"
+            out["machine"] = self.machine
+            out["efi_storage"] = self.efi_storage
+        out["memory"] = self.memory
+        if self.balloon is not None:
+            out["balloon"] = self.balloon
+        if self.serial:
+            out["serial"] = {"id": self.serial[0], "type": self.serial[1]}
+        out["scsihw"] = self.scsihw
+        out["bootdisk"] = self.bootdisk
+        out["disks"] = [d.to_dict() for d in self.disks]
+        out["networks"] = [n.to_dict() for n in self.networks]
+        if self.cloudinit:
+            out["cloudinit"] = self.cloudinit.to_dict()
+        if self.agent:
+            out["agent"] = self.agent
+        if self.depends_on:
+            out["depends_on"] = list(self.depends_on)
+        if self.os_type:
+            out["os_type"] = self.os_type
+        return out
+
+    @property
+    def tier(self) -> int:
+        """Terraform tier (main.tf): 0 deps, 1 dep, 2+ deps."""
+        return min(len(self.depends_on), 2)
+
+    @property
+    def ips(self) -> list[str]:
+        if not self.cloudinit:
+            return []
+        return [e.ip for e in self.cloudinit.ipconfig if e.ip]
+
+    @property
+    def primary_ip(self) -> str:
+        """First cloud-init address without its prefix length, or ''."""
+        ips = self.ips
+        return ips[0].split("/")[0] if ips else ""
+
+    @property
+    def roles(self) -> tuple[str, ...]:
+        return vm_roles(self.name, self.clone, self.tags)
+
+    @property
+    def is_windows(self) -> bool:
+        return self.os_type.startswith("win") or self.clone.startswith("win")
+
+    @property
+    def os_disk_size(self) -> str:
+        return next((d.size for d in self.disks if d.type == "disk"), "")
+
+
+@dataclass(slots=True)
+class VMGroup:
+    """A pattern that expands into ``count`` VMs sharing one template entry.
+
+    ``template`` is a regular vms.json entry without name/vmid; its first
+    ipconfig entry supplies the gateway and prefix length for the allocated
+    addresses.
+    """
+    name_pattern: str
+    count: int
+    vmid_range: tuple[int, int]
+    template: dict
+    ip_range: tuple[str, str] | None = None
+    start: int = 1
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "VMGroup":
+        pattern = d.get("name_pattern") or "?"
+        try:
+            lo, hi = d["vmid_range"]
+            ip_range = d.get("ip_range")
+            return cls(
+                name_pattern=d["name_pattern"],
+                count=int(d["count"]),
+                vmid_range=(int(lo), int(hi)),
+                template=dict(d["template"]),
+                ip_range=(ip_range[0], ip_range[1]) if ip_range else None,
+                start=int(d.get("start", 1)),
+            )
+        except KeyError as e:
+            raise ValueError(f"group {pattern}: missing field {e.args[0]!r}") from None
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"group {pattern}: {e}") from None
+
+    def to_dict(self) -> dict:
+        out: dict = {
+            "name_pattern": self.name_pattern,
+            "count": self.count,
+            "vmid_range": list(self.vmid_range),
+        }
+        if self.ip_range:
+            out["ip_range"] = list(self.ip_range)
+        if self.start != 1:
+            out["start"] = self.start
+        out["template"] = self.template
+        return out
+
+    def expand(self, used_vmids: set[int], used_ips: set[int]) -> list[VM]:
+        """Give member i VMID ``vmid_range[0] + i`` and address ``ip_range[0] + i``.
+
+        Allocation depends only on the member index, so adding a hand-written
+        VM never renumbers the fleet; a VMID or address that is already taken
+        is an error instead. Updates both sets in place.
+        """
+        label = f"group {self.name_pattern}"
+        lo, hi = self.vmid_range
+        if self.count > hi - lo + 1:
+            raise ValueError(f"{label}: {self.count} VMs do not fit VMIDs {lo}-{hi}")
+        vmids = list(range(lo, lo + self.count))
+
+        addrs: list[int] = []
+        prefix = 0
+        if self.ip_range:
+            try:
+                first = ipaddress.ip_interface(self.ip_range[0])
+                last = ipaddress.ip_address(self.ip_range[1].split("/")[0])
+            except ValueError as e:
+                raise ValueError(f"{label}: {e}") from None
+            if self.count > int(last) - int(first.ip) + 1:
+                raise ValueError(f"{label}: {self.count} VMs do not fit addresses {self.ip_range[0]}-{self.ip_range[1]}")
+            addrs = list(range(int(first.ip), int(first.ip) + self.count))
+            prefix = first.network.prefixlen
+
+        clashes = [f"VMID {v}" for v in vmids if v in used_vmids]
+        clashes += [f"address {ipaddress.ip_address(a)}" for a in addrs if a in used_ips]
+        if clashes:
+            raise ValueError(f"{label}: {', '.join(clashes)} already used by another VM")
+        used_vmids.update(vmids)
+        used_ips.update(addrs)
+
+        vms = []
+        for i in range(self.count):
+            entry = copy.deepcopy(self.template)
+            try:
+                entry["name"] = self.name_pattern.format(n=self.start + i)
+            except (KeyError, IndexError, ValueError) as e:
+                raise ValueError(f"{label}: invalid name_pattern ({e!r}); use {{n}} for the member number") from None
+            entry["vmid"] = vmids[i]
+            if addrs:
+                ci = entry.setdefault("cloudinit", {"enabled": True})
+                ipconfig = ci.get("ipconfig") or [{"interface": "net0"}]
+                ipconfig[0]["ip"] = f"{ipaddress.ip_address(addrs[i])}/{prefix}"
+                ci["ipconfig"] = ipconfig
+            vms.append(VM.from_dict(entry))
+        return vms
+
+
+def _vm_addresses(vm: VM) -> list[int]:
+    out = []
+    for raw in vm.ips:
+        try:
+            out.append(int(ipaddress.ip_interface(raw).ip))
+        except ValueError:
+            continue
+    return out
+
+
+def expand_vm_groups(vms: list[VM], groups: list[VMGroup]) -> list[VM]:
+    """Expand groups against the concrete VMs; returns concrete + generated VMs."""
+    used_vmids = {vm.vmid for vm in vms}
+    used_ips = {addr for vm in vms for addr in _vm_addresses(vm)}
+    out = list(vms)
+    for group in groups:
+        out.extend(group.expand(used_vmids, used_ips))
+    return out
+
+
+def parse_vms(entries: list) -> tuple[list[VM], list[str]]:
+    """Convert raw entries, collecting every schema error instead of stopping at the first."""
+    vms: list[VM] = []
+    errors: list[str] = []
+    for idx, entry in enumerate(entries):
+        try:
+            vms.append(VM.from_dict(entry))
+        except ValueError as e:
+            errors.append(f"VM #{idx + 1} {e}")
+    return vms, errors
+
+
+def read_vms_data(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"vms": data}
+    return data
+
+
+def load_vms(path: str, expand: bool = True) -> list[VM]:
+    """Load vms.json into VM objects, reusing the last result while the file is unchanged.
+
+    With ``expand`` (the default) entries from ``vm_groups`` are appended as
+    concrete VMs; the VM Editor passes False to edit only hand-written VMs.
+    The list and its VMs are shared with the cache: treat them as read-only
+    and ``copy.deepcopy`` them before editing.
+    Raises ValueError listing every schema error in the file.
+    """
+    st = os.stat(path)
+    sig = (st.st_mtime_ns, st.st_size)
+    cached = _CACHE.get((path, expand))
+    if cached and cached[0] == sig:
+        return cached[1]
+    data = read_vms_data(path)
+    vms, errors = parse_vms(data.get("vms", []))
+    groups = []
+    if expand:
+        for entry in data.get("vm_groups", []):
+            try:
+                groups.append(VMGroup.from_dict(entry))
+            except ValueError as e:
+                errors.append(str(e))
+    if errors:
+        raise ValueError("; ".join(errors))
+    if groups:
+        vms = expand_vm_groups(vms, groups)
+    _CACHE[(path, expand)] = (sig, vms)
+    return vms
+
+
+def dump_vms(path: str, vms: list[VM], data: dict | None = None, indent: int = 4):
+    """Write VMs back to vms.json, keeping any other top-level keys (e.g. vm_groups) from ``data``."""
+    out = dict(data) if data else {}
+    out["vms"] = [vm.to_dict() for vm in vms]
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(out, f, indent=indent)
+    os.replace(tmp, path)
+    _CACHE.pop((path, True), None)
+    _CACHE.pop((path, False), None)
+
+
+def terraform_external(stdin=sys.stdin, stdout=sys.stdout):
+    """Terraform ``external`` data source protocol: query JSON in, string map out."""
+    query = json.load(stdin)
+    vms = load_vms(query["path"])
+    json.dump({"vms": json.dumps({"vms": [vm.to_dict() for vm in vms]})}, stdout)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--terraform"]:
+        try:
+            terraform_external()
+        except (ValueError, OSError) as e:
+            print(f"vms.json: {e}", file=sys.stderr)
+            sys.exit(1)
+    else:
+        print("usage: cyberlab_model.py --terraform  (reads {\"path\": ...} on stdin)", file=sys.stderr)
+        sys.exit(2)
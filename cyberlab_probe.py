@@ -0,0 +1,174 @@
+"""Concurrent TCP reachability prober for the lab, shared by cyberlab.py and cyberlab_ui.py.
+
+Opens one asyncio connection per (host, port) at once, so the whole lab is
+checked in roughly one timeout instead of a full Ansible run. Which ports a
+host gets depends on its OS and roles (cyberlab_model.VM.roles). Results are
+cached in-process for PROBE_TTL seconds.
+
+Usage:
+    python3 cyberlab_probe.py [--timeout 1.5] [--json]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+
+from cyberlab_common import VMS_JSON
+from cyberlab_model import VM, load_vms
+
+PROBE_TTL = 15.0
+PROBE_TIMEOUT = 1.5
+PROBE_CONCURRENCY = 256
+
+SERVICE_PORTS = {
+    "ssh": 22,
+    "winrm": 5985,
+    "winrm-https": 5986,
+    "kibana": 5601,
+    "elasticsearch": 9200,
+    "wazuh-api": 55000,
+    "thehive": 9000,
+}
+# Reported but not required for a host to count as up (Ansible uses 5985).
+OPTIONAL_SERVICES = {"winrm-https"}
+ROLE_SERVICES = {
+    "siem": ("elasticsearch", "kibana"),
+    "xdr": ("wazuh-api",),
+    "soc": ("thehive",),
+}
+
+_CACHE: dict[tuple, tuple[float, list["HostResult"]]] = {}
+
+
+@dataclass(slots=True)
+class PortResult:
+    service: str
+    port: int
+    open: bool
+    latency_ms: float | None = None
+    error: str = ""
+
+
+@dataclass(slots=True)
+class HostResult:
+    name: str
+    ip: str
+    ports: list[PortResult] = field(default_factory=list)
+
+    @property
+    def state(self) -> str:
+        """'up' when every required port answered, 'partial' when some did, else 'down'."""
+        required = [p for p in self.ports if p.service not in OPTIONAL_SERVICES]
+        opened = sum(p.open for p in required)
+        if opened == len(required):
+            return "up"
+        return "partial" if opened else "down"
+
+
+def host_services(vm: VM) -> list[str]:
+    """Services to probe on a VM: management port by OS, then role services."""
+    services = ["winrm", "winrm-https"] if vm.is_windows else ["ssh"]
+    for role in vm.roles:
+        services.extend(ROLE_SERVICES.get(role, ()))
+    return services
+
+
+def probe_targets(vms: list[VM]) -> list[tuple[str, str, tuple[str, ...]]]:
+    """(name, ip, services) for every VM Ansible manages that has an address."""
+    targets = []
+    for vm in vms:
+        ip = vm.primary_ip
+        if not ip or ip == "dhcp" or "router" in vm.roles:
+            continue
+        targets.append((vm.name, ip, tuple(host_services(vm))))
+    return targets
+
+
+async def probe_port(ip: str, service: str, timeout: float, sem: asyncio.Semaphore) -> PortResult:
+    port = SERVICE_PORTS[service]
+    async with sem:
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+        except asyncio.TimeoutError:
+            return PortResult(service, port, False, error="timeout")
+        except ConnectionRefusedError:
+            return PortResult(service, port, False, error="refused")
+        except OSError as e:
+            return PortResult(service, port, False, error=type(e).__name__)
+        latency = (time.perf_counter() - start) * 1000
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return PortResult(service, port, True, round(latency, 1))
+
+
+async def probe_hosts_async(
+    targets: list[tuple[str, str, tuple[str, ...]]],
+    timeout: float = PROBE_TIMEOUT,
+    concurrency: int = PROBE_CONCURRENCY,
+) -> list[HostResult]:
+    sem = asyncio.Semaphore(concurrency)
+    hosts = [HostResult(name, ip) for name, ip, _ in targets]
+    tasks = [
+        (host, probe_port(host.ip, service, timeout, sem))
+        for host, (_, _, services) in zip(hosts, targets)
+        for service in services
+    ]
+    results = await asyncio.gather(*(coro for _, coro in tasks))
+    for (host, _), result in zip(tasks, results):
+        host.ports.append(result)
+    return hosts
+
+
+def probe_lab(
+    vms: list[VM] | None = None,
+    timeout: float = PROBE_TIMEOUT,
+    ttl: float = PROBE_TTL,
+) -> list[HostResult]:
+    """Probe every lab host; reuse results younger than ``ttl`` for the same targets."""
+    if vms is None:
+        vms = load_vms(VMS_JSON)
+    targets = probe_targets(vms)
+    key = (tuple(targets), timeout)
+    now = time.monotonic()
+    cached = _CACHE.get(key)
+    if cached and now - cached[0] < ttl:
+        return cached[1]
+    results = asyncio.run(probe_hosts_async(targets, timeout))
+    _CACHE.clear()
+    _CACHE[key] = (time.monotonic(), results)
+    return results
+
+
+def probe_states(results: list[HostResult]) -> dict[str, str]:
+    return {host.name: host.state for host in results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Probe lab hosts over TCP")
+    parser.add_argument("--timeout", type=float, default=PROBE_TIMEOUT, help="Per-connection timeout in seconds")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    try:
+        results = probe_lab(timeout=args.timeout, ttl=0)
+    except (OSError, ValueError) as e:
+        sys.exit(f"cyberlab_probe: {e}")
+    if args.json:
+        print(json.dumps([asdict(host) | {"state": host.state} for host in results], indent=2))
+        return
+    for host in results:
+        ports = "  ".join(
+            f"{p.service}:{p.port} {'open' if p.open else p.error}" for p in host.ports
+        )
+        print(f"{host.name:<16} {host.ip:<16} {host.state:<8} {ports}")
+    sys.exit(0 if all(host.state == "up" for host in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Pick ansible-playbook --forks and strategy from inventory size and controller capacity.
+
+For each playbook the host patterns of its plays are resolved against the
+dynamic inventory groups. Forks cover the largest play (never below
+Ansible's default of 5), capped by the controller's CPUs and RAM. The
+``free`` strategy is used for large plays unless the playbook or its roles
+rely on ``run_once``, which free does not honour reliably. Overrides come
+from PLAYBOOK_TUNING and the ``playbook_tuning`` key of the UI config; a
+connection profile that sets ANSIBLE_FORKS/ANSIBLE_STRATEGY also wins over
+the automatic choice.
+"""
+import importlib.util
+import os
+from dataclasses import dataclass
+
+from cyberlab_common import ANSIBLE_DIR, ANSIBLE_PROFILES, get_ansible_profile, read_ui_config
+
+DEFAULT_FORKS = 5
+FORKS_PER_CPU = 4
+FORK_RAM_MB = 128
+FREE_STRATEGY_MIN_HOSTS = 8
+
+# Built-in per-playbook overrides ({"forks": int, "strategy": str}).
+PLAYBOOK_TUNING: dict[str, dict] = {
+    # The dc group is a single host, so free gains nothing there, and promoting the
+    # forest, rebooting and waiting for ADWS must finish before OUs and users are
+    # created: keep the run in task order even if more hosts join the group.
+    "dc_setup.yml": {"strategy": "linear"},
+}
+
+_PLAYBOOK_CACHE: dict[str, tuple[tuple, tuple[list[tuple[str, bool]], bool]]] = {}
+
+
+@dataclass(slots=True)
+class PlaybookTuning:
+    forks: int
+    strategy: str
+    hosts: int
+    source: str
+
+    def summary(self) -> str:
+        return f"forks={self.forks} strategy={self.strategy} (largest play {self.hosts} hosts, {self.source})"
+
+
+def controller_capacity() -> tuple[int, int]:
+    """(CPU count, RAM in MiB) of the machine running ansible-playbook."""
+    cpus = os.cpu_count() or 1
+    try:
+        ram_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    except (AttributeError, OSError, ValueError):
+        ram_mb = 2048
+    return cpus, ram_mb
+
+
+def max_forks() -> int:
+    cpus, ram_mb = controller_capacity()
+    return max(DEFAULT_FORKS, min(cpus * FORKS_PER_CPU, ram_mb // FORK_RAM_MB))
+
+
+def inventory_groups() -> dict[str, set[str]]:
+    """Group -> hosts (children expanded) from the dynamic inventory, or {} if unavailable."""
+    path = os.path.join(ANSIBLE_DIR, "inventory", "cyberlab_inventory.py")
+    try:
+        spec = importlib.util.spec_from_file_location("cyberlab_inventory", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        inventory = module.cached_inventory()
+    except (OSError, ValueError, ImportError):
+        return {}
+
+    raw = {name: group for name, group in inventory.items() if name != "_meta"}
+    resolved: dict[str, set[str]] = {}
+
+    def expand(name: str, seen: frozenset = frozenset()) -> set[str]:
+        if name in resolved:
+            return resolved[name]
+        group = raw.get(name, {})
+        hosts = set(group.get("hosts", []))
+        for child in group.get("children", []):
+            if child not in seen:
+                hosts |= expand(child, seen | {name})
+        resolved[name] = hosts
+        return hosts
+
+    for name in raw:
+        expand(name)
+    resolved["all"] = set(inventory.get("_meta", {}).get("hostvars", {}))
+    return resolved
+
+
+def resolve_pattern(pattern, groups: dict[str, set[str]]) -> set[str]:
+    """Hosts matched by an Ansible host pattern (list, 'a,b', 'a:b', '!x', '&x')."""
+    if isinstance(pattern, list):
+        pattern = ",".join(str(p) for p in pattern)
+    parts = [p.strip() for p in str(pattern).replace(":", ",").split(",") if p.strip()]
+    matched: set[str] = set()
+    for part in parts:
+        if part.startswith("!"):
+            matched -= groups.get(part[1:], {part[1:]})
+        elif part.startswith("&"):
+            matched &= groups.get(part[1:], {part[1:]})
+        else:
+            matched |= groups.get(part, {part} if part in groups.get("all", set()) else set())
+    return matched
+
+
+def _tasks_use_run_once(tasks) -> bool:
+    """True when a parsed task list sets run_once on any task, including inside blocks."""
+    for task in tasks if isinstance(tasks, list) else []:
+        if not isinstance(task, dict):
+            continue
+        if task.get("run_once"):
+            return True
+        if any(_tasks_use_run_once(task.get(section)) for section in ("block", "rescue", "always")):
+            return True
+    return False
+
+
+def _role_uses_run_once(role: str) -> bool:
+    import yaml
+
+    for subdir in ("tasks", "handlers"):
+        tasks_dir = os.path.join(ANSIBLE_DIR, "roles", role, subdir)
+        try:
+            names = os.listdir(tasks_dir)
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith((".yml", ".yaml")):
+                continue
+            try:
+                with open(os.path.join(tasks_dir, name)) as f:
+                    if _tasks_use_run_once(yaml.safe_load(f)):
+                        return True
+            except (OSError, yaml.YAMLError):
+                continue
+    return False
+
+
+def playbook_plays(playbook: str) -> tuple[list[tuple[str, bool]], bool]:
+    """([(hosts pattern, run_once)], uses_run_once) for a playbook, cached on its mtime."""
+    import yaml
+
+    path = os.path.join(ANSIBLE_DIR, "playbooks", playbook)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [], False
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _PLAYBOOK_CACHE.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path) as f:
+        plays = yaml.safe_load(f) or []
+    result = []
+    roles: set[str] = set()
+    uses_run_once = False
+    for play in plays if isinstance(plays, list) else []:
+        if not isinstance(play, dict) or "hosts" not in play:
+            continue
+        result.append((play["hosts"], bool(play.get("run_once"))))
+        for role in play.get("roles") or []:
+            roles.add(role["role"] if isinstance(role, dict) else str(role))
+        for section in ("pre_tasks", "tasks", "post_tasks", "handlers"):
+            tasks = play.get(section) or []
+            uses_run_once = uses_run_once or _tasks_use_run_once(tasks)
+            for task in tasks if isinstance(tasks, list) else []:
+                include = task.get("include_role") or task.get("ansible.builtin.include_role") if isinstance(task, dict) else None
+                if isinstance(include, dict) and include.get("name"):
+                    roles.add(include["name"])
+    uses_run_once = uses_run_once or any(_role_uses_run_once(role) for role in roles)
+    _PLAYBOOK_CACHE[path] = (key, (result, uses_run_once))
+    return result, uses_run_once
+
+
+def tune_playbook(playbook: str, profile: str | None = None, config: dict | None = None) -> PlaybookTuning:
+    config = config if config is not None else read_ui_config()
+    env = ANSIBLE_PROFILES.get(profile or get_ansible_profile(config), {})
+    groups = inventory_groups()
+    plays, uses_run_once = playbook_plays(playbook)
+    largest = max(
+        (1 if run_once else len(resolve_pattern(pattern, groups)) for pattern, run_once in plays),
+        default=0,
+    )
+
+    forks = min(max(DEFAULT_FORKS, largest), max_forks())
+    strategy = "free" if largest >= FREE_STRATEGY_MIN_HOSTS and not uses_run_once else "linear"
+    source = "auto"
+    if "ANSIBLE_FORKS" in env:
+        forks = int(env["ANSIBLE_FORKS"])
+        source = "profile"
+    if "ANSIBLE_STRATEGY" in env:
+        strategy = env["ANSIBLE_STRATEGY"]
+        source = "profile"
+    override = {**PLAYBOOK_TUNING.get(playbook, {}), **config.get("playbook_tuning", {}).get(playbook, {})}
+    if override:
+        forks = int(override.get("forks", forks))
+        strategy = override.get("strategy", strategy)
+        source = "override"
+    return PlaybookTuning(forks, strategy, largest, source)
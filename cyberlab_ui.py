@@ -6,7 +6,10 @@ import sys
 if sys.platform == "darwin":
     os.environ.setdefault("OBJC_DISABLE_INITIALIZE_FORK_SAFETY", "YES")
 
+import copy
+import hashlib
 import html
+import ipaddress
 import re
 import signal
 import subprocess
@@ -29,48 +32,73 @@ except ImportError:
     print("Missing dependency: PyYAML (import yaml). Install with: pip install -r requirements.txt", file=sys.stderr)
     raise
 
-from cyberlab_common import ansible_playbook_cmd
+from cyberlab_apt_proxy import APT_PROXY_PORT, apt_proxy_url, cache_usage, proxy_pid, start_proxy, stop_proxy
+from cyberlab_artifacts import (
+    ARTIFACT_PORT,
+    cache_stats,
+    controller_lan_address,
+    server_pid,
+    start_server,
+    stop_server,
+)
+from cyberlab_common import (
+    ANSIBLE_DIR,
+    ANSIBLE_PROFILES,
+    BASE_DIR,
+    CYBERLAB_DIR,
+    TEMPLATES,
+    TERRAFORM_DIR,
+    PreflightReport,
+    ansible_playbook_cmd,
+    ensure_cyberlab_dir,
+    get_ansible_profile,
+    get_router_ips,
+    read_profile_bench,
+    read_ui_config,
+    run_preflight,
+    validate_vms,
+    write_ui_config,
+)
+from cyberlab_model import (
+    ROLES,
+    VM,
+    VMGroup,
+    dump_vms,
+    expand_vm_groups,
+    load_vms,
+    parse_vms,
+    read_vms_data,
+    vm_roles,
+)
+from cyberlab_probe import PROBE_TTL, probe_lab, probe_states
+from cyberlab_tuning import tune_playbook
+from cyberlab_w2thive import METRICS_TTL, W2THIVE_METRICS_PORT, ForwarderMetrics, fetch_metrics, xdr_address
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-TERRAFORM_DIR = os.path.join(BASE_DIR, "terraform")
-ANSIBLE_DIR = os.path.join(BASE_DIR, "ansible")
-CYBERLAB_DIR = os.path.join(BASE_DIR, ".cyberlab")
-UI_CONFIG_FILE = os.path.join(CYBERLAB_DIR, "ui_config.json")
 PLAYBOOKS_JOB_DIR = os.path.join(CYBERLAB_DIR, "playbooks")
 BATCH_PLAYBOOK_KEY = "batch"
 CLEAN_HOSTS_KEY = "clean_hosts"
+ARTIFACT_SYNC_KEY = "artifact_sync"
 ANSIBLE_TERMINAL_CACHE = "ansible"
 DEPLOY_LOG = os.path.join(CYBERLAB_DIR, "deploy.log")
 DEPLOY_STATUS_FILE = os.path.join(CYBERLAB_DIR, "deploy.status.json")
 DEPLOY_EXIT_FILE = os.path.join(CYBERLAB_DIR, "deploy.exit")
 CLEAN_HOSTS_SCRIPT = os.path.join(BASE_DIR, "scripts", "clean_known_hosts.sh")
-ROUTER_VM = "PF-01-RTR"
-DC_VM = "DC-01-SRV"
-FLEET_VM = "FLEET-01-SRV"
-SIEM_VM = "SIEM-01-SRV"
-XDR_VM = "XDR-01-SRV"
-
-TOPO_VM_ROLES = {
-    ROUTER_VM: "Gateway Router",
-    DC_VM: "Domain Controller",
-    SIEM_VM: "Elasticsearch SIEM",
-    FLEET_VM: "Elastic Fleet Server",
-    XDR_VM: "Wazuh Manager · XDR",
-    "SOC-01-SRV": "SOC · TheHive",
-    "LIN-01-WS": "Linux Workstation",
-    "WIN-01-WS": "Windows Workstation",
-}
-
-TOPO_LOG_SOURCES = (DC_VM, "LIN-01-WS", "WIN-01-WS", XDR_VM, "SOC-01-SRV")
-TOPO_WAZUH_AGENTS = (DC_VM, FLEET_VM, "LIN-01-WS", SIEM_VM, "SOC-01-SRV", "WIN-01-WS")
-TOPO_WORKSTATIONS = ("LIN-01-WS", "WIN-01-WS")
-
-TEMPLATES = [
-    "ubuntu-server-template",
-    "ubuntu-desktop-template",
-    "win11-template",
-    "win-dc-2022-template",
-]
+TOPO_ROLE_LABELS = {
+    "router": "Gateway Router",
+    "dc": "Domain Controller",
+    "siem": "Elasticsearch SIEM",
+    "fleet": "Elastic Fleet Server",
+    "xdr": "Wazuh Manager · XDR",
+    "soc": "SOC · TheHive",
+}
+# Elastic agents run everywhere except the router and the Elastic stack
+# itself; Wazuh agents everywhere except the router and the manager.
+TOPO_NO_ELASTIC_AGENT = {"router", "fleet", "siem"}
+TOPO_NO_WAZUH_AGENT = {"router", "xdr"}
+# Workstation/member pools larger than this collapse into one group node.
+TOPO_COLLAPSE_AT = 4
+# Agent host lists show at most this many names before "+N more".
+TOPO_HOST_LIST_MAX = 8
 
 PLAYBOOKS = [
     ("check_connectivity.yml", "Check Connectivity", "#3fb950"),
@@ -1011,6 +1039,44 @@ div[data-testid="stForm"] {
     min-width: 96px;
 }
 
+.probe-dot {
+    display: inline-block;
+    width: 6px;
+    height: 6px;
+    border-radius: 50%;
+    margin-right: 5px;
+    vertical-align: middle;
+}
+
+.probe-dot.probe-up {
+    background: #3fb950;
+    box-shadow: 0 0 5px rgba(63, 185, 80, 0.6);
+}
+
+.probe-dot.probe-partial {
+    background: #d29922;
+}
+
+.probe-dot.probe-down {
+    background: #f85149;
+}
+
+.topo-group summary {
+    font-size: 0.55rem;
+    color: #8b949e;
+    cursor: pointer;
+    margin-top: 4px;
+}
+
+.topo-group-hosts {
+    max-width: 260px;
+    max-height: 120px;
+    overflow-y: auto;
+    font-size: 0.55rem;
+    color: #8b949e;
+    line-height: 1.5;
+}
+
 .topo-arrow {
     font-size: 0.56rem;
     color: #484f58;
@@ -1038,40 +1104,6 @@ def subprocess_env() -> dict[str, str]:
     return env
 
 
-def ensure_cyberlab_dir():
-    os.makedirs(CYBERLAB_DIR, exist_ok=True)
-
-
-def read_ui_config() -> dict:
-    if not file_exists(UI_CONFIG_FILE):
-        return {}
-    try:
-        with open(UI_CONFIG_FILE) as f:
-            return json.load(f)
-    except Exception:
-        return {}
-
-
-def write_ui_config(config: dict):
-    ensure_cyberlab_dir()
-    with open(UI_CONFIG_FILE, "w") as f:
-        json.dump(config, f, indent=4)
-
-
-def default_router_ips() -> dict[str, str]:
-    return {"lan": "172.16.10.1/24", "wan": ""}
-
-
-def get_router_ips(config: dict | None = None) -> dict[str, str]:
-    cfg = config if config is not None else read_ui_config()
-    defaults = default_router_ips()
-    stored = cfg.get("router_ips", {})
-    return {
-        "lan": stored.get("lan", defaults["lan"]),
-        "wan": stored.get("wan", defaults["wan"]),
-    }
-
-
 def parse_disk_size_gb(size: str) -> float:
     if not size:
         return 0.0
@@ -1084,12 +1116,12 @@ def parse_disk_size_gb(size: str) -> float:
     return value * multipliers.get(unit, 1.0)
 
 
-def total_disk_gb(vms: list) -> float:
+def total_disk_gb(vms: list[VM]) -> float:
     total = 0.0
     for vm in vms:
-        for disk in vm.get("disks", []):
-            if disk.get("type") == "disk":
-                total += parse_disk_size_gb(disk.get("size", ""))
+        for disk in vm.disks:
+            if disk.type == "disk":
+                total += parse_disk_size_gb(disk.size)
     return total
 
 
@@ -1101,26 +1133,16 @@ def format_disk_gb(gb: float) -> str:
     return f"{gb:.1f}G"
 
 
-def vm_topology_ip(vm: dict, router_ips: dict[str, str]) -> str:
-    if vm.get("name") == ROUTER_VM:
+def vm_topology_ip(vm: VM, router_ips: dict[str, str]) -> str:
+    if "router" in vm.roles:
         lan = html.escape(router_ips.get("lan") or "—")
         wan = html.escape(router_ips.get("wan") or "—")
         return f'LAN <code>{lan}</code><br>WAN <code>{wan}</code>'
-    ci = vm.get("cloudinit", {})
-    if ci.get("enabled") and ci.get("ipconfig"):
-        ip = html.escape(ci["ipconfig"][0].get("ip", "") or "—")
-        return f"<code>{ip}</code>"
+    if vm.ips:
+        return f"<code>{html.escape(vm.ips[0])}</code>"
     return "—"
 
 
-def vm_short_ip(vm: dict) -> str:
-    ci = vm.get("cloudinit", {})
-    if ci.get("enabled") and ci.get("ipconfig"):
-        ip = ci["ipconfig"][0].get("ip", "")
-        return ip.split("/")[0] if ip else ""
-    return ""
-
-
 def lan_network_label(router_ips: dict[str, str]) -> str:
     lan = router_ips.get("lan", "172.16.10.1/24")
     if "/" in lan:
@@ -1130,67 +1152,153 @@ def lan_network_label(router_ips: dict[str, str]) -> str:
     return "172.16.10.0/24"
 
 
-def topo_vm_by_name(vms: list) -> dict[str, dict]:
-    return {vm["name"]: vm for vm in vms if vm.get("name")}
+def topo_role_label(vm: VM) -> str:
+    roles = vm.roles
+    if roles and roles[0] in TOPO_ROLE_LABELS:
+        return TOPO_ROLE_LABELS[roles[0]]
+    if "workstation" in roles:
+        return "Windows Workstation" if vm.is_windows else "Linux Workstation"
+    return "Domain Member"
 
 
-def topo_role_label(name: str) -> str:
-    return TOPO_VM_ROLES.get(name, "Domain Member")
+def topo_probe_dot(state: str | None) -> str:
+    if not state:
+        return ""
+    return f'<span class="probe-dot probe-{state}" title="{state}"></span>'
 
 
-def render_topo_node(name: str, vm_map: dict[str, dict], css_class: str = "") -> str:
-    vm = vm_map.get(name)
+def render_topo_node(vm: VM | None, css_class: str = "", status: dict[str, str] | None = None) -> str:
     if not vm:
         return ""
-    ip = html.escape(vm_short_ip(vm) or "—")
-    role = html.escape(topo_role_label(name))
+    ip = html.escape(vm.primary_ip or "—")
+    role = html.escape(topo_role_label(vm))
     cls = f"topo-node {css_class}".strip()
+    dot = topo_probe_dot((status or {}).get(vm.name))
     return (
         f'<div class="{cls}">'
-        f'<div class="topo-node-name">{html.escape(name)}</div>'
+        f'<div class="topo-node-name">{dot}{html.escape(vm.name)}</div>'
         f'<div class="topo-node-meta">{role}<br><code>{ip}</code></div>'
         f'</div>'
     )
 
 
-def render_topo_host_list(names: tuple[str, ...], vm_map: dict[str, dict]) -> str:
-    hosts = [html.escape(name) for name in names if name in vm_map]
+def render_topo_nodes(vms: list[VM], css_class: str = "", status: dict[str, str] | None = None) -> str:
+    return "".join(render_topo_node(vm, css_class, status) for vm in vms)
+
+
+def topo_ip_span(vms: list[VM]) -> str:
+    addrs = []
+    for vm in vms:
+        try:
+            addrs.append(ipaddress.ip_address(vm.primary_ip))
+        except ValueError:
+            continue
+    addrs.sort(key=lambda a: (a.version, int(a)))
+    if not addrs:
+        return "—"
+    if len(addrs) == 1:
+        return str(addrs[0])
+    return f"{addrs[0]} – {addrs[-1]}"
+
+
+def render_topo_group(label: str, vms: list[VM], css_class: str = "", status: dict[str, str] | None = None) -> str:
+    """One node standing for a pool of similar hosts; names sit in a <details>."""
+    status = status or {}
+    names = " · ".join(topo_probe_dot(status.get(vm.name)) + html.escape(vm.name) for vm in vms)
+    cls = f"topo-node topo-group {css_class}".strip()
+    probed = [status[vm.name] for vm in vms if vm.name in status]
+    summary = ""
+    if probed:
+        up = probed.count("up")
+        state = "up" if up == len(probed) else ("partial" if up or "partial" in probed else "down")
+        summary = f'<br>{topo_probe_dot(state)}{up}/{len(probed)} up'
+    return (
+        f'<div class="{cls}">'
+        f'<div class="topo-node-name">{len(vms)} × {html.escape(label)}</div>'
+        f'<div class="topo-node-meta"><code>{html.escape(topo_ip_span(vms))}</code>{summary}</div>'
+        f'<details><summary>hosts</summary><div class="topo-group-hosts">{names}</div></details>'
+        f'</div>'
+    )
+
+
+def render_topo_pool(vms: list[VM], css_class: str = "", status: dict[str, str] | None = None) -> str:
+    """Render hosts individually, or one group node per role label when the pool is large."""
+    if len(vms) <= TOPO_COLLAPSE_AT:
+        return render_topo_nodes(vms, css_class, status)
+    pools: dict[str, list[VM]] = {}
+    for vm in vms:
+        pools.setdefault(topo_role_label(vm), []).append(vm)
+    return "".join(render_topo_group(label, pool, css_class, status) for label, pool in pools.items())
+
+
+def render_topo_host_list(vms: list[VM]) -> str:
+    hosts = [html.escape(vm.name) for vm in vms[:TOPO_HOST_LIST_MAX]]
     if not hosts:
         return ""
+    extra = len(vms) - len(hosts)
+    if extra > 0:
+        hosts.append(f"+{extra} more")
     return " · ".join(hosts)
 
 
-def render_topo_pipeline_src(label: str, names: tuple[str, ...], vm_map: dict[str, dict]) -> str:
-    hosts = render_topo_host_list(names, vm_map)
+def render_topo_pipeline_src(label: str, vms: list[VM]) -> str:
+    hosts = render_topo_host_list(vms)
     if not hosts:
         return ""
     return (
         f'<div class="topo-pipeline-src">'
-        f'<div class="topo-pipeline-label">{html.escape(label)}</div>'
+        f'<div class="topo-pipeline-label">{html.escape(label)} · {len(vms)}</div>'
         f'<div class="topo-pipeline-hosts">{hosts}</div>'
         f'</div>'
     )
 
 
-def render_topology_graph(vms: list, router_ips: dict[str, str]) -> str:
-    vm_map = topo_vm_by_name(vms)
+def topology_key(vms: list[VM], router_ips: dict[str, str]) -> str:
+    """Digest of everything the topology graph depends on."""
+    h = hashlib.sha1()
+    for k in sorted(router_ips):
+        h.update(f"{k}={router_ips[k]}\x1e".encode())
+    for vm in vms:
+        h.update(f"{vm.name}\x1f{vm.clone}\x1f{vm.os_type}\x1f{','.join(vm.tags)}\x1f{vm.primary_ip}\x1e".encode())
+    return h.hexdigest()
+
+
+def render_topology_graph(vms: list[VM], router_ips: dict[str, str], status: dict[str, str] | None = None) -> str:
+    """Topology HTML; ``status`` maps VM name to a probe state (up/partial/down) for the overlay."""
+    return build_topology_graph(topology_key(vms, router_ips), vms, router_ips, status or {})
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def build_topology_graph(key: str, _vms: list[VM], router_ips: dict[str, str], status: dict[str, str]) -> str:
+    """Topology HTML memoized on ``key`` (see topology_key) and ``status``; ``_vms`` is not hashed."""
+    by_role: dict[str, list[VM]] = {role: [] for role in ROLES}
+    members: list[VM] = []
+    elastic_sources: list[VM] = []
+    wazuh_agents: list[VM] = []
+    for vm in _vms:
+        roles = vm.roles
+        for role in roles:
+            by_role[role].append(vm)
+        if not roles:
+            members.append(vm)
+        if not TOPO_NO_ELASTIC_AGENT.intersection(roles):
+            elastic_sources.append(vm)
+        if not TOPO_NO_WAZUH_AGENT.intersection(roles):
+            wazuh_agents.append(vm)
 
     lan = html.escape(router_ips.get("lan") or "—")
     wan = html.escape(router_ips.get("wan") or "—")
     lan_net = html.escape(lan_network_label(router_ips))
+    router_name = html.escape(", ".join(vm.name for vm in by_role["router"]) or "router")
 
-    workstations = "".join(
-        render_topo_node(name, vm_map, "ws")
-        for name in TOPO_WORKSTATIONS
-        if name in vm_map
-    )
-    dc_node = render_topo_node(DC_VM, vm_map, "dc")
+    workstations = render_topo_pool(by_role["workstation"] + members, "ws", status)
+    dc_node = render_topo_nodes(by_role["dc"], "dc", status)
 
-    elastic_agents = render_topo_pipeline_src("elastic agents", TOPO_LOG_SOURCES, vm_map)
-    fleet_node = render_topo_node(FLEET_VM, vm_map, "fleet")
-    siem_node = render_topo_node(SIEM_VM, vm_map, "siem")
-    xdr_node = render_topo_node(XDR_VM, vm_map, "xdr")
-    wazuh_agents = render_topo_pipeline_src("wazuh agents", TOPO_WAZUH_AGENTS, vm_map)
+    elastic_src = render_topo_pipeline_src("elastic agents", elastic_sources)
+    fleet_node = render_topo_nodes(by_role["fleet"], "fleet", status)
+    siem_node = render_topo_nodes(by_role["siem"], "siem", status)
+    xdr_node = render_topo_nodes(by_role["xdr"], "xdr", status)
+    wazuh_src = render_topo_pipeline_src("wazuh agents", wazuh_agents)
 
     domain_lane = ""
     if dc_node or workstations:
@@ -1206,11 +1314,11 @@ def render_topology_graph(vms: list, router_ips: dict[str, str]) -> str:
 </div>'''
 
     siem_lane = ""
-    if elastic_agents and (fleet_node or siem_node):
+    if elastic_src and (fleet_node or siem_node):
         siem_lane = f'''<div class="topo-lane">
   <div class="topo-lane-title">Log pipeline · Elastic Stack</div>
   <div class="topo-pipeline">
-    <div class="topo-pipeline-src">{elastic_agents}</div>
+    <div class="topo-pipeline-src">{elastic_src}</div>
     <span class="topo-arrow">logs →</span>
     {fleet_node}
     <span class="topo-arrow">ingest →</span>
@@ -1219,13 +1327,13 @@ def render_topology_graph(vms: list, router_ips: dict[str, str]) -> str:
 </div>'''
 
     xdr_lane = ""
-    if xdr_node and wazuh_agents:
+    if xdr_node and wazuh_src:
         xdr_lane = f'''<div class="topo-lane">
   <div class="topo-lane-title">Endpoint protection · Wazuh XDR</div>
   <div class="topo-pipeline">
     {xdr_node}
     <span class="topo-arrow">manages →</span>
-    <div class="topo-pipeline-src">{wazuh_agents}</div>
+    <div class="topo-pipeline-src">{wazuh_src}</div>
   </div>
 </div>'''
 
@@ -1237,7 +1345,7 @@ def render_topology_graph(vms: list, router_ips: dict[str, str]) -> str:
   </div>
   <div class="topo-vline"></div>
   <div class="topo-router">
-    <div class="topo-router-name">{html.escape(ROUTER_VM)}</div>
+    <div class="topo-router-name">{router_name}</div>
     <div class="topo-router-iface">WAN <code>{wan}</code><br>LAN <code>{lan}</code></div>
   </div>
   <div class="topo-vline"></div>
@@ -1315,6 +1423,8 @@ def is_ansible_busy() -> bool:
         return True
     if is_playbook_job_running(CLEAN_HOSTS_KEY):
         return True
+    if is_playbook_job_running(ARTIFACT_SYNC_KEY):
+        return True
     if is_playbook_job_running(BATCH_PLAYBOOK_KEY):
         return True
     return any(is_playbook_job_running(playbook_job_key(pb_file)) for pb_file, _, _ in PLAYBOOKS)
@@ -1323,6 +1433,7 @@ def is_ansible_busy() -> bool:
 def resolve_ansible_terminal() -> tuple[str, dict, str]:
     candidates: list[tuple[str, str]] = [
         (CLEAN_HOSTS_KEY, "cyberlab@ansible — clean ssh keys"),
+        (ARTIFACT_SYNC_KEY, "cyberlab@ansible — artifact cache"),
         (BATCH_PLAYBOOK_KEY, "cyberlab@ansible — batch"),
     ]
     candidates += [
@@ -1777,10 +1888,6 @@ def stop_playbook_job(key: str) -> bool:
     return True
 
 
-def check_tool(name: str) -> str | None:
-    return shutil.which(name)
-
-
 def highlight_terminal_output(text: str) -> str:
     raw_lines = text.split("\n")
     lines = []
@@ -2025,40 +2132,132 @@ def pb_card_html(idx: int, name: str, filename: str, color: str) -> str:
     </div>'''
 
 
+def vm_ip_sort_key(vm: VM) -> tuple[int, int, int, int]:
+    """Static addresses in numeric order (IPv4 first), then DHCP or unparsable ones by VMID."""
+    try:
+        addr = ipaddress.ip_address(vm.primary_ip)
+    except ValueError:
+        return (1, 0, 0, vm.vmid)
+    return (0, addr.version, int(addr), vm.vmid)
+
+
+VM_TABLE_SORTS = {
+    "Tier": lambda vm: (vm.tier, vm.vmid),
+    "Name": lambda vm: vm.name.lower(),
+    "VMID": lambda vm: vm.vmid,
+    "Template": lambda vm: (vm.clone, vm.vmid),
+    "RAM": lambda vm: (vm.memory, vm.vmid),
+    "IP": vm_ip_sort_key,
+}
+
+
+def render_vm_table(vms: list[VM], router_ips: dict[str, str]):
+    """Sortable, paginated VM grid; only the visible page is turned into HTML."""
+    c1, c2, c3 = st.columns([2, 1, 1], vertical_alignment="bottom")
+    with c1:
+        sort_by = st.selectbox("Sort by", list(VM_TABLE_SORTS), key="vm_table_sort")
+    with c2:
+        descending = st.toggle("Descending", key="vm_table_desc")
+    with c3:
+        page_size = st.selectbox("Rows", [25, 50, 100], key="vm_table_rows")
+    ordered = sorted(vms, key=VM_TABLE_SORTS[sort_by], reverse=descending)
+    page = paginate(len(ordered), page_size, "vm_table_page")
+
+    rows = []
+    for vm in ordered[page * page_size:(page + 1) * page_size]:
+        tn = vm.tier
+        ct = "full" if vm.full_clone else "linked"
+        ip = vm_topology_ip(vm, router_ips)
+        rows.append(
+            f'<tr><td><span class="tier-badge tier-{tn}">T{tn}</span></td><td><strong>{html.escape(vm.name)}</strong></td>'
+            f'<td>{vm.vmid}</td><td>{html.escape(vm.clone)}</td><td>{vm.cores}c / {vm.memory}M</td>'
+            f'<td>{html.escape(vm.os_disk_size)}</td><td class="clone-{ct}">{ct}</td><td>{ip}</td></tr>'
+        )
+    st.markdown(
+        '<table class="vm-table"><thead><tr><th>Tier</th><th>Name</th><th>VMID</th><th>Template</th>'
+        '<th>CPU/RAM</th><th>Disk</th><th>Clone</th><th>IP</th></tr></thead>'
+        f'<tbody>{"".join(rows)}</tbody></table>',
+        unsafe_allow_html=True,
+    )
+
+
 # ---------------------------------------------------------------------------
 # Pages
 # ---------------------------------------------------------------------------
 
-def page_dashboard():
-    st.markdown(hero("Dashboard"), unsafe_allow_html=True)
-    st.markdown('<div class="hero-sub">CyberLab environment overview</div>', unsafe_allow_html=True)
+def _topology_fragment(vms: list[VM], router_ips: dict[str, str], live: bool):
+    status: dict[str, str] = {}
+    if live:
+        results = probe_lab(vms)
+        status = probe_states(results)
+        up = sum(state == "up" for state in status.values())
+        st.caption(f"{up}/{len(status)} hosts reachable · probed {time.strftime('%H:%M:%S')}")
+    st.markdown(render_topology_graph(vms, router_ips, status), unsafe_allow_html=True)
 
-    tools = {"terraform": check_tool("terraform"), "ansible": check_tool("ansible"), "ansible-playbook": check_tool("ansible-playbook")}
-    files_check = {
-        "terraform.tfvars": os.path.join(TERRAFORM_DIR, "terraform.tfvars"),
-        "vms.json": os.path.join(TERRAFORM_DIR, "vms.json"),
-        ".vault_pass": os.path.join(ANSIBLE_DIR, ".vault_pass"),
-        "secret_vault.yml": os.path.join(ANSIBLE_DIR, "inventory", "group_vars", "secret_vault.yml"),
-    }
 
+PREFLIGHT_CARD_TEXT = {
+    "tool": ("ready", "missing", "err"),
+    "file": ("found", "missing", "warn"),
+    "terraform": ("yes", "no", "warn"),
+    "galaxy": ("installed", "missing", "warn"),
+}
+
+
+def render_preflight_grid(report: PreflightReport):
     cards = '<div class="status-grid">'
-    for t, path in tools.items():
-        cards += status_card(t, "ready" if path else "missing", "ok-status" if path else "err")
-    for name, path in files_check.items():
-        cards += status_card(name, "found" if file_exists(path) else "missing", "ok-status" if file_exists(path) else "warn")
-    tf_init = file_exists(os.path.join(TERRAFORM_DIR, ".terraform"))
-    cards += status_card("tf init", "yes" if tf_init else "no", "ok-status" if tf_init else "warn")
+    for check in report.checks:
+        ok_text, bad_text, bad_cls = PREFLIGHT_CARD_TEXT[check.kind]
+        cards += status_card(check.name, ok_text if check.ok else bad_text, "ok-status" if check.ok else bad_cls)
     cards += '</div>'
     st.markdown(cards, unsafe_allow_html=True)
 
+
+def render_w2thive_metrics(metrics: ForwarderMetrics):
+    cards = '<div class="status-grid">'
+    cards += status_card("received", str(metrics.received))
+    cards += status_card("filtered", str(metrics.filtered))
+    cards += status_card("forwarded", str(metrics.forwarded), "ok-status")
+    cards += status_card("aggregated", str(metrics.aggregated))
+    cards += status_card("failed", str(metrics.failed), "err" if metrics.failed else "ok")
+    cards += status_card("queue depth", str(metrics.backlog), "err" if metrics.spool_full else "warn" if metrics.queue.get("retry") else "ok")
+    for quantile, ms in metrics.latency_ms.items():
+        cards += status_card(f"thehive {quantile}", f"{ms:.0f} ms")
+    cards += '</div>'
+    st.markdown(cards, unsafe_allow_html=True)
+    routes = " · ".join(f"{route}: {fwd} fwd / {drop} drop" for route, (fwd, drop) in sorted(metrics.routes.items()))
+    note = f"backing off after {metrics.retrying} failed requests · " if metrics.retrying else ""
+    if metrics.spool_full:
+        note = "spool full, alerts sent inline · " + note
+    st.caption(f"{note}{routes or 'no alerts routed yet'} · up {timedelta(seconds=int(metrics.uptime))}")
+
+
+def _w2thive_fragment(host: str):
+    try:
+        metrics = fetch_metrics(host)
+    except OSError as e:
+        st.caption(f"w2thive-forwarder metrics unavailable on {host}:{W2THIVE_METRICS_PORT} ({e})")
+        return
+    render_w2thive_metrics(metrics)
+
+
+def page_dashboard():
+    st.markdown(hero("Dashboard"), unsafe_allow_html=True)
+    st.markdown('<div class="hero-sub">CyberLab environment overview</div>', unsafe_allow_html=True)
+
+    render_preflight_grid(run_preflight())
+    if st.button("Re-check", key="preflight_recheck"):
+        run_preflight(force=True)
+        st.rerun()
+
     vm_count = count_deployed_vms(os.path.join(TERRAFORM_DIR, "terraform.tfstate"))
 
     vms_path = os.path.join(TERRAFORM_DIR, "vms.json")
-    vms = []
+    vms: list[VM] = []
     if file_exists(vms_path):
-        with open(vms_path) as f:
-            data = json.load(f)
-        vms = data.get("vms", [])
+        try:
+            vms = load_vms(vms_path)
+        except (ValueError, OSError) as e:
+            st.error(f"vms.json could not be loaded: {e}")
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -2066,7 +2265,7 @@ def page_dashboard():
     with col2:
         st.markdown(f'<div class="metric-big">{vm_count}</div><div class="metric-label">VMs Deployed</div>', unsafe_allow_html=True)
     with col3:
-        total_ram = sum(v.get("memory", 0) for v in vms)
+        total_ram = sum(v.memory for v in vms)
         st.markdown(f'<div class="metric-big">{total_ram // 1024}G</div><div class="metric-label">Total RAM</div>', unsafe_allow_html=True)
     with col4:
         total_disk = format_disk_gb(total_disk_gb(vms))
@@ -2075,16 +2274,28 @@ def page_dashboard():
     if vms:
         section("lab topology")
         router_ips = get_router_ips()
-        st.markdown(render_topology_graph(vms, router_ips), unsafe_allow_html=True)
-        rows = ""
-        for vm in vms:
-            deps = vm.get("depends_on", [])
-            tn = 0 if not deps else (1 if len(deps) == 1 else 2)
-            ct = "linked" if not vm.get("full_clone", True) else "full"
-            disk = next((d.get("size", "") for d in vm.get("disks", []) if d.get("type") == "disk"), "")
-            ip = vm_topology_ip(vm, router_ips)
-            rows += f'<tr><td><span class="tier-badge tier-{tn}">T{tn}</span></td><td><strong>{vm["name"]}</strong></td><td>{vm["vmid"]}</td><td>{vm.get("clone","")}</td><td>{vm.get("cpu",{}).get("cores","")}c / {vm.get("memory","")}M</td><td>{disk}</td><td class="clone-{ct}">{ct}</td><td>{ip}</td></tr>'
-        st.markdown(f'<table class="vm-table"><thead><tr><th>Tier</th><th>Name</th><th>VMID</th><th>Template</th><th>CPU/RAM</th><th>Disk</th><th>Clone</th><th>IP</th></tr></thead><tbody>{rows}</tbody></table>', unsafe_allow_html=True)
+        live = st.toggle(
+            "Live reachability",
+            key="topo_live",
+            help=f"Probe SSH/WinRM and service ports on every host every {int(PROBE_TTL)}s.",
+        )
+        topology = (
+            st.fragment(run_every=timedelta(seconds=PROBE_TTL))(_topology_fragment)
+            if live
+            else st.fragment(_topology_fragment)
+        )
+        topology(vms, router_ips, live)
+        xdr_host = xdr_address(vms)
+        if xdr_host:
+            section("wazuh → thehive")
+            if st.toggle(
+                "Forwarder metrics",
+                key="w2thive_live",
+                help=f"Read w2thive-forwarder metrics from {xdr_host}:{W2THIVE_METRICS_PORT} every {int(METRICS_TTL)}s.",
+            ):
+                st.fragment(run_every=timedelta(seconds=METRICS_TTL))(_w2thive_fragment)(xdr_host)
+        section("virtual machines")
+        render_vm_table(vms, router_ips)
 
 
 def page_terraform_config():
@@ -2195,96 +2406,233 @@ def _sshkeys_to_text(keys) -> str:
     return "\n".join(keys)
 
 
-def sanitize_disk(disk: dict) -> dict:
-    out: dict = {"slot": disk["slot"], "type": disk["type"], "storage": disk["storage"]}
-    if disk["type"] != "disk":
-        return out
-    if disk.get("size"):
-        out["size"] = disk["size"]
-    if disk.get("iothread"):
-        out["iothread"] = True
-    if disk.get("discard"):
-        out["discard"] = True
-    if disk.get("cache"):
-        out["cache"] = disk["cache"]
-    return out
-
-
-def sanitize_ipconfig_entry(entry: dict) -> dict:
-    out: dict = {}
-    if entry.get("interface"):
-        out["interface"] = entry["interface"]
-    if entry.get("ip"):
-        out["ip"] = entry["ip"]
-    if entry.get("gateway"):
-        out["gateway"] = entry["gateway"]
-    return out
-
-
-def sanitize_cloudinit(ci: dict) -> dict:
-    out: dict = {"enabled": True}
-    if ci.get("nameserver"):
-        out["nameserver"] = ci["nameserver"]
-    if ci.get("searchdomain"):
-        out["searchdomain"] = ci["searchdomain"]
-    keys = ci.get("sshkeys") or []
-    if keys:
-        out["sshkeys"] = keys
-    ipconfig = [sanitize_ipconfig_entry(e) for e in ci.get("ipconfig", []) if e.get("ip")]
-    if ipconfig:
-        out["ipconfig"] = ipconfig
-    return out
-
-
-def sanitize_vm(vm: dict) -> dict:
-    out: dict = {
-        "name": vm["name"],
-        "vmid": int(vm["vmid"]),
-        "target_node": vm["target_node"],
-        "clone": vm["clone"],
-        "full_clone": bool(vm["full_clone"]),
-    }
-    if vm.get("onboot"):
-        out["onboot"] = True
-    tags = vm.get("tags") or []
-    if tags:
-        out["tags"] = tags
-    out["cpu"] = {
-        "cores": int(vm["cpu"]["cores"]),
-        "sockets": int(vm["cpu"]["sockets"]),
-        "type": vm["cpu"]["type"],
-    }
-    if vm.get("bios") == "ovmf":
-        out["bios"] = "ovmf"
-        out["machine"] = vm.get("machine", "q35")
-        out["efi_storage"] = vm.get("efi_storage", "Internal")
-    out["memory"] = int(vm["memory"])
-    if vm.get("balloon") is not None:
-        out["balloon"] = int(vm["balloon"])
-    if vm.get("serial"):
-        out["serial"] = {"id": int(vm["serial"]["id"]), "type": vm["serial"]["type"]}
-    out["scsihw"] = vm["scsihw"]
-    out["bootdisk"] = vm["bootdisk"]
-    out["disks"] = [sanitize_disk(d) for d in vm.get("disks", [])]
-    out["networks"] = [
-        {
-            "id": int(n["id"]),
-            "model": n["model"],
-            "bridge": n["bridge"],
-            "firewall": bool(n.get("firewall", True)),
-        }
-        for n in vm.get("networks", [])
-    ]
-    ci = vm.get("cloudinit")
-    if ci and ci.get("enabled"):
-        out["cloudinit"] = sanitize_cloudinit(ci)
-    agent = int(vm.get("agent", 0))
-    if agent:
-        out["agent"] = agent
-    deps = vm.get("depends_on") or []
+def render_vm_conflicts(conflicts: list[tuple[str, str]]):
+    lines = "\n".join(f"- **{name}**: {msg}" for name, msg in conflicts)
+    st.error(f"vms.json has {len(conflicts)} conflict(s):\n\n{lines}")
+
+
+def load_vms_conflicts(vms_path: str) -> list[tuple[str, str]]:
+    try:
+        vms = load_vms(vms_path)
+    except (ValueError, OSError) as e:
+        return [("vms.json", f"cannot be loaded: {e}")]
+    return validate_vms(vms)
+
+
+def vm_matches(vm: dict, query: str, tiers: list[int]) -> bool:
+    if tiers and min(len(vm.get("depends_on", [])), 2) not in tiers:
+        return False
+    if not query:
+        return True
+    q = query.lower()
+    ips = [e.get("ip", "") for e in vm.get("cloudinit", {}).get("ipconfig", [])]
+    haystack = [vm.get("name", ""), vm.get("clone", ""), str(vm.get("vmid", ""))] + vm.get("tags", []) + ips
+    return any(q in str(h).lower() for h in haystack)
+
+
+def vm_draft_changed(draft: dict, base: VM) -> bool:
+    try:
+        return VM.from_dict(draft) != base
+    except ValueError:
+        return True
+
+
+def paginate(total: int, page_size: int, key: str) -> int:
+    """Render a page picker when needed and return the zero-based page index."""
+    pages = max(1, -(-total // page_size))
+    if pages == 1:
+        return 0
+    # The keyed widget reads its value from session state only; passing value= as well
+    # makes Streamlit warn on every rerun that clamps the page.
+    if key not in st.session_state:
+        st.session_state[key] = 1
+    elif st.session_state[key] > pages:
+        st.session_state[key] = pages
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, key=key)
+    return min(int(page), pages) - 1
+
+
+def render_vm_fields(i: int, vm: dict, all_names: list[str], router_ips: dict[str, str]):
+    """Edit widgets for one VM; mutates ``vm`` in place. Only called for VMs the user opened."""
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        vm["name"] = st.text_input("Name", vm["name"], key=f"name_{i}")
+        vm["vmid"] = st.number_input("VMID", value=vm["vmid"], key=f"vmid_{i}")
+        vm["clone"] = st.text_input("Template", vm.get("clone", ""), key=f"clone_{i}")
+        vm["target_node"] = st.text_input("Node", vm.get("target_node", "proxmox"), key=f"node_{i}")
+        tags_text = st.text_input("Tags (comma-separated)", ", ".join(vm.get("tags", [])), key=f"tags_{i}")
+        vm["tags"] = [t.strip() for t in tags_text.split(",") if t.strip()]
+        vm["onboot"] = st.checkbox("On boot", value=vm.get("onboot", False), key=f"onboot_{i}")
+    with col2:
+        cpu = vm.get("cpu", {})
+        cpu["cores"] = st.number_input("Cores", value=cpu.get("cores", 1), min_value=1, key=f"cores_{i}")
+        cpu["sockets"] = st.number_input("Sockets", value=cpu.get("sockets", 1), min_value=1, key=f"sockets_{i}")
+        cpu["type"] = st.text_input("CPU type", cpu.get("type", "host"), key=f"cpu_type_{i}")
+        vm["cpu"] = cpu
+        vm["memory"] = st.number_input("RAM (MB)", value=vm.get("memory", 1024), step=512, key=f"mem_{i}")
+        vm["balloon"] = st.number_input("Balloon (MB)", value=vm.get("balloon", vm.get("memory", 1024)), step=512, key=f"balloon_{i}")
+    with col3:
+        vm["full_clone"] = st.selectbox(
+            "Clone", [True, False],
+            index=0 if vm.get("full_clone", True) else 1,
+            format_func=lambda x: "Full" if x else "Linked",
+            key=f"fc_{i}",
+        )
+        vm["scsihw"] = st.text_input("SCSI HW", vm.get("scsihw", "virtio-scsi-single"), key=f"scsihw_{i}")
+        vm["bootdisk"] = st.text_input("Boot disk", vm.get("bootdisk", "scsi0"), key=f"bootdisk_{i}")
+        vm["agent"] = 1 if st.checkbox(
+            "QEMU agent", value=bool(vm.get("agent", 0)), key=f"agent_{i}",
+        ) else 0
+
+    other_names = [n for j, n in enumerate(all_names) if j != i]
+    deps = st.multiselect(
+        "Depends on",
+        options=other_names,
+        default=[d for d in vm.get("depends_on", []) if d in other_names],
+        key=f"deps_{i}",
+    )
     if deps:
-        out["depends_on"] = deps
-    return out
+        vm["depends_on"] = deps
+    else:
+        vm.pop("depends_on", None)
+
+    section("firmware & serial")
+    fw1, fw2, fw3, fw4 = st.columns(4, vertical_alignment="bottom")
+    with fw1:
+        uefi = st.checkbox("UEFI (OVMF)", value=vm.get("bios") == "ovmf", key=f"uefi_{i}")
+    if uefi:
+        vm["bios"] = "ovmf"
+        with fw2:
+            vm["machine"] = st.text_input("Machine", vm.get("machine", "q35"), key=f"machine_{i}")
+        with fw3:
+            vm["efi_storage"] = st.text_input("EFI storage", vm.get("efi_storage", "Internal"), key=f"efi_{i}")
+    else:
+        vm.pop("bios", None)
+        vm.pop("machine", None)
+        vm.pop("efi_storage", None)
+
+    has_serial = vm.get("serial") is not None
+    with fw4:
+        use_serial = st.checkbox("Serial console", value=has_serial, key=f"serial_en_{i}")
+    if use_serial:
+        serial = vm.get("serial", {"id": 0, "type": "socket"})
+        s1, s2 = st.columns(2)
+        with s1:
+            serial["id"] = st.number_input("Serial ID", value=serial.get("id", 0), min_value=0, key=f"serial_id_{i}")
+        with s2:
+            serial["type"] = st.text_input("Serial type", serial.get("type", "socket"), key=f"serial_type_{i}")
+        vm["serial"] = serial
+    else:
+        vm.pop("serial", None)
+
+    section("disks")
+    for di, disk in enumerate(vm.get("disks", [])):
+        dc1, dc2, dc3, dc4, dc5, dc6, dc7 = st.columns(7, vertical_alignment="bottom")
+        with dc1:
+            disk["slot"] = st.text_input("Slot", disk.get("slot", ""), key=f"disk_slot_{i}_{di}")
+        with dc2:
+            disk["type"] = st.selectbox(
+                "Type", ["disk", "cloudinit"],
+                index=0 if disk.get("type", "disk") == "disk" else 1,
+                key=f"disk_type_{i}_{di}",
+            )
+        with dc3:
+            disk["storage"] = st.text_input("Storage", disk.get("storage", ""), key=f"disk_storage_{i}_{di}")
+        with dc4:
+            if disk["type"] == "disk":
+                disk["size"] = st.text_input("Size", disk.get("size", ""), key=f"disk_size_{i}_{di}")
+            else:
+                disk.pop("size", None)
+                disk.pop("cache", None)
+                disk.pop("iothread", None)
+                disk.pop("discard", None)
+        with dc5:
+            if disk["type"] == "disk":
+                cache = disk.get("cache", "")
+                disk["cache"] = st.text_input("Cache", cache, key=f"disk_cache_{i}_{di}")
+                if not disk["cache"]:
+                    disk.pop("cache", None)
+        with dc6:
+            if disk["type"] == "disk":
+                disk["iothread"] = st.checkbox("IO thread", value=disk.get("iothread", False), key=f"disk_iothread_{i}_{di}")
+                if not disk["iothread"]:
+                    disk.pop("iothread", None)
+        with dc7:
+            if disk["type"] == "disk":
+                disk["discard"] = st.checkbox("Discard (TRIM)", value=disk.get("discard", False), key=f"disk_discard_{i}_{di}")
+                if not disk["discard"]:
+                    disk.pop("discard", None)
+
+    section("networks")
+    for ni, net in enumerate(vm.get("networks", [])):
+        nc1, nc2, nc3, nc4 = st.columns(4, vertical_alignment="bottom")
+        with nc1:
+            net["id"] = st.number_input("Net ID", value=net.get("id", ni), min_value=0, key=f"net_id_{i}_{ni}")
+        with nc2:
+            net["model"] = st.text_input("Model", net.get("model", "virtio"), key=f"net_model_{i}_{ni}")
+        with nc3:
+            net["bridge"] = st.text_input("Bridge", net.get("bridge", "vmbr1"), key=f"net_bridge_{i}_{ni}")
+        with nc4:
+            net["firewall"] = st.checkbox("Firewall", value=net.get("firewall", True), key=f"net_fw_{i}_{ni}")
+
+    ci = vm.get("cloudinit", {})
+    ci_enabled = st.checkbox("Cloud-init", value=ci.get("enabled", False), key=f"ci_en_{i}")
+    if ci_enabled:
+        ci["enabled"] = True
+        section("cloud-init")
+        c1, c2 = st.columns(2)
+        with c1:
+            if not ci.get("ipconfig"):
+                ci["ipconfig"] = [{"interface": "net0", "ip": "", "gateway": ""}]
+            ci["ipconfig"][0]["interface"] = st.text_input(
+                "Interface", ci["ipconfig"][0].get("interface", "net0"), key=f"ci_iface_{i}",
+            )
+            ci["ipconfig"][0]["ip"] = st.text_input(
+                "IP/CIDR", ci["ipconfig"][0].get("ip", ""), key=f"ip_{i}",
+            )
+            ci["ipconfig"][0]["gateway"] = st.text_input(
+                "Gateway", ci["ipconfig"][0].get("gateway", ""), key=f"gw_{i}",
+            )
+        with c2:
+            ns = st.text_input("DNS", ci.get("nameserver", ""), key=f"ns_{i}")
+            ci["nameserver"] = ns or None
+            if not ci["nameserver"]:
+                ci.pop("nameserver", None)
+            sd = st.text_input("Domain", ci.get("searchdomain", ""), key=f"sd_{i}")
+            ci["searchdomain"] = sd or None
+            if not ci["searchdomain"]:
+                ci.pop("searchdomain", None)
+        ssh_text = st.text_area(
+            "SSH keys (one per line)",
+            value=_sshkeys_to_text(ci.get("sshkeys")),
+            key=f"sshkeys_{i}",
+            height=120,
+        )
+        keys = _lines_to_list(ssh_text)
+        if keys:
+            ci["sshkeys"] = keys
+        else:
+            ci.pop("sshkeys", None)
+        gw = ci["ipconfig"][0].get("gateway", "")
+        if not gw:
+            ci["ipconfig"][0].pop("gateway", None)
+        vm["cloudinit"] = ci
+    else:
+        vm.pop("cloudinit", None)
+
+    if "router" in vm_roles(vm["name"], vm["clone"], vm.get("tags", [])):
+        section("router interfaces (template)")
+        st.caption("Configured in pfSense template — stored locally, not in vms.json.")
+        r1, r2 = st.columns(2)
+        with r1:
+            router_ips["lan"] = st.text_input(
+                "LAN IP (vmbr1)", router_ips.get("lan", "172.16.10.1/24"), key=f"router_lan_{i}",
+            )
+        with r2:
+            router_ips["wan"] = st.text_input(
+                "WAN IP (vmbr0)", router_ips.get("wan", ""), key=f"router_wan_{i}",
+                placeholder="e.g. dhcp or 203.0.113.1/24",
+            )
 
 
 def page_vm_editor():
@@ -2301,205 +2649,84 @@ def page_vm_editor():
             st.rerun()
         return
 
-    with open(vms_path) as f:
-        data = json.load(f)
-    vms = data.get("vms", [])
-    all_names = [v["name"] for v in vms]
+    try:
+        data = read_vms_data(vms_path)
+        base_models = load_vms(vms_path, expand=False)
+    except (ValueError, OSError) as e:
+        st.error(f"vms.json could not be loaded: {e}")
+        return
+    vms = [vm.to_dict() for vm in base_models]
     router_ips = get_router_ips()
+    vm_groups = data.get("vm_groups", [])
+    if vm_groups:
+        generated = sum(int(g.get("count", 0)) for g in vm_groups)
+        st.caption(
+            f"{len(vm_groups)} VM group(s) in vms.json expand to {generated} more VM(s) at deploy time "
+            "— edit `vm_groups` in the file to change them."
+        )
 
-    for i, vm in enumerate(vms):
+    sig = os.stat(vms_path).st_mtime_ns
+    if st.session_state.get("vm_edits_sig") != sig:
+        st.session_state.vm_edits_sig = sig
+        st.session_state.vm_edits = {}
+        st.session_state.vm_router_ips = router_ips
+    edits: dict[int, dict] = st.session_state.vm_edits
+    router_ips = st.session_state.vm_router_ips
+    current = [edits.get(i, vm) for i, vm in enumerate(vms)]
+    all_names = [v["name"] for v in current]
+
+    f1, f2, f3 = st.columns([3, 2, 1], vertical_alignment="bottom")
+    with f1:
+        query = st.text_input("Search", placeholder="name, template, tag or IP", key="vm_search")
+    with f2:
+        tiers = st.multiselect("Tier", [0, 1, 2], format_func=lambda t: f"T{t}", key="vm_tier_filter")
+    with f3:
+        page_size = st.selectbox("Per page", [10, 25, 50, 100], key="vm_page_size")
+    matches = [i for i, vm in enumerate(current) if vm_matches(vm, query, tiers)]
+    page = paginate(len(matches), page_size, "vm_page")
+    st.caption(f"{len(matches)} of {len(current)} VMs · {len(edits)} unsaved change(s)")
+
+    for i in matches[page * page_size:(page + 1) * page_size]:
+        vm = current[i]
         deps = vm.get("depends_on", [])
-        tn = 0 if not deps else (1 if len(deps) == 1 else 2)
-        label = f"`T{tn}` **{vm['name']}** -- {vm.get('clone', '')} -- VMID {vm['vmid']}"
-        with st.expander(label, expanded=False):
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                vm["name"] = st.text_input("Name", vm["name"], key=f"name_{i}")
-                vm["vmid"] = st.number_input("VMID", value=vm["vmid"], key=f"vmid_{i}")
-                vm["clone"] = st.text_input("Template", vm.get("clone", ""), key=f"clone_{i}")
-                vm["target_node"] = st.text_input("Node", vm.get("target_node", "proxmox"), key=f"node_{i}")
-                tags_text = st.text_input("Tags (comma-separated)", ", ".join(vm.get("tags", [])), key=f"tags_{i}")
-                vm["tags"] = [t.strip() for t in tags_text.split(",") if t.strip()]
-                vm["onboot"] = st.checkbox("On boot", value=vm.get("onboot", False), key=f"onboot_{i}")
-            with col2:
-                cpu = vm.get("cpu", {})
-                cpu["cores"] = st.number_input("Cores", value=cpu.get("cores", 1), min_value=1, key=f"cores_{i}")
-                cpu["sockets"] = st.number_input("Sockets", value=cpu.get("sockets", 1), min_value=1, key=f"sockets_{i}")
-                cpu["type"] = st.text_input("CPU type", cpu.get("type", "host"), key=f"cpu_type_{i}")
-                vm["cpu"] = cpu
-                vm["memory"] = st.number_input("RAM (MB)", value=vm.get("memory", 1024), step=512, key=f"mem_{i}")
-                vm["balloon"] = st.number_input("Balloon (MB)", value=vm.get("balloon", vm.get("memory", 1024)), step=512, key=f"balloon_{i}")
-            with col3:
-                vm["full_clone"] = st.selectbox(
-                    "Clone", [True, False],
-                    index=0 if vm.get("full_clone", True) else 1,
-                    format_func=lambda x: "Full" if x else "Linked",
-                    key=f"fc_{i}",
-                )
-                vm["scsihw"] = st.text_input("SCSI HW", vm.get("scsihw", "virtio-scsi-single"), key=f"scsihw_{i}")
-                vm["bootdisk"] = st.text_input("Boot disk", vm.get("bootdisk", "scsi0"), key=f"bootdisk_{i}")
-                vm["agent"] = 1 if st.checkbox(
-                    "QEMU agent", value=bool(vm.get("agent", 0)), key=f"agent_{i}",
-                ) else 0
-
-            other_names = [n for j, n in enumerate(all_names) if j != i]
-            deps = st.multiselect(
-                "Depends on",
-                options=other_names,
-                default=[d for d in vm.get("depends_on", []) if d in other_names],
-                key=f"deps_{i}",
-            )
-            if deps:
-                vm["depends_on"] = deps
-            else:
-                vm.pop("depends_on", None)
-
-            section("firmware & serial")
-            fw1, fw2, fw3, fw4 = st.columns(4, vertical_alignment="bottom")
-            with fw1:
-                uefi = st.checkbox("UEFI (OVMF)", value=vm.get("bios") == "ovmf", key=f"uefi_{i}")
-            if uefi:
-                vm["bios"] = "ovmf"
-                with fw2:
-                    vm["machine"] = st.text_input("Machine", vm.get("machine", "q35"), key=f"machine_{i}")
-                with fw3:
-                    vm["efi_storage"] = st.text_input("EFI storage", vm.get("efi_storage", "Internal"), key=f"efi_{i}")
-            else:
-                vm.pop("bios", None)
-                vm.pop("machine", None)
-                vm.pop("efi_storage", None)
-
-            has_serial = vm.get("serial") is not None
-            with fw4:
-                use_serial = st.checkbox("Serial console", value=has_serial, key=f"serial_en_{i}")
-            if use_serial:
-                serial = vm.get("serial", {"id": 0, "type": "socket"})
-                s1, s2 = st.columns(2)
-                with s1:
-                    serial["id"] = st.number_input("Serial ID", value=serial.get("id", 0), min_value=0, key=f"serial_id_{i}")
-                with s2:
-                    serial["type"] = st.text_input("Serial type", serial.get("type", "socket"), key=f"serial_type_{i}")
-                vm["serial"] = serial
-            else:
-                vm.pop("serial", None)
-
-            section("disks")
-            for di, disk in enumerate(vm.get("disks", [])):
-                dc1, dc2, dc3, dc4, dc5, dc6, dc7 = st.columns(7, vertical_alignment="bottom")
-                with dc1:
-                    disk["slot"] = st.text_input("Slot", disk.get("slot", ""), key=f"disk_slot_{i}_{di}")
-                with dc2:
-                    disk["type"] = st.selectbox(
-                        "Type", ["disk", "cloudinit"],
-                        index=0 if disk.get("type", "disk") == "disk" else 1,
-                        key=f"disk_type_{i}_{di}",
-                    )
-                with dc3:
-                    disk["storage"] = st.text_input("Storage", disk.get("storage", ""), key=f"disk_storage_{i}_{di}")
-                with dc4:
-                    if disk["type"] == "disk":
-                        disk["size"] = st.text_input("Size", disk.get("size", ""), key=f"disk_size_{i}_{di}")
-                    else:
-                        disk.pop("size", None)
-                        disk.pop("cache", None)
-                        disk.pop("iothread", None)
-                        disk.pop("discard", None)
-                with dc5:
-                    if disk["type"] == "disk":
-                        cache = disk.get("cache", "")
-                        disk["cache"] = st.text_input("Cache", cache, key=f"disk_cache_{i}_{di}")
-                        if not disk["cache"]:
-                            disk.pop("cache", None)
-                with dc6:
-                    if disk["type"] == "disk":
-                        disk["iothread"] = st.checkbox("IO thread", value=disk.get("iothread", False), key=f"disk_iothread_{i}_{di}")
-                        if not disk["iothread"]:
-                            disk.pop("iothread", None)
-                with dc7:
-                    if disk["type"] == "disk":
-                        disk["discard"] = st.checkbox("Discard (TRIM)", value=disk.get("discard", False), key=f"disk_discard_{i}_{di}")
-                        if not disk["discard"]:
-                            disk.pop("discard", None)
-
-            section("networks")
-            for ni, net in enumerate(vm.get("networks", [])):
-                nc1, nc2, nc3, nc4 = st.columns(4, vertical_alignment="bottom")
-                with nc1:
-                    net["id"] = st.number_input("Net ID", value=net.get("id", ni), min_value=0, key=f"net_id_{i}_{ni}")
-                with nc2:
-                    net["model"] = st.text_input("Model", net.get("model", "virtio"), key=f"net_model_{i}_{ni}")
-                with nc3:
-                    net["bridge"] = st.text_input("Bridge", net.get("bridge", "vmbr1"), key=f"net_bridge_{i}_{ni}")
-                with nc4:
-                    net["firewall"] = st.checkbox("Firewall", value=net.get("firewall", True), key=f"net_fw_{i}_{ni}")
-
-            ci = vm.get("cloudinit", {})
-            ci_enabled = st.checkbox("Cloud-init", value=ci.get("enabled", False), key=f"ci_en_{i}")
-            if ci_enabled:
-                ci["enabled"] = True
-                section("cloud-init")
-                c1, c2 = st.columns(2)
-                with c1:
-                    if not ci.get("ipconfig"):
-                        ci["ipconfig"] = [{"interface": "net0", "ip": "", "gateway": ""}]
-                    ci["ipconfig"][0]["interface"] = st.text_input(
-                        "Interface", ci["ipconfig"][0].get("interface", "net0"), key=f"ci_iface_{i}",
-                    )
-                    ci["ipconfig"][0]["ip"] = st.text_input(
-                        "IP/CIDR", ci["ipconfig"][0].get("ip", ""), key=f"ip_{i}",
-                    )
-                    ci["ipconfig"][0]["gateway"] = st.text_input(
-                        "Gateway", ci["ipconfig"][0].get("gateway", ""), key=f"gw_{i}",
-                    )
-                with c2:
-                    ns = st.text_input("DNS", ci.get("nameserver", ""), key=f"ns_{i}")
-                    ci["nameserver"] = ns or None
-                    if not ci["nameserver"]:
-                        ci.pop("nameserver", None)
-                    sd = st.text_input("Domain", ci.get("searchdomain", ""), key=f"sd_{i}")
-                    ci["searchdomain"] = sd or None
-                    if not ci["searchdomain"]:
-                        ci.pop("searchdomain", None)
-                ssh_text = st.text_area(
-                    "SSH keys (one per line)",
-                    value=_sshkeys_to_text(ci.get("sshkeys")),
-                    key=f"sshkeys_{i}",
-                    height=120,
-                )
-                keys = _lines_to_list(ssh_text)
-                if keys:
-                    ci["sshkeys"] = keys
-                else:
-                    ci.pop("sshkeys", None)
-                gw = ci["ipconfig"][0].get("gateway", "")
-                if not gw:
-                    ci["ipconfig"][0].pop("gateway", None)
-                vm["cloudinit"] = ci
-            else:
-                vm.pop("cloudinit", None)
-
-            if vm["name"] == ROUTER_VM:
-                section("router interfaces (template)")
-                st.caption("Configured in pfSense template — stored locally, not in vms.json.")
-                r1, r2 = st.columns(2)
-                with r1:
-                    router_ips["lan"] = st.text_input(
-                        "LAN IP (vmbr1)", router_ips.get("lan", "172.16.10.1/24"), key=f"router_lan_{i}",
-                    )
-                with r2:
-                    router_ips["wan"] = st.text_input(
-                        "WAN IP (vmbr0)", router_ips.get("wan", ""), key=f"router_wan_{i}",
-                        placeholder="e.g. dhcp or 203.0.113.1/24",
-                    )
+        tn = min(len(deps), 2)
+        edited_mark = " · *edited*" if i in edits else ""
+        label = f"`T{tn}` **{vm['name']}** -- {vm.get('clone', '')} -- VMID {vm['vmid']}{edited_mark}"
+        if not st.toggle(label, key=f"vm_open_{i}"):
+            continue
+        with st.container(border=True):
+            draft = copy.deepcopy(vm)
+            render_vm_fields(i, draft, all_names, router_ips)
+        if vm_draft_changed(draft, base_models[i]):
+            edits[i] = draft
+        else:
+            edits.pop(i, None)
 
     if st.button("Save", type="primary", use_container_width=True):
-        data["vms"] = [sanitize_vm(vm) for vm in vms]
-        with open(vms_path, "w") as f:
-            json.dump(data, f, indent=4)
+        changed_idx = sorted(edits)
+        changed, errors = parse_vms([edits[i] for i in changed_idx])
+        if errors:
+            st.error("\n\n".join(errors))
+            return
+        cleaned = list(base_models)
+        for i, vm in zip(changed_idx, changed):
+            cleaned[i] = vm
+        try:
+            expanded = expand_vm_groups(cleaned, [VMGroup.from_dict(g) for g in vm_groups])
+        except ValueError as e:
+            st.error(str(e))
+            return
+        conflicts = validate_vms(expanded, router_ips)
+        if conflicts:
+            render_vm_conflicts(conflicts)
+            return
+        if changed_idx:
+            dump_vms(vms_path, cleaned, data)
         ui_cfg = read_ui_config()
         ui_cfg["router_ips"] = router_ips
         write_ui_config(ui_cfg)
-        st.success("Saved")
+        st.session_state.vm_edits = {}
+        st.success(f"Saved {len(changed_idx)} changed VM(s)")
         st.rerun()
 
 
@@ -2695,15 +2922,22 @@ def page_deploy():
     tf_init = file_exists(os.path.join(TERRAFORM_DIR, ".terraform"))
     run_destroy = st.session_state.get("run_destroy", False)
     job_running = is_deploy_job_running() or is_any_playbook_job_running()
+    conflicts = load_vms_conflicts(vms_path)
+    if conflicts:
+        render_vm_conflicts(conflicts)
+        st.caption("Fix these in the VM Editor before running Plan or Apply.")
 
     section("terraform actions")
     tf_cols = st.columns(4, gap="small")
     with tf_cols[0]:
         init_btn = st.button("Initialize", use_container_width=True, disabled=job_running)
     with tf_cols[1]:
-        plan_btn = st.button("Plan", use_container_width=True, disabled=not tf_init or job_running)
+        plan_btn = st.button("Plan", use_container_width=True, disabled=not tf_init or job_running or bool(conflicts))
     with tf_cols[2]:
-        apply_btn = st.button("Apply", type="primary", use_container_width=True, disabled=not tf_init or job_running)
+        apply_btn = st.button(
+            "Apply", type="primary", use_container_width=True,
+            disabled=not tf_init or job_running or bool(conflicts),
+        )
     with tf_cols[3]:
         destroy_btn = st.button(
             "Destroy", type="primary", key="deploy_destroy",
@@ -2872,6 +3106,169 @@ def _batch_playbooks_tab():
             st.warning("A playbook job is already running.")
 
 
+def render_ansible_profile_picker(disabled: bool):
+    """Select the connection profile ansible_playbook_cmd() applies, with the last benchmark."""
+    config = read_ui_config()
+    current = get_ansible_profile(config)
+    bench = read_profile_bench()
+    results = bench.get("results", {})
+    winner = bench.get("winner")
+
+    def label(name: str) -> str:
+        median = results.get(name, {}).get("median_s")
+        return f"{name} · {median:.2f}s" if median is not None else name
+
+    names = list(ANSIBLE_PROFILES)
+    c1, c2 = st.columns([3, 1], vertical_alignment="bottom")
+    with c1:
+        choice = st.selectbox(
+            "Profile", names, index=names.index(current), format_func=label,
+            key="ansible_profile", disabled=disabled,
+        )
+    with c2:
+        use_winner = st.button(
+            "Use fastest", key="ansible_profile_winner", use_container_width=True,
+            disabled=disabled or not winner or winner == current,
+        )
+    if use_winner:
+        choice = winner
+        st.session_state.pop("ansible_profile", None)
+    if choice != current:
+        config["ansible_profile"] = choice
+        write_ui_config(config)
+        if use_winner:
+            st.rerun()
+
+    env = ANSIBLE_PROFILES[choice]
+    st.caption(" ".join(f"{k}={v}" for k, v in env.items()) or "Ansible defaults")
+    if bench:
+        st.caption(
+            f"Benchmark {bench.get('measured_at', '')}: fastest {winner or '—'} "
+            f"({bench.get('loops')} loops × {bench.get('rounds')} rounds, hosts {bench.get('hosts')})"
+        )
+    else:
+        st.caption("No benchmark yet — run scripts/bench_ansible_profiles.py --save.")
+
+
+def render_playbook_tuning_overrides(disabled: bool):
+    """Per-playbook forks/strategy overrides stored under ``playbook_tuning`` in the UI config."""
+    with st.expander("Forks & strategy per playbook"):
+        config = read_ui_config()
+        overrides = config.get("playbook_tuning", {})
+        pb_file = st.selectbox(
+            "Playbook", [f for f, _, _ in PLAYBOOKS], format_func=playbook_title, key="tuning_pb",
+        )
+        tuning = tune_playbook(pb_file, config=config)
+        st.caption(f"Current: {tuning.summary()}")
+        current = overrides.get(pb_file, {})
+        c1, c2 = st.columns(2)
+        with c1:
+            forks = st.number_input(
+                "Forks (0 = auto)", min_value=0, max_value=200, value=int(current.get("forks", 0)),
+                key=f"tuning_forks_{pb_file}",
+            )
+        with c2:
+            strategies = ["auto", "linear", "free"]
+            strategy = st.selectbox(
+                "Strategy", strategies, index=strategies.index(current.get("strategy", "auto")),
+                key=f"tuning_strategy_{pb_file}",
+            )
+        if st.button("Save override", key="tuning_save", disabled=disabled):
+            entry = {}
+            if forks:
+                entry["forks"] = int(forks)
+            if strategy != "auto":
+                entry["strategy"] = strategy
+            if entry:
+                overrides[pb_file] = entry
+            else:
+                overrides.pop(pb_file, None)
+            config["playbook_tuning"] = overrides
+            write_ui_config(config)
+            st.rerun()
+
+
+def render_artifact_cache(disabled: bool):
+    """Sync/serve the controller artifact cache and point the roles at it."""
+    config = read_ui_config()
+    cache_cfg = config.get("artifact_cache", {})
+    count, size = cache_stats()
+    pid = server_pid()
+    server = f"serving on :{ARTIFACT_PORT} (pid {pid})" if pid else "server stopped"
+    st.caption(f"{count} artifacts · {size / 2**30:.2f} GiB · {server}")
+
+    c1, c2 = st.columns(2)
+    with c1:
+        if st.button("Sync artifacts", key="artifact_sync", disabled=disabled, use_container_width=True):
+            if start_playbook_job(
+                ARTIFACT_SYNC_KEY,
+                f'python3 "{os.path.join(BASE_DIR, "cyberlab_artifacts.py")}" sync',
+                BASE_DIR,
+                "Artifact cache synced",
+                "Artifact sync failed",
+                running_label="Sync artifacts",
+            ):
+                set_ansible_terminal_focus(ARTIFACT_SYNC_KEY, "cyberlab@ansible — artifact cache")
+                st.rerun()
+            else:
+                st.warning("Another job is already running.")
+    with c2:
+        if pid:
+            if st.button("Stop server", key="artifact_stop", use_container_width=True):
+                stop_server()
+                st.rerun()
+        elif st.button("Start server", key="artifact_start", use_container_width=True):
+            start_server()
+            st.rerun()
+
+    default_url = cache_cfg.get("url", "")
+    if not default_url:
+        address = controller_lan_address(get_router_ips())
+        default_url = f"http://{address}:{ARTIFACT_PORT}" if address else ""
+    c1, c2 = st.columns([1, 3], vertical_alignment="bottom")
+    with c1:
+        enabled = st.toggle("Use cache", value=bool(cache_cfg.get("enabled")), key="artifact_enabled", disabled=disabled)
+    with c2:
+        url = st.text_input("Cache URL (reachable from the lab)", value=default_url, key="artifact_url", disabled=disabled)
+    if enabled != bool(cache_cfg.get("enabled")) or (enabled and url.strip() != cache_cfg.get("url", "")):
+        config["artifact_cache"] = {"enabled": enabled, "url": url.strip()}
+        write_ui_config(config)
+    if enabled and not pid:
+        st.warning("Cache enabled but the server is not running — downloads in the roles will fail.")
+
+
+def render_apt_proxy(disabled: bool):
+    """Start/stop the controller caching APT proxy and point the Linux hosts at it."""
+    config = read_ui_config()
+    proxy_cfg = config.get("apt_proxy", {})
+    count, size = cache_usage()
+    pid = proxy_pid()
+    proxy = f"proxy on :{APT_PROXY_PORT} (pid {pid})" if pid else "proxy stopped"
+    st.caption(f"{count} cached files · {size / 2**20:.0f} MiB · {proxy}")
+
+    c1, c2 = st.columns([1, 3], vertical_alignment="bottom")
+    with c1:
+        enabled = st.toggle("Use proxy", value=bool(proxy_cfg.get("enabled")), key="apt_proxy_enabled", disabled=disabled)
+        if pid:
+            if st.button("Stop proxy", key="apt_proxy_stop", use_container_width=True):
+                stop_proxy()
+                st.rerun()
+        elif st.button("Start proxy", key="apt_proxy_start", use_container_width=True):
+            start_proxy()
+            st.rerun()
+    with c2:
+        default_url = proxy_cfg.get("url", "")
+        if not default_url:
+            address = controller_lan_address(get_router_ips())
+            default_url = f"http://{address}:{APT_PROXY_PORT}" if address else ""
+        url = st.text_input("Proxy URL (reachable from the lab)", value=default_url, key="apt_proxy_url", disabled=disabled)
+    if enabled != bool(proxy_cfg.get("enabled")) or (enabled and url.strip() != proxy_cfg.get("url", "")):
+        config["apt_proxy"] = {"enabled": enabled, "url": url.strip()}
+        write_ui_config(config)
+    if apt_proxy_url(config) and not pid:
+        st.warning("Proxy enabled but not running — apt on the Linux hosts will fail until it is started.")
+
+
 def _ansible_stats_panel():
     render_playbook_stats()
 
@@ -2906,8 +3303,23 @@ def page_ansible():
     )
     ansible_terminal()
 
+    section("connection profile")
+    render_ansible_profile_picker(ansible_jobs_busy)
+    render_playbook_tuning_overrides(ansible_jobs_busy)
+
+    section("artifact cache")
+    render_artifact_cache(ansible_jobs_busy)
+
+    section("apt proxy")
+    st.caption("Cache Ubuntu packages on the controller; Linux hosts use it on the next playbook run.")
+    render_apt_proxy(ansible_jobs_busy)
+
     section("ssh")
-    st.caption("Clear stale SSH host keys before connecting to redeployed Linux VMs.")
+    st.caption("Clear stale SSH host keys for every lab host in vms.json before connecting to redeployed VMs.")
+    scan_keys = st.checkbox(
+        "Pre-scan fresh host keys", key="ansible_scan_keys",
+        help="Collect the new keys of all Linux hosts with one concurrent ssh-keyscan run.",
+    )
     if st.button(
         "Clear SSH keys", key="ansible_clean_hosts",
         disabled=ansible_jobs_busy,
@@ -2918,7 +3330,7 @@ def page_ansible():
             os.chmod(CLEAN_HOSTS_SCRIPT, 0o755)
             if start_playbook_job(
                 CLEAN_HOSTS_KEY,
-                f'"{CLEAN_HOSTS_SCRIPT}"',
+                f'"{CLEAN_HOSTS_SCRIPT}"' + (" --scan" if scan_keys else ""),
                 BASE_DIR,
                 "SSH keys cleared",
                 "Failed to clear SSH keys",
@@ -0,0 +1,151 @@
+"""Wazuh -> TheHive forwarder metrics for the cyberlab_ui.py dashboard and the command line.
+
+The w2thive-forwarder service on the XDR host (wazuh_thehive_integration
+role) serves Prometheus-format metrics on port 9787 of its lab LAN
+address. This reads them from the controller and summarises
+received/filtered/forwarded/failed counts, queue depth and TheHive latency
+quantiles. Results are cached in-process for METRICS_TTL seconds.
+
+Usage:
+    python3 cyberlab_w2thive.py [--host 172.16.10.30] [--port 9787] [--json]
+"""
+import argparse
+import json
+import re
+import sys
+import time
+import urllib.request
+from dataclasses import asdict, dataclass, field
+
+from cyberlab_common import VMS_JSON
+from cyberlab_model import VM, load_vms
+
+W2THIVE_METRICS_PORT = 9787
+METRICS_TIMEOUT = 2.0
+METRICS_TTL = 15.0
+
+_SAMPLE_RE = re.compile(r'^(\w+)(?:\{(.*)\})?\s+(\S+)$')
+_LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+_CACHE: dict[tuple, tuple[float, "ForwarderMetrics"]] = {}
+
+
+@dataclass(slots=True)
+class ForwarderMetrics:
+    received: int = 0
+    filtered: int = 0
+    forwarded: int = 0
+    failed: int = 0
+    aggregated: int = 0
+    suppressed: int = 0
+    deferred: int = 0
+    dropped: int = 0
+    retrying: int = 0  # consecutive failed TheHive requests
+    spool_full: bool = False  # ingest paused, the wrapper sends alerts inline
+    uptime: float = 0.0
+    queue: dict[str, int] = field(default_factory=dict)
+    latency_ms: dict[str, float] = field(default_factory=dict)  # "p50"/"p95"/"p99"
+    routes: dict[str, tuple[int, int]] = field(default_factory=dict)  # route -> (forwarded, dropped)
+
+    @property
+    def backlog(self) -> int:
+        return sum(self.queue.values())
+
+
+def parse_metrics(text: str) -> list[tuple[str, dict[str, str], float]]:
+    """(name, labels, value) for every sample in a Prometheus text exposition."""
+    samples = []
+    for line in text.splitlines():
+        match = _SAMPLE_RE.match(line.strip())
+        if not match or line.startswith("#"):
+            continue
+        name, labels, value = match.groups()
+        samples.append((name, dict(_LABEL_RE.findall(labels or "")), float(value)))
+    return samples
+
+
+def summarize(samples: list[tuple[str, dict[str, str], float]]) -> ForwarderMetrics:
+    metrics = ForwarderMetrics()
+    totals = {"received", "forwarded", "failed", "aggregated", "suppressed", "deferred", "dropped"}
+    for name, labels, value in samples:
+        key = name.removeprefix("w2thive_")
+        if key.startswith("alerts_") and key.endswith("_total") and key[7:-6] in totals:
+            setattr(metrics, key[7:-6], int(value))
+        elif key == "alerts_routed_total":
+            forwarded, dropped = metrics.routes.get(labels["route"], (0, 0))
+            if labels["action"] == "drop":
+                dropped = int(value)
+                metrics.filtered += dropped
+            else:
+                forwarded = int(value)
+            metrics.routes[labels["route"]] = (forwarded, dropped)
+        elif key == "thehive_request_seconds" and "quantile" in labels and value == value:
+            metrics.latency_ms[f"p{round(float(labels['quantile']) * 100)}"] = value * 1000
+        elif key == "queue_depth":
+            metrics.queue[labels["stage"]] = int(value)
+        elif key == "thehive_failures_in_row":
+            metrics.retrying = int(value)
+        elif key == "spool_full":
+            metrics.spool_full = bool(value)
+        elif key == "start_time_seconds":
+            metrics.uptime = max(0.0, time.time() - value)
+    return metrics
+
+
+def xdr_address(vms: list[VM] | None = None) -> str:
+    """Address of the first VM with the xdr role (where the forwarder runs), or ''."""
+    if vms is None:
+        vms = load_vms(VMS_JSON)
+    for vm in vms:
+        if "xdr" in vm.roles and vm.primary_ip and vm.primary_ip != "dhcp":
+            return vm.primary_ip
+    return ""
+
+
+def fetch_metrics(
+    host: str,
+    port: int = W2THIVE_METRICS_PORT,
+    timeout: float = METRICS_TIMEOUT,
+    ttl: float = METRICS_TTL,
+) -> ForwarderMetrics:
+    """Scrape the forwarder; reuse a result younger than ``ttl``. Raises OSError when unreachable."""
+    key = (host, port)
+    cached = _CACHE.get(key)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+    with urllib.request.urlopen(f"http://{host}:{port}/metrics", timeout=timeout) as resp:
+        metrics = summarize(parse_metrics(resp.read().decode()))
+    _CACHE[key] = (time.monotonic(), metrics)
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show Wazuh -> TheHive forwarder metrics")
+    parser.add_argument("--host", help="Forwarder address (default: the xdr VM from vms.json)")
+    parser.add_argument("--port", type=int, default=W2THIVE_METRICS_PORT)
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    try:
+        host = args.host or xdr_address()
+        if not host:
+            raise ValueError("no xdr VM with a static address in vms.json; pass --host")
+        metrics = fetch_metrics(host, args.port, ttl=0)
+    except (OSError, ValueError) as e:
+        sys.exit(f"cyberlab_w2thive: {e}")
+    if args.json:
+        print(json.dumps(asdict(metrics) | {"backlog": metrics.backlog}, indent=2))
+        return
+    print(f"received {metrics.received}  filtered {metrics.filtered}  forwarded {metrics.forwarded}  "
+          f"failed {metrics.failed}  aggregated {metrics.aggregated}  suppressed {metrics.suppressed}")
+    print("queue: " + "  ".join(f"{stage} {count}" for stage, count in metrics.queue.items())
+          + f"  (deferred {metrics.deferred}, dropped {metrics.dropped})"
+          + ("  SPOOL FULL: ingest paused" if metrics.spool_full else ""))
+    latency = "  ".join(f"{q} {ms:.0f}ms" for q, ms in metrics.latency_ms.items()) or "no requests yet"
+    print(f"TheHive latency: {latency}" + (f"  backing off after {metrics.retrying} failures" if metrics.retrying else ""))
+    for route, (forwarded, dropped) in sorted(metrics.routes.items()):
+        print(f"  route {route:<16} {forwarded} forwarded, {dropped} dropped")
+
+
+if __name__ == "__main__":
+    main()
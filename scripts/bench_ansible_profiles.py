@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Compare Ansible connection profiles (cyberlab_common.ANSIBLE_PROFILES) by wall-clock time.
+
+Runs a connection-heavy task set (command/stat/copy loops, the pattern of
+the elk_setup and wazuh_agent_setup roles) against stand-in SSH hosts:
+by default N inventory aliases of 127.0.0.1, or any group of a real
+inventory with --inventory/--group. Each profile runs --rounds times and
+the median is reported; --save stores the results in
+.cyberlab/ansible_profile_bench.json so the UI can offer the winner.
+
+Usage:
+    python scripts/bench_ansible_profiles.py [--hosts 4] [--loops 15] [--rounds 3] [--save]
+    python scripts/bench_ansible_profiles.py --inventory ansible/inventory/cyberlab_inventory.py --group linux
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cyberlab_common import ANSIBLE_DIR, ANSIBLE_PROFILES, PROFILE_BENCH_FILE, ensure_cyberlab_dir  # noqa: E402
+
+BENCH_PLAYBOOK = """\
+- name: Connection profile benchmark
+  hosts: "{{ bench_group }}"
+  gather_facts: false
+  become: false
+  vars:
+    bench_dir: "/tmp/cyberlab_bench_{{ inventory_hostname }}"
+  tasks:
+    - name: Prepare scratch directory
+      ansible.builtin.file:
+        path: "{{ bench_dir }}"
+        state: directory
+        mode: "0700"
+
+    - name: Command loop
+      ansible.builtin.command: "echo {{ item }}"
+      loop: "{{ range(bench_loops | int) | list }}"
+      changed_when: false
+
+    - name: Stat loop
+      ansible.builtin.stat:
+        path: /etc/hostname
+      loop: "{{ range(bench_loops | int) | list }}"
+
+    - name: Copy loop
+      ansible.builtin.copy:
+        content: "{{ item }}\\n"
+        dest: "{{ bench_dir }}/{{ item }}"
+        mode: "0600"
+      loop: "{{ range(bench_loops | int) | list }}"
+
+    - name: Remove scratch directory
+      ansible.builtin.file:
+        path: "{{ bench_dir }}"
+        state: absent
+"""
+
+
+def write_standin_inventory(path: str, count: int, address: str, user: str | None):
+    with open(path, "w") as f:
+        f.write("[bench]\n")
+        for i in range(count):
+            f.write(f"bench-{i + 1:02d} ansible_host={address}\n")
+        f.write("\n[bench:vars]\nansible_connection=ssh\nansible_python_interpreter=auto_silent\n")
+        if user:
+            f.write(f"ansible_user={user}\n")
+
+
+def run_profile(profile: str, workdir: str, inventory: str, group: str, loops: int) -> tuple[bool, float, str]:
+    env = os.environ.copy()
+    env["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+    env["ANSIBLE_RETRY_FILES_ENABLED"] = "False"
+    vault_pass = os.path.join(ANSIBLE_DIR, ".vault_pass")
+    if os.path.exists(vault_pass):
+        # A real inventory's group_vars may include the encrypted vault.
+        env.setdefault("ANSIBLE_VAULT_PASSWORD_FILE", vault_pass)
+    env.update(ANSIBLE_PROFILES[profile])
+    cmd = [
+        "ansible-playbook", "-i", inventory, "bench.yml",
+        "-e", f"bench_group={group}", "-e", f"bench_loops={loops}",
+    ]
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=workdir, env=env, capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    tail = (proc.stdout + proc.stderr).strip().splitlines()[-3:]
+    return proc.returncode == 0, elapsed, "\n".join(tail)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--hosts", type=int, default=4, help="Stand-in host aliases to generate")
+    parser.add_argument("--address", default="127.0.0.1", help="SSH address the stand-in hosts point at")
+    parser.add_argument("--user", help="SSH user for the stand-in hosts")
+    parser.add_argument("--inventory", help="Use this inventory instead of generated stand-ins")
+    parser.add_argument("--group", default="bench", help="Inventory group to run against")
+    parser.add_argument("--loops", type=int, default=15, help="Items per task loop")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--profiles", nargs="*", default=list(ANSIBLE_PROFILES), choices=list(ANSIBLE_PROFILES))
+    parser.add_argument("--save", action="store_true", help=f"Write results to {PROFILE_BENCH_FILE}")
+    args = parser.parse_args()
+
+    if not shutil.which("ansible-playbook"):
+        sys.exit("ansible-playbook not found in PATH")
+
+    with tempfile.TemporaryDirectory(prefix="cyberlab-bench-") as workdir:
+        with open(os.path.join(workdir, "bench.yml"), "w") as f:
+            f.write(BENCH_PLAYBOOK)
+        inventory = os.path.abspath(args.inventory) if args.inventory else os.path.join(workdir, "hosts.ini")
+        if not args.inventory:
+            write_standin_inventory(inventory, args.hosts, args.address, args.user)
+
+        results = {}
+        for profile in args.profiles:
+            runs = []
+            ok = True
+            for _ in range(args.rounds):
+                passed, elapsed, tail = run_profile(profile, workdir, inventory, args.group, args.loops)
+                if not passed:
+                    ok = False
+                    print(f"{profile}: run failed\n{tail}", file=sys.stderr)
+                    break
+                runs.append(round(elapsed, 3))
+            median = statistics.median(runs) if runs else None
+            results[profile] = {"ok": ok, "runs": runs, "median_s": median}
+            shown = f"{median:.2f}s" if ok else "failed"
+            print(f"{profile:<28} {shown:>8}  runs={runs}")
+
+    passing = {name: r["median_s"] for name, r in results.items() if r["ok"]}
+    winner = min(passing, key=passing.get) if passing else None
+    if winner:
+        base = passing.get("default")
+        gain = f" ({(1 - passing[winner] / base) * 100:.0f}% faster than default)" if base else ""
+        print(f"\nFastest: {winner}{gain}")
+
+    if args.save:
+        ensure_cyberlab_dir()
+        with open(PROFILE_BENCH_FILE, "w") as f:
+            json.dump({
+                "measured_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "hosts": args.group if args.inventory else args.hosts,
+                "loops": args.loops,
+                "rounds": args.rounds,
+                "results": results,
+                "winner": winner,
+            }, f, indent=4)
+        print(f"Saved to {PROFILE_BENCH_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""Time load + validate of a synthetic vms.json with many VMs.
+
+Usage: python scripts/bench_vms_model.py [--vms 1000] [--rounds 20]
+"""
+import argparse
+import copy
+import ipaddress
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from cyberlab_common import validate_vms  # noqa: E402
+from cyberlab_model import _CACHE, load_vms  # noqa: E402
+
+
+def build_fleet(count: int) -> dict:
+    with open(os.path.join(ROOT, "terraform", "vms.json.example")) as f:
+        base = json.load(f)["vms"]
+    seed = next(vm for vm in base if vm["name"] == "LIN-01-WS")
+    network = ipaddress.ip_network("10.0.0.0/16")
+    vms = []
+    for i in range(count):
+        vm = copy.deepcopy(seed)
+        vm["name"] = f"LIN-{i + 1:04d}-WS"
+        vm["vmid"] = 1000 + i
+        vm["depends_on"] = []
+        vm["cloudinit"]["ipconfig"][0]["ip"] = f"{network[i + 10]}/16"
+        vm["cloudinit"]["ipconfig"][0]["gateway"] = "10.0.0.1"
+        vms.append(vm)
+    return {"vms": vms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--vms", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    router_ips = {"lan": "10.0.0.1/16", "wan": ""}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vms.json")
+        with open(path, "w") as f:
+            json.dump(build_fleet(args.vms), f, indent=4)
+
+        cold = []
+        for _ in range(args.rounds):
+            _CACHE.clear()
+            start = time.perf_counter()
+            vms = load_vms(path)
+            conflicts = validate_vms(vms, router_ips)
+            cold.append(time.perf_counter() - start)
+
+        warm = []
+        hits = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            vms = load_vms(path)
+            hits.append(time.perf_counter() - start)
+            validate_vms(vms, router_ips)
+            warm.append(time.perf_counter() - start)
+
+    cold.sort()
+    warm.sort()
+    hits.sort()
+    print(f"{args.vms} VMs, {args.rounds} rounds, {len(conflicts)} conflicts")
+    print(f"  cold load+validate: median {cold[len(cold) // 2] * 1000:.1f} ms, best {cold[0] * 1000:.1f} ms")
+    print(f"  warm load+validate: median {warm[len(warm) // 2] * 1000:.1f} ms, best {warm[0] * 1000:.1f} ms")
+    print(f"  warm load only:     median {hits[len(hits) // 2] * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
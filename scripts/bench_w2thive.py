@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""Offline throughput benchmark for the Wazuh -> TheHive integration.
+
+Builds a synthetic corpus of Wazuh alerts (Suricata ``ids``, Sysmon with a
+varying number of eventdata fields, sshd syslog) and runs the real
+custom-w2thive.py / w2thive-forwarder.py from a temporary /var/ossec-like
+tree against a local TheHive API stub (a subprocess) that records requests
+and injects latency and errors.
+
+``run`` reports two things:
+- per-stage CPU time and peak allocations per alert, one alert at a time:
+  route, flatten (the old ``pr``), md_format, observables (the old
+  ``artifact_detect``), generate_alert, jsonify and the HTTP post;
+- end-to-end alerts/sec of the forwarder (spool -> workers -> stub),
+  including retries of the injected errors, with its CPU time and RSS.
+
+Needs requests and thehive4py (``pip install requests thehive4py==1.8.1``).
+
+Usage:
+    python scripts/bench_w2thive.py run [--alerts 2000] [--latency-ms 20] [--error-rate 0.05] [--workers 4]
+    python scripts/bench_w2thive.py corpus alerts.json [--alerts 2000]
+    python scripts/bench_w2thive.py stub [--port 9000] [--latency-ms 20] [--error-rate 0.05]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FILES_DIR = os.path.join(ROOT, "ansible", "roles", "wazuh_thehive_integration", "files")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_w2thive_format import base_alert, suricata_alert, sysmon_alert  # noqa: E402
+
+STAGES = ("route", "flatten", "md_format", "observables", "generate_alert", "jsonify", "http")
+EXTERNAL_IPS = [f"203.0.113.{i}" for i in range(1, 40)] + [f"198.51.100.{i}" for i in range(1, 20)]
+LAB_IPS = [f"172.16.10.{i}" for i in range(20, 60)]
+SYSMON_RULES = [
+    ("92052", "Powershell process spawned with encoded command"),
+    ("92213", "Executable dropped in folder commonly used by malware"),
+    ("61603", "Sysmon - Suspicious Process - svchost.exe"),
+]
+
+
+# ---------------------------------------------------------------------------
+# Corpus
+# ---------------------------------------------------------------------------
+
+def syslog_alert(rng: random.Random) -> dict:
+    brute = rng.random() < 0.3
+    rule_id, level, description = ("5712", 10, "sshd: brute force trying to get access to the system") if brute \
+        else ("5710", 5, "sshd: Attempt to login using a non-existent user")
+    alert = base_alert(rule_id, level, description, ["syslog", "sshd", "authentication_failed"])
+    alert["agent"] = {"id": "007", "name": "LNX-01-SRV", "ip": "172.16.10.50"}
+    alert["decoder"] = {"parent": "sshd", "name": "sshd"}
+    alert["location"] = "/var/log/auth.log"
+    src, user = rng.choice(EXTERNAL_IPS), rng.choice(["admin", "oracle", "test", "ubuntu"])
+    alert["data"] = {"srcip": src, "srcport": str(rng.randint(1024, 65535)), "srcuser": user}
+    alert["full_log"] = f"Oct 19 10:15:42 LNX-01-SRV sshd[{rng.randint(1000, 9999)}]: Invalid user {user} from {src} port 51544"
+    return alert
+
+
+def make_corpus(count: int, seed: int = 1) -> list[dict]:
+    """Deterministic mix: 40% Suricata, 40% Sysmon (0-200 extra fields), 20% sshd."""
+    rng = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(hours=1)
+    corpus = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.4:
+            alert = suricata_alert()
+            data = alert["data"]
+            data["src_ip"] = data["flow"]["src_ip"] = rng.choice(LAB_IPS)
+            data["dest_ip"] = data["flow"]["dest_ip"] = rng.choice(EXTERNAL_IPS)
+            data["alert"]["severity"] = str(rng.choice((1, 2, 2, 3)))
+        elif kind < 0.8:
+            alert = sysmon_alert(rng.choice((0, 0, 10, 50, 200)))
+            alert["rule"]["id"], alert["rule"]["description"] = rng.choice(SYSMON_RULES)
+            eventdata = alert["data"]["win"]["eventdata"]
+            eventdata["commandLine"] = eventdata["commandLine"].replace("198.51.100.7", rng.choice(EXTERNAL_IPS))
+        else:
+            alert = syslog_alert(rng)
+        alert["timestamp"] = (start + timedelta(milliseconds=10 * i)).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "+0000"
+        alert["id"] = f"{int(start.timestamp())}.{i}"
+        corpus.append(alert)
+    return corpus
+
+
+# ---------------------------------------------------------------------------
+# TheHive stub
+# ---------------------------------------------------------------------------
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, each reply would
+    # wait ~40 ms for the client's delayed ACK and swamp --latency-ms.
+    disable_nagle_algorithm = True
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def reply(self, code: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.reply(200, dict(self.server.stats, unique_refs=len(self.server.refs)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        server = self.server
+        if server.latency:
+            time.sleep(server.rng.expovariate(1 / server.latency))
+        with server.lock:
+            failed = server.rng.random() < server.error_rate
+            server.stats["requests"] += 1
+            server.stats["bytes"] += len(body)
+            if failed:
+                server.stats["errors"] += 1
+            else:
+                alert = json.loads(body)
+                server.stats["artifacts"] += len(alert.get("artifacts", []))
+                if alert.get("sourceRef") in server.refs:
+                    server.stats["duplicates"] += 1
+                server.refs.add(alert.get("sourceRef"))
+                server.stats["created"] += 1
+            number = server.stats["requests"]
+        if failed:
+            self.reply(503, {"type": "ServiceUnavailable", "message": "injected error"})
+        else:
+            self.reply(201, {"id": f"~{number}"})
+
+
+def serve_stub(port: int, latency_ms: float, error_rate: float, seed: int = 1):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency_ms / 1000
+    server.error_rate = error_rate
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    server.refs = set()
+    server.stats = {"requests": 0, "created": 0, "errors": 0, "duplicates": 0, "artifacts": 0, "bytes": 0}
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+def start_stub(latency_ms: float, error_rate: float) -> tuple[subprocess.Popen, str]:
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "stub", "--port", "0",
+         "--latency-ms", str(latency_ms), "--error-rate", str(error_rate)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    return proc, f"http://127.0.0.1:{proc.stdout.readline().strip()}"
+
+
+def stub_stats(url: str) -> dict:
+    import requests
+
+    return requests.get(url, timeout=5).json()
+
+
+# ---------------------------------------------------------------------------
+# Integration under test
+# ---------------------------------------------------------------------------
+
+def load_module(name: str, path: str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def ossec_tree(base: str, url: str, window: int, workers: int) -> dict:
+    """Lay out integrations/, logs/ and etc/w2thive.json like /var/ossec; returns the forwarder config."""
+    for name in ("integrations", "logs", "etc", "queue"):
+        os.makedirs(os.path.join(base, name))
+    for name in ("custom-w2thive.py", "w2thive_format.py", "w2thive_enrich.py", "w2thive-forwarder.py"):
+        shutil.copy(os.path.join(FILES_DIR, name), os.path.join(base, "integrations", name))
+    # Enrichment without GeoIP databases: lab assets plus one known-bad list.
+    known_bad = os.path.join(base, "etc", "bench-blocklist.txt")
+    with open(known_bad, "w") as f:
+        f.write("\n".join(EXTERNAL_IPS[::5]) + "\n198.51.100.0/28\n")
+    config = {
+        "thehive_url": url,
+        "api_key": "bench",
+        "queue_dir": os.path.join(base, "queue", "w2thive"),
+        "integration": os.path.join(base, "integrations", "custom-w2thive.py"),
+        "workers": workers,
+        "aggregate_window": window,
+        "retry_base": 0.05,
+        "retry_max_delay": 1,
+        "metrics_port": 0,
+        "enrichment": {
+            "assets": {ip: f"LAB-{i:02d}" for i, ip in enumerate(LAB_IPS)},
+            "known_bad": [known_bad],
+        },
+    }
+    with open(os.path.join(base, "etc", "w2thive.json"), "w") as f:
+        json.dump(config, f)
+    return config
+
+
+def stage_costs(integration, alerts: list[dict], url: str, trace_memory: bool = False) -> dict[str, list[int]]:
+    """Per stage: [alerts that reached it, CPU ns, wall ns, peak traced bytes]."""
+    import requests
+
+    session = requests.Session()
+    session.headers.update({"Authorization": "Bearer bench", "Content-Type": "application/json"})
+    costs = {stage: [0, 0, 0, 0] for stage in STAGES}
+    cpu, wall = time.thread_time_ns, time.perf_counter_ns
+
+    def timed(stage, func, *args):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        c0, w0 = cpu(), wall()
+        result = func(*args)
+        c1, w1 = cpu(), wall()
+        entry = costs[stage]
+        entry[0] += 1
+        entry[1] += c1 - c0
+        entry[2] += w1 - w0
+        if trace_memory:
+            entry[3] = max(entry[3], tracemalloc.get_traced_memory()[1] - base)
+        return result
+
+    for alert in alerts:
+        alert = json.loads(json.dumps(alert))
+        _, forward = timed("route", integration.route_alert, alert)
+        if not forward:
+            continue
+        entries = timed("flatten", lambda a: list(integration.flatten_alert(a)), alert)
+        description = timed("md_format", integration.md_format, entries)
+        observables = timed("observables", integration.extract_observables, entries)
+        thehive_alert = timed("generate_alert", integration.generate_alert, description, observables, alert)
+        payload = timed("jsonify", lambda a: a.jsonify(excludes=["id"]), thehive_alert)
+        timed("http", lambda p: session.post(f"{url}/api/alert", data=p, timeout=10), payload)
+    session.close()
+    return costs
+
+
+def run_forwarder(forwarder_mod, integration, config: dict, alerts: list[dict]) -> dict:
+    """Spool the corpus, run the forwarder until it is drained, return timings."""
+    forwarder = forwarder_mod.Forwarder(dict(forwarder_mod.DEFAULTS, **config), integration)
+    for handler in integration.logger.handlers:
+        forwarder_mod.logger.addHandler(handler)
+    new_dir = os.path.join(config["queue_dir"], "new")
+    os.makedirs(new_dir)
+    for i, alert in enumerate(alerts):
+        with open(os.path.join(new_dir, f"{i:08d}"), "w") as f:
+            json.dump(alert, f)
+
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    thread = threading.Thread(target=forwarder.run)
+    thread.start()
+    spool = [os.path.join(config["queue_dir"], name) for name in ("new", "cur", "retry")]
+    while True:
+        time.sleep(0.05)
+        with forwarder.lock:
+            busy = forwarder.pending or forwarder.retrying
+        if not busy and forwarder.queue.unfinished_tasks == 0 and not any(os.listdir(d) for d in spool if os.path.isdir(d)):
+            break
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+    forwarder.stopping.set()
+    thread.join()
+    return {"wall": wall, "cpu": cpu, "deferred": forwarder.deferred, "aggregated": forwarder.aggregated,
+            "suppressed": forwarder.suppressed, "latencies": sorted(forwarder.latencies)}
+
+
+def max_rss_mib() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 1024
+
+
+def quantile(values: list[float], q: float) -> float:
+    return values[round(q * (len(values) - 1))] if values else float("nan")
+
+
+def bench(args):
+    try:
+        import requests  # noqa: F401
+        import thehive4py  # noqa: F401
+    except ImportError as e:
+        sys.exit(f"bench_w2thive: {e.name} is required (pip install requests thehive4py==1.8.1)")
+
+    alerts = make_corpus(args.alerts, args.seed)
+    stub, url = start_stub(args.latency_ms, args.error_rate)
+    try:
+        with tempfile.TemporaryDirectory(prefix="w2thive-bench-") as base:
+            config = ossec_tree(base, url, args.window, args.workers)
+            integration = load_module("custom_w2thive", config["integration"])
+            forwarder_mod = load_module("w2thive_forwarder", os.path.join(base, "integrations", "w2thive-forwarder.py"))
+
+            fields = sum(sum(1 for _ in integration.flatten_alert(a)) for a in alerts)
+            print(f"corpus: {len(alerts)} alerts, {fields / len(alerts):.0f} fields/alert on average; "
+                  f"stub latency {args.latency_ms:g} ms, error rate {args.error_rate:.0%}")
+
+            costs = stage_costs(integration, alerts, url)
+            tracemalloc.start()
+            memory = stage_costs(integration, alerts[:args.memory_sample], url, trace_memory=True)
+            tracemalloc.stop()
+            print(f"\n{'stage':<16} {'alerts':>7} {'cpu/alert':>11} {'wall/alert':>11} {'peak alloc':>11}")
+            for stage in STAGES:
+                n, cpu_ns, wall_ns, _ = costs[stage]
+                peak = memory[stage][3]
+                if n:
+                    print(f"{stage:<16} {n:>7} {cpu_ns / n / 1000:>9.1f}us {wall_ns / n / 1000:>9.1f}us {peak / 1024:>8.1f}KiB")
+            cpu_total = sum(c[1] for c in costs.values()) / 1e9
+            print(f"{'total':<16} {len(alerts):>7} {cpu_total:>10.3f}s cpu ({len(alerts) / cpu_total:,.0f} alerts per CPU second)")
+
+            stats_before = stub_stats(url)
+            result = run_forwarder(forwarder_mod, integration, config, alerts)
+            stats = {k: stub_stats(url)[k] - stats_before.get(k, 0) for k in stats_before}
+            lat = result["latencies"]
+            print(f"\nforwarder ({args.workers} workers, window {args.window}s): {len(alerts)} alerts in "
+                  f"{result['wall']:.2f}s = {len(alerts) / result['wall']:,.0f} alerts/s, "
+                  f"cpu {result['cpu']:.2f}s, max RSS {max_rss_mib():.0f} MiB")
+            print(f"thehive stub: {stats['requests']} requests, {stats['created']} created, {stats['errors']} injected errors, "
+                  f"{stats['duplicates']} duplicate refs, {stats['artifacts']} artifacts, {stats['bytes'] / 2**20:.1f} MiB")
+            print(f"retries: {result['deferred']} deferred; aggregated {result['aggregated']}, suppressed {result['suppressed']}; "
+                  f"latency p50 {quantile(lat, 0.5) * 1000:.1f}ms p95 {quantile(lat, 0.95) * 1000:.1f}ms "
+                  f"p99 {quantile(lat, 0.99) * 1000:.1f}ms")
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Wazuh -> TheHive integration benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Benchmark stages and the forwarder against the stub")
+    run.add_argument("--alerts", type=int, default=2000)
+    run.add_argument("--latency-ms", type=float, default=20, help="Mean stub latency (exponential)")
+    run.add_argument("--error-rate", type=float, default=0.05, help="Fraction of requests answered 503")
+    run.add_argument("--workers", type=int, default=4)
+    run.add_argument("--window", type=int, default=0, help="aggregate_window for the forwarder run")
+    run.add_argument("--memory-sample", type=int, default=200, help="Alerts traced for peak allocations")
+    run.add_argument("--seed", type=int, default=1)
+    corpus = sub.add_parser("corpus", help="Write the synthetic corpus as alerts.json lines")
+    corpus.add_argument("path")
+    corpus.add_argument("--alerts", type=int, default=2000)
+    corpus.add_argument("--seed", type=int, default=1)
+    stub = sub.add_parser("stub", help="Run the TheHive API stub (GET / returns its counters)")
+    stub.add_argument("--port", type=int, default=9000)
+    stub.add_argument("--latency-ms", type=float, default=20)
+    stub.add_argument("--error-rate", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        bench(args)
+    elif args.command == "corpus":
+        with open(args.path, "w") as f:
+            for alert in make_corpus(args.alerts, args.seed):
+                f.write(json.dumps(alert) + "\n")
+        print(f"Wrote {args.alerts} alerts to {args.path}")
+    else:
+        try:
+            serve_stub(args.port, args.latency_ms, args.error_rate)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
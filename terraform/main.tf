@@ -1,6 +1,15 @@
-# Read VM configuration from JSON file
+# Read VM configuration from JSON file.
+# cyberlab_model.py expands "vm_groups" into concrete VMs (bulk VMID/IP
+# allocation) so Terraform, Ansible and the UI all see the same VM list.
+data "external" "vms" {
+  program = ["python3", "${abspath(path.module)}/../cyberlab_model.py", "--terraform"]
+  query = {
+    path = abspath("${path.module}/vms.json")
+  }
+}
+
 locals {
-  vm_config = jsondecode(file("${path.module}/vms.json"))
+  vm_config = jsondecode(data.external.vms.result.vms)
   vms       = { for vm in local.vm_config.vms : vm.name => vm }
   
   # Map templates to their default usernames
@@ -4,6 +4,10 @@ terraform {
       source = "telmate/proxmox"
       version = "3.0.2-rc07"
     }
+    external = {
+      source  = "hashicorp/external"
+      version = "~> 2.3"
+    }
   }
 }
 